@@ -0,0 +1,33 @@
+import threading
+
+from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+
+
+class QueryCounter:
+    """Count of db queries run by all threads of benchmarked server process."""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+
+db_queries = QueryCounter()
+
+
+def count_queries(sender, connection, **kwargs):
+    # Signal is sent again whenever closed connection of a thread is reopened.
+    if db_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(db_queries)
+
+
+class BenchmarksConfig(AppConfig):
+    name = 'benchmarks'
+
+    def ready(self):
+        connection_created.connect(count_queries)
@@ -0,0 +1,159 @@
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+GRAPHQL_REPOSITORY_FIELD = re.compile(r'(\w+): repository\(owner: \$(\w+), name: \$(\w+)\)')
+
+
+class FakeGithubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        time.sleep(server.latency)
+        if server.fails():
+            return self.send_json(502, {"message": "Server Error"})
+        if self.path == '/rate_limit':
+            # Not counted against rate limit.
+            resources = {}
+            for resource in ('core', 'graphql'):
+                _, headers = server.consume_rate_limit(self.token, resource, consume=False)
+                resources[resource] = {"limit": int(headers['X-RateLimit-Limit']),
+                                       "remaining": int(headers['X-RateLimit-Remaining']),
+                                       "reset": int(headers['X-RateLimit-Reset'])}
+            return self.send_json(200, {"resources": resources})
+        match = re.match(r'^/repos/([^/]+/[^/]+)$', self.path)
+        repo = server.repos.get(match.group(1)) if match else None
+        etag = server.etag(repo) if repo is not None else None
+        if etag is not None and self.headers.get('If-None-Match') == etag:
+            # Conditional requests answered with 304 are not counted against rate limit.
+            _, rate_limit_headers = server.consume_rate_limit(self.token, 'core', consume=False)
+            return self.send_json(304, None, dict(rate_limit_headers, ETag=etag))
+        within_limit, rate_limit_headers = server.consume_rate_limit(self.token, 'core')
+        if not within_limit:
+            return self.send_json(403, {"message": "API rate limit exceeded"}, rate_limit_headers)
+        if repo is None:
+            return self.send_json(404, {"message": "Not Found"}, rate_limit_headers)
+        num_stars, num_forks = repo
+        if etag is not None:
+            rate_limit_headers['ETag'] = etag
+        return self.send_json(200, {"stargazers_count": num_stars, "forks": num_forks}, rate_limit_headers)
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        time.sleep(server.latency)
+        if self.path != '/graphql':
+            return self.send_json(404, {"message": "Not Found"})
+        if server.fails():
+            return self.send_json(502, {"message": "Server Error"})
+        variables = body.get('variables', {})
+        data, errors = {}, []
+        for alias, owner_variable, name_variable in GRAPHQL_REPOSITORY_FIELD.findall(body['query']):
+            repo_name = f"{variables[owner_variable]}/{variables[name_variable]}"
+            repo = server.repos.get(repo_name)
+            if repo is None:
+                data[alias] = None
+                errors.append({"type": "NOT_FOUND", "path": [alias],
+                               "message": f"Could not resolve to a Repository with the name '{repo_name}'."})
+            else:
+                data[alias] = {"stargazerCount": repo[0], "forkCount": repo[1]}
+        payload = {"data": data}
+        if errors:
+            payload["errors"] = errors
+        within_limit, rate_limit_headers = server.consume_rate_limit(self.token, 'graphql')
+        if not within_limit:
+            return self.send_json(403, {"message": "API rate limit exceeded"}, rate_limit_headers)
+        return self.send_json(200, payload, rate_limit_headers)
+
+    @property
+    def token(self):
+        return (self.headers.get('Authorization') or '').split(' ')[-1]
+
+    def send_json(self, status_code, payload, headers=None):
+        self.server.record_call(status_code)
+        body = json.dumps(payload).encode() if payload is not None else b''
+        self.send_response(status_code)
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+        if body:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeGithubServer(ThreadingHTTPServer):
+    """
+    Local stand-in of Github Api for tests and benchmarks. Serves REST GET /repos/<owner>/<name>, /rate_limit
+    and aliased GraphQL repository queries from `repos` = {repo_name: (num_stars, num_forks)}.
+    Answers after `latency` seconds, fails `error_rate` of calls with 502, answers If-None-Match with 304
+    when `etags` are on and sends X-RateLimit-* headers of `rate_limit` calls per `rate_limit_window` per token.
+    """
+    daemon_threads = True
+
+    def __init__(self, repos=None, latency=0, error_rate=0, etags=True, rate_limit=5000, rate_limit_window=3600,
+                 seed=None):
+        super().__init__(('127.0.0.1', 0), FakeGithubHandler)
+        self.repos = repos or {}
+        self.latency = latency
+        self.error_rate = error_rate
+        self.etags = etags
+        self.rate_limit = rate_limit
+        self.rate_limit_window = rate_limit_window
+        self.calls = 0
+        self.calls_by_status = Counter()
+        self._random = random.Random(seed)
+        self._budgets = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address
+        return f'http://{host}:{port}'
+
+    def record_call(self, status_code):
+        with self._lock:
+            self.calls += 1
+            self.calls_by_status[status_code] += 1
+
+    def fails(self):
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def etag(self, repo):
+        return f'W/"{repo[0]}-{repo[1]}"' if self.etags else None
+
+    def consume_rate_limit(self, token, resource, consume=True):
+        """
+        Returns (call within rate limit, X-RateLimit-* headers after the call) for token.
+        Budget is renewed every rate_limit_window seconds.
+        """
+        now = int(time.time())
+        with self._lock:
+            remaining, reset = self._budgets.get((token, resource), (self.rate_limit, now + self.rate_limit_window))
+            if reset <= now:
+                remaining, reset = self.rate_limit, now + self.rate_limit_window
+            within_limit = remaining > 0
+            if consume and within_limit:
+                remaining -= 1
+            self._budgets[(token, resource)] = remaining, reset
+        return within_limit, {'X-RateLimit-Limit': str(self.rate_limit), 'X-RateLimit-Remaining': str(remaining),
+                              'X-RateLimit-Reset': str(reset), 'X-RateLimit-Resource': resource}
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,102 @@
+import socketserver
+import threading
+import time
+
+
+class FakeMemcachedHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command, *arguments = line.decode().split()
+            handler = getattr(self, f'command_{command}', None)
+            if handler is None:
+                self.wfile.write(b'ERROR\r\n')
+            else:
+                handler(*arguments)
+
+    def command_get(self, *keys):
+        for key in keys:
+            item = self.server.get_item(key)
+            if item is not None:
+                flags, value = item
+                self.wfile.write(f'VALUE {key} {flags} {len(value)}\r\n'.encode() + value + b'\r\n')
+        self.wfile.write(b'END\r\n')
+
+    command_gets = command_get
+
+    def store(self, key, flags, exptime, length, only_new):
+        value = self.rfile.read(int(length) + 2)[:-2]
+        with self.server.lock:
+            if only_new and self.server.get_item(key) is not None:
+                self.wfile.write(b'NOT_STORED\r\n')
+                return
+            self.server.items[key] = int(flags), value, self.server.expires_at(int(exptime))
+        self.wfile.write(b'STORED\r\n')
+
+    def command_set(self, key, flags, exptime, length):
+        self.store(key, flags, exptime, length, only_new=False)
+
+    def command_add(self, key, flags, exptime, length):
+        self.store(key, flags, exptime, length, only_new=True)
+
+    def command_delete(self, key, *arguments):
+        with self.server.lock:
+            deleted = self.server.items.pop(key, None) is not None
+        self.wfile.write(b'DELETED\r\n' if deleted else b'NOT_FOUND\r\n')
+
+    def command_touch(self, key, exptime):
+        with self.server.lock:
+            item = self.server.get_item(key)
+            if item is not None:
+                self.server.items[key] = item[0], item[1], self.server.expires_at(int(exptime))
+        self.wfile.write(b'TOUCHED\r\n' if item is not None else b'NOT_FOUND\r\n')
+
+    def command_flush_all(self, *arguments):
+        with self.server.lock:
+            self.server.items.clear()
+        self.wfile.write(b'OK\r\n')
+
+    def command_version(self):
+        self.wfile.write(b'VERSION fake\r\n')
+
+
+class FakeMemcachedServer(socketserver.ThreadingTCPServer):
+    """Local stand-in of memcached text protocol (get, set, add, delete, touch, flush_all) for tests."""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeMemcachedHandler)
+        self.items = {}
+        self.lock = threading.RLock()
+
+    @property
+    def location(self):
+        host, port = self.server_address
+        return f'{host}:{port}'
+
+    @staticmethod
+    def expires_at(exptime):
+        return time.time() + exptime if exptime else None
+
+    def get_item(self, key):
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return None
+            flags, value, expires_at = item
+            if expires_at is not None and expires_at <= time.time():
+                del self.items[key]
+                return None
+            return flags, value
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
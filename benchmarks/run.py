@@ -0,0 +1,253 @@
+"""
+Load benchmark of the Api served by WSGI (threaded runserver, sync views) and ASGI (uvicorn, async views).
+Github is replaced by local fake with configurable latency, error rate, ETag/304 answers and rate limit.
+Every endpoint is driven at fixed concurrency and reported with requests per second, p50/p95/p99 latency,
+Github calls per request and db queries per request. Results saved with --output are diffed with --compare.
+
+    python -m benchmarks.run --concurrency 64 --requests 2000 --github-latency 0.1 --output after.json \\
+        --compare before.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+import httpx
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+HOST = '127.0.0.1'
+
+SERVERS = {
+    'wsgi': [sys.executable, 'manage.py', 'runserver', '{host}:{port}', '--noreload', '--insecure'],
+    'asgi': [sys.executable, '-m', 'uvicorn', 'repos.asgi:application', '--host', '{host}', '--port', '{port}',
+             '--lifespan', 'off', '--no-access-log', '--log-level', 'warning'],
+}
+
+ENDPOINTS = {
+    'list': lambda repo_ids, number: '/api/v1/repos/',
+    'popular': lambda repo_ids, number: f'/api/v1/repos/{repo_ids[number % len(repo_ids)]}/popular/',
+    'health_check': lambda repo_ids, number: '/health_check/',
+}
+
+# Compared metrics, True when higher value is better.
+METRICS = {
+    'rps': True,
+    'p50_ms': False,
+    'p95_ms': False,
+    'p99_ms': False,
+    'upstream_calls_per_request': False,
+    'db_queries_per_request': False,
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((HOST, port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'Server did not start listening on {HOST}:{port} in {timeout}s')
+
+
+def prepare_database(repo_names):
+    """Migrate benchmark database, create user with token and repos. Returns (token, repo ids)."""
+    import django
+    django.setup()
+    from django.contrib.auth.models import User
+    from django.core.management import call_command
+    from rest_framework.authtoken.models import Token
+
+    from popularity.models import Repo
+
+    call_command('migrate', verbosity=0)
+    user = User.objects.create_user('benchmark', password='benchmark')
+    token = Token.objects.create(user=user)
+    Repo.objects.bulk_create([Repo(name=name) for name in repo_names])
+    return token.key, list(Repo.objects.exclude(name='facebook/react').values_list('id', flat=True))
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0
+
+
+async def load(client, path_for, concurrency, requests):
+    """Send `requests` GETs from `concurrency` concurrent clients. Returns rps, latency percentiles and statuses."""
+    latencies, statuses = [], Counter()
+    numbers = iter(range(requests))
+
+    async def send():
+        for number in numbers:
+            started = time.perf_counter()
+            try:
+                response = await client.get(path_for(number))
+                statuses[str(response.status_code)] += 1
+            except httpx.HTTPError as exc:
+                statuses[type(exc).__name__] += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(send() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        'requests': requests,
+        'rps': round(requests / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+        'statuses': dict(statuses),
+    }
+
+
+async def measure(base_url, token, repo_ids, github, args):
+    """Warm up and measure every endpoint, Github calls and db queries are counted around the measured run."""
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    results = {}
+    async with httpx.AsyncClient(base_url=base_url, headers={'Authorization': f'Token {token}'}, timeout=60,
+                                 limits=limits) as client:
+        for endpoint in args.endpoints:
+
+            def path_for(number):
+                return ENDPOINTS[endpoint](repo_ids, number)
+
+            if args.warmup:
+                await load(client, path_for, args.concurrency, args.warmup)
+            upstream_before = Counter(github.calls_by_status)
+            db_queries_before = (await client.get('/benchmark/stats/')).json()['db_queries']
+            result = await load(client, path_for, args.concurrency, args.requests)
+            db_queries = (await client.get('/benchmark/stats/')).json()['db_queries'] - db_queries_before
+            upstream = Counter(github.calls_by_status)
+            upstream.subtract(upstream_before)
+            result['upstream_calls'] = {str(status_code): calls for status_code, calls in upstream.items() if calls}
+            result['upstream_calls_per_request'] = round(sum(upstream.values()) / args.requests, 3)
+            result['db_queries_per_request'] = round(db_queries / args.requests, 3)
+            results[endpoint] = result
+    return results
+
+
+def run_server(name, env, token, repo_ids, github, args):
+    port = free_port()
+    command = [part.format(host=HOST, port=port) for part in SERVERS[name]]
+    server = subprocess.Popen(command, cwd=BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+        return asyncio.run(measure(f'http://{HOST}:{port}', token, repo_ids, github, args))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def compare(baseline, current):
+    """Rows (server, endpoint, metric, baseline value, current value, change %, regression) of both reports."""
+    rows = []
+    for server_name, endpoints in current['results'].items():
+        for endpoint, result in endpoints.items():
+            baseline_result = baseline['results'].get(server_name, {}).get(endpoint)
+            if baseline_result is None:
+                continue
+            for metric, higher_is_better in METRICS.items():
+                before, after = baseline_result.get(metric), result.get(metric)
+                if before is None or after is None:
+                    continue
+                change = round((after - before) * 100 / before, 1) if before else None
+                regression = change is not None and (change < 0 if higher_is_better else change > 0)
+                rows.append((server_name, endpoint, metric, before, after, change, regression))
+    return rows
+
+
+def print_comparison(rows, threshold):
+    print(f"{'server':8} {'endpoint':14} {'metric':28} {'baseline':>10} {'current':>10} {'change':>9}")
+    for server_name, endpoint, metric, before, after, change, regression in rows:
+        change_text = f'{change:+.1f}%' if change is not None else '-'
+        marker = ' !' if regression and abs(change) >= threshold else ''
+        print(f'{server_name:8} {endpoint:14} {metric:28} {before:>10} {after:>10} {change_text:>9}{marker}')
+
+
+def git_revision():
+    revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, universal_newlines=True)
+    return revision.stdout.strip() or None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--servers', nargs='+', choices=sorted(SERVERS), default=['wsgi', 'asgi'])
+    parser.add_argument('--endpoints', nargs='+', choices=sorted(ENDPOINTS), default=list(ENDPOINTS))
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--warmup', type=int, default=100, help='Unmeasured requests sent before every run.')
+    parser.add_argument('--repos', type=int, default=500, help='Amount of distinct saved repos looked up.')
+    parser.add_argument('--github-latency', type=float, default=0.1, help='Seconds fake Github takes to answer.')
+    parser.add_argument('--github-error-rate', type=float, default=0, help='Fraction of Github calls failing 502.')
+    parser.add_argument('--github-rate-limit', type=int, default=5000, help='Github calls per hour per token.')
+    parser.add_argument('--no-github-etags', dest='github_etags', action='store_false',
+                        help='Fake Github does not send ETag, so lookups are never answered 304.')
+    parser.add_argument('--github-cache-ttl', type=int, default=0)
+    parser.add_argument('--popularity-max-age', type=int, default=0)
+    parser.add_argument('--output', help='Save results as JSON.')
+    parser.add_argument('--compare', help='Diff results with JSON saved earlier with --output.')
+    parser.add_argument('--threshold', type=float, default=5, help='Mark regressions larger than this %%.')
+    args = parser.parse_args(argv)
+
+    from benchmarks.fake_github import FakeGithubServer
+
+    repo_names = [f'benchmark/repo-{number}' for number in range(args.repos)] + ['facebook/react']
+    github = FakeGithubServer(repos={name: (number, number) for number, name in enumerate(repo_names)},
+                              latency=args.github_latency, error_rate=args.github_error_rate,
+                              etags=args.github_etags, rate_limit=args.github_rate_limit, seed=0).start()
+    report = {
+        'revision': git_revision(),
+        'parameters': {key: value for key, value in vars(args).items()
+                       if key not in ('output', 'compare', 'threshold')},
+        'results': {},
+    }
+    try:
+        for server_name in args.servers:
+            with tempfile.TemporaryDirectory() as workdir:
+                env = dict(os.environ,
+                           DJANGO_SETTINGS_MODULE='repos.settings_benchmark',
+                           BENCHMARK_DATABASE=str(Path(workdir) / 'db.sqlite3'),
+                           BENCHMARK_CACHE_DIR=str(Path(workdir) / 'cache'),
+                           BENCHMARK_GITHUB_URL=github.url,
+                           BENCHMARK_GITHUB_CACHE_TTL=str(args.github_cache_ttl),
+                           BENCHMARK_POPULARITY_MAX_AGE=str(args.popularity_max_age),
+                           PERSONAL_ACCESS_TOKEN=f'benchmark-{server_name}')
+                env.pop('POPULARITY_ASYNC_VIEWS', None)
+                env.pop('PERSONAL_ACCESS_TOKENS', None)
+                prepared = subprocess.run([sys.executable, '-m', 'benchmarks.run', 'prepare', *repo_names],
+                                          cwd=BASE_DIR, env=env, check=True, stdout=subprocess.PIPE)
+                token, repo_ids = json.loads(prepared.stdout)
+                report['results'][server_name] = run_server(server_name, env, token, repo_ids, github, args)
+    finally:
+        github.stop()
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    if args.compare:
+        with open(args.compare) as baseline:
+            print_comparison(compare(json.load(baseline), report), args.threshold)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['prepare']:
+        # Run in subprocess, with settings of the benchmarked servers.
+        print(json.dumps(prepare_database(sys.argv[2:])))
+    else:
+        main()
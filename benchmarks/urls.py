@@ -0,0 +1,15 @@
+from django.http import JsonResponse
+from django.urls import path, include
+
+from benchmarks.apps import db_queries
+
+
+def stats(request):
+    """Counters read by benchmarks/run.py before and after every measured run."""
+    return JsonResponse({'db_queries': db_queries.count})
+
+
+urlpatterns = [
+    path('benchmark/stats/', stats),
+    path('', include('repos.urls')),
+]
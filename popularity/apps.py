@@ -1,5 +1,27 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_delete
+
+
+def time_queries(sender, connection, **kwargs):
+    from popularity.timing import time_query
+
+    # Signal is sent again whenever closed connection of a thread is reopened.
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
 
 
 class PopularityConfig(AppConfig):
     name = 'popularity'
+
+    def ready(self):
+        from rest_framework.authtoken.models import Token
+
+        from popularity.authentication import token_deleted, user_changed
+
+        connection_created.connect(time_queries)
+        # Cached token authentication forgets deleted tokens and deactivated, changed or deleted users.
+        post_delete.connect(token_deleted, sender=Token)
+        post_save.connect(user_changed, sender=settings.AUTH_USER_MODEL)
+        pre_delete.connect(user_changed, sender=settings.AUTH_USER_MODEL)
@@ -0,0 +1,120 @@
+import asyncio
+import random
+import weakref
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework import status
+
+from popularity.metrics import observed_github_call
+from popularity.utils import github_cache, github_token_pool, GithubTokensExhausted, is_rate_limited, \
+    conditional_headers, github_repo_result, calculate_popularity
+
+RETRY_STATUSES = frozenset([status.HTTP_429_TOO_MANY_REQUESTS, status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            status.HTTP_502_BAD_GATEWAY, status.HTTP_503_SERVICE_UNAVAILABLE,
+                            status.HTTP_504_GATEWAY_TIMEOUT])
+
+# One client (connection pool) and one map of lookups in flight per event loop.
+_clients = weakref.WeakKeyDictionary()
+_in_flight = weakref.WeakKeyDictionary()
+
+# Cache may be backed by files or memcached, its blocking calls are run off the event loop.
+cache_get = sync_to_async(github_cache.get, thread_sensitive=False)
+repo_result = sync_to_async(github_repo_result, thread_sensitive=False)
+
+
+def get_github_client():
+    """AsyncClient keeping alive pooled connections to Github, sized and timed out like the sync session."""
+    loop = asyncio.get_event_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(settings.GITHUB_READ_TIMEOUT, connect=settings.GITHUB_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=settings.GITHUB_POOL_MAXSIZE,
+                                max_keepalive_connections=settings.GITHUB_POOL_MAXSIZE))
+        _clients[loop] = client
+    return client
+
+
+def is_retry(response):
+    if response.status_code == status.HTTP_403_FORBIDDEN:
+        return 'Retry-After' in response.headers
+    return response.status_code in RETRY_STATUSES
+
+
+def backoff_time(response, retry_number):
+    """Retry-After capped at GITHUB_RETRY_AFTER_MAX, jittered exponential backoff otherwise (as GithubRetry)."""
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after and retry_after.isdigit():
+        return min(int(retry_after), settings.GITHUB_RETRY_AFTER_MAX)
+    if retry_number <= 1:
+        return 0
+    return random.uniform(0, settings.GITHUB_RETRY_BACKOFF_FACTOR * (2 ** (retry_number - 1)))
+
+
+async def github_get(url, headers):
+    """GET with bounded retries of connection errors, 5xx, 429 and 403 with Retry-After."""
+    retry_number = 0
+    while True:
+        response = None
+        try:
+            response = await get_github_client().get(url, headers=headers)
+        except httpx.ConnectError:
+            if retry_number >= settings.GITHUB_MAX_RETRIES:
+                raise
+        else:
+            if retry_number >= settings.GITHUB_MAX_RETRIES or not is_retry(response):
+                return response
+        retry_number += 1
+        await asyncio.sleep(backoff_time(response, retry_number))
+
+
+async def async_get_github_api_response(repo_name):
+    _status, info = await async_fetch_github_repo(repo_name)
+    if _status != status.HTTP_200_OK:
+        return _status, info
+    return _status, calculate_popularity(num_stars=info.num_stars, num_forks=info.num_forks)
+
+
+async def async_fetch_github_repo(repo_name, known=None):
+    """
+    Asyncio counterpart of utils.fetch_github_repo sharing its cache and token pool.
+    Concurrent lookups of the same repo on one event loop share single Github call.
+    """
+    if not github_token_pool.configured_tokens():
+        return status.HTTP_503_SERVICE_UNAVAILABLE, "PERSONAL ACCESS TOKEN not granted on server"
+    cached = await cache_get(repo_name)
+    if cached is not None and github_cache.is_fresh(cached):
+        github_cache.record('hits')
+        return status.HTTP_200_OK, cached
+    in_flight = _in_flight.setdefault(asyncio.get_event_loop(), {})
+    lookup = in_flight.get(repo_name)
+    if lookup is None:
+        lookup = asyncio.ensure_future(_async_fetch_github_repo(repo_name, cached or known))
+        in_flight[repo_name] = lookup
+        lookup.add_done_callback(lambda _: in_flight.pop(repo_name, None))
+    # Cancelled caller must not cancel lookup awaited by the others.
+    return await asyncio.shield(lookup)
+
+
+async def _async_fetch_github_repo(repo_name, cached):
+    headers = conditional_headers(cached)
+    while True:
+        try:
+            personal_token = github_token_pool.acquire()
+        except GithubTokensExhausted:
+            return status.HTTP_503_SERVICE_UNAVAILABLE, "Github rate limit exhausted for all PERSONAL ACCESS TOKENs"
+        try:
+            with observed_github_call() as call:
+                response = await github_get(f'{settings.GITHUB_API_URL}/repos/{repo_name}',
+                                            headers=dict(headers, Authorization=f'Token {personal_token}'))
+                call['status'] = response.status_code
+        except httpx.TimeoutException:
+            return status.HTTP_504_GATEWAY_TIMEOUT, "Github Rest Api not responding in time"
+        except httpx.TransportError:
+            return status.HTTP_503_SERVICE_UNAVAILABLE, "Github Rest Api not reachable"
+        github_token_pool.update(personal_token, response.headers)
+        if not is_rate_limited(response):
+            break
+    return await repo_result(repo_name, cached, response)
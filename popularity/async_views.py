@@ -0,0 +1,100 @@
+import functools
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, HttpResponseNotAllowed, JsonResponse
+from rest_framework import exceptions, status
+from rest_framework.request import Request
+
+from popularity.async_client import async_fetch_github_repo, async_get_github_api_response
+from popularity.authentication import API_AUTHENTICATION_CLASSES
+from popularity.conditional import not_modified, with_validators, popularity_validators
+from popularity.models import Repo, STALE_WARNING
+from popularity.refresh import repo_reads, revalidate_in_background
+from popularity.timing import timed
+from popularity.views import rate_limit_headers, staleness_headers
+
+
+def require_safe(view):
+    """
+    Answer methods other than GET and HEAD with 405 as the sync views do. Decorators of django.views.decorators.http
+    wrap views into sync functions, so they are not used for native async ones.
+    """
+    @functools.wraps(view)
+    async def inner(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return HttpResponseNotAllowed(['GET', 'HEAD'])
+        return await view(request, *args, **kwargs)
+    return inner
+
+
+def authenticate(request):
+    """
+    Authenticate with API_AUTHENTICATION_CLASSES as RepoViewSet does.
+    Returns (user, None) or (None, response) answering unauthenticated request.
+    """
+    authenticators = [authentication() for authentication in API_AUTHENTICATION_CLASSES]
+    try:
+        with timed('auth'):
+            user = Request(request, authenticators=authenticators).user
+        if user and user.is_authenticated:
+            return user, None
+        raise exceptions.NotAuthenticated()
+    except exceptions.APIException as exc:
+        authenticate_header = authenticators[0].authenticate_header(request) if authenticators else None
+        response = JsonResponse({"detail": str(exc.detail)},
+                                status=status.HTTP_401_UNAUTHORIZED if authenticate_header else exc.status_code)
+        if authenticate_header:
+            response['WWW-Authenticate'] = authenticate_header
+        return None, response
+
+
+def get_repo(pk):
+    repo = Repo.objects.filter(pk=pk).first()
+    if repo is not None:
+        repo_reads.record(repo.id)
+    return repo
+
+
+@require_safe
+async def repo_popular(request, pk):
+    """
+    Native async GET /api/v1/repos/<id>/popular/ served under ASGI. Answers as RepoViewSet.popular, while
+    waiting for Github the event loop serves other requests instead of holding a worker thread.
+    """
+    user, response = await sync_to_async(authenticate)(request)
+    if user is None:
+        return response
+    repo = await sync_to_async(get_repo)(pk)
+    if repo is None:
+        return JsonResponse({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+    lookup = repo.stored_lookup()
+    if lookup is None:
+        age = repo.popularity_age
+        _status, info = await async_fetch_github_repo(repo_name=repo.name, known=repo.stored_counts)
+        if _status == status.HTTP_200_OK:
+            await sync_to_async(repo.update_popularity)(num_stars=info.num_stars, num_forks=info.num_forks,
+                                                        etag=info.etag)
+        lookup = repo.refreshed_lookup(age, _status, info)
+    elif lookup.warning == STALE_WARNING:
+        revalidate_in_background(repo.id)
+    validators = popularity_validators(repo, lookup)
+    response = not_modified(request, validators)
+    if response is None:
+        with timed('serialize'):
+            response = JsonResponse(lookup.info, status=lookup.status, safe=False)
+    for header, value in dict(rate_limit_headers(lookup.status), **staleness_headers(lookup)).items():
+        response[header] = value
+    return with_validators(response, validators)
+
+
+@require_safe
+async def health_check(request):
+    """Native async counterpart of HealthCheckView served under ASGI."""
+    test_repo = "facebook/react"
+    _status, _ = await async_get_github_api_response(test_repo)
+    if _status == status.HTTP_200_OK:
+        return HttpResponse("ok")
+    response = HttpResponse("Not ok", status=_status)
+    for header, value in rate_limit_headers(_status).items():
+        response[header] = value
+    return response
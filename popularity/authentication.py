@@ -0,0 +1,129 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from rest_framework import exceptions
+from rest_framework.authentication import SessionAuthentication, TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+# Fields of user kept in cache, enough for request.user and permission checks. Password hash is never cached.
+CACHED_USER_FIELDS = ('pk', 'username', 'is_active', 'is_staff', 'is_superuser')
+
+
+def read_only(*args, **kwargs):
+    raise TypeError("User rebuilt from token cache has only some fields, it can not be saved or deleted.")
+
+
+class TokenUserCache:
+    """
+    Users of resolved auth tokens. Kept in bounded in-process LRU for `local_ttl` seconds and shared with other
+    worker processes through Django cache `cache_alias` for `shared_ttl` seconds. Invalidated entries are dropped
+    from the shared cache at once, other processes drop their local copy at most `local_ttl` seconds later.
+    Only CACHED_USER_FIELDS are stored, users are rebuilt from them.
+    """
+
+    def __init__(self, max_size, local_ttl, shared_ttl, cache_alias):
+        self.max_size = max_size
+        self.local_ttl = local_ttl
+        self.shared_ttl = shared_ttl
+        self.cache_alias = cache_alias
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def shared(self):
+        return caches[self.cache_alias]
+
+    @staticmethod
+    def shared_key(key):
+        # Tokens are not stored in plain text outside of db.
+        return f"auth:token:{hashlib.sha256(key.encode()).hexdigest()}"
+
+    @staticmethod
+    def pack(user):
+        return tuple(getattr(user, field) for field in CACHED_USER_FIELDS)
+
+    @staticmethod
+    def unpack(fields):
+        user = get_user_model()(**dict(zip(CACHED_USER_FIELDS, fields)))
+        # Saving partial user would wipe its other fields.
+        user.save = user.delete = read_only
+        return user
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                return self.unpack(entry[1])
+        fields = self.shared.get(self.shared_key(key))
+        if fields is None:
+            return None
+        self._remember(key, fields, now)
+        return self.unpack(fields)
+
+    def set(self, key, user):
+        fields = self.pack(user)
+        self._remember(key, fields, time.monotonic())
+        self.shared.set(self.shared_key(key), fields, timeout=self.shared_ttl)
+
+    def _remember(self, key, fields, now):
+        with self._lock:
+            self._entries[key] = (now + self.local_ttl, fields)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+        self.shared.delete_many([self.shared_key(key) for key in keys])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_users = TokenUserCache(max_size=settings.POPULARITY_AUTH_CACHE_MAX_SIZE,
+                             local_ttl=settings.POPULARITY_AUTH_CACHE_LOCAL_TTL,
+                             shared_ttl=settings.POPULARITY_AUTH_CACHE_TTL,
+                             cache_alias=settings.GITHUB_CACHE_ALIAS)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication resolving token to user without db query once the token was seen. Users of cache hits
+    are partial and read only, so it authenticates only views reading request.user (API_AUTHENTICATION_CLASSES).
+    Tokens of deleted, inactive or changed users and deleted tokens are invalidated by model signals. Users
+    deactivated by queryset update (no signals) are rejected once their entries expire.
+    """
+
+    def authenticate_credentials(self, key):
+        user = token_users.get(key)
+        if user is None:
+            user, token = super().authenticate_credentials(key)
+            token_users.set(key, user)
+            return user, token
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        return user, Token(key=key, user=user)
+
+
+def token_deleted(sender, instance, **kwargs):
+    token_users.invalidate(instance.key)
+
+
+def user_changed(sender, instance, **kwargs):
+    keys = list(Token.objects.filter(user_id=instance.pk).values_list('key', flat=True))
+    if keys:
+        token_users.invalidate(*keys)
+
+
+# Authentication of repo and popularity Api, views changing users (djoser auth/) keep DEFAULT_AUTHENTICATION_CLASSES.
+API_AUTHENTICATION_CLASSES = (CachedTokenAuthentication, SessionAuthentication)
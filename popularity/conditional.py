@@ -0,0 +1,62 @@
+import hashlib
+
+from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+from rest_framework import status
+
+
+def version(moment):
+    """Microseconds of timestamp, part of ETag."""
+    return int(moment.timestamp() * 1000000)
+
+
+def repo_validators(repo):
+    """(ETag, Last-Modified, max-age) of repo detail, changed by every Repo.save."""
+    return f'"{repo.pk}-{version(repo.updated)}"', repo.updated, settings.POPULARITY_REPO_CACHE_MAX_AGE
+
+
+def page_validators(repos, next_link, previous_link):
+    """(ETag, Last-Modified, max-age) of page of repos, changed when any of them is saved, added or deleted."""
+    digest = hashlib.sha1(f'{next_link}|{previous_link}'.encode())
+    for repo in repos:
+        digest.update(f'|{repo.pk}-{version(repo.updated)}'.encode())
+    last_modified = max((repo.updated for repo in repos), default=None)
+    return f'"{digest.hexdigest()}"', last_modified, settings.POPULARITY_REPO_CACHE_MAX_AGE
+
+
+def popularity_validators(repo, lookup):
+    """
+    (ETag, Last-Modified, max-age) of stored popularity served by lookup, None for failed lookups.
+    Popularity does not change until it is fetched again, it is fresh for the rest of POPULARITY_MAX_AGE.
+    """
+    if lookup.status != status.HTTP_200_OK or repo.popularity_fetched_at is None:
+        return None
+    max_age = max(0, settings.POPULARITY_MAX_AGE - (lookup.age or 0)) if lookup.warning is None else 0
+    return f'"{repo.pk}-{version(repo.popularity_fetched_at)}"', repo.popularity_fetched_at, max_age
+
+
+def not_modified(request, validators):
+    """304 response when conditional GET matches validators, None otherwise."""
+    if validators is None:
+        return None
+    etag, last_modified, max_age = validators
+    response = get_conditional_response(request, etag=etag,
+                                        last_modified=int(last_modified.timestamp()) if last_modified else None)
+    return with_validators(response, validators) if response is not None else None
+
+
+def with_validators(response, validators):
+    """
+    Set ETag, Last-Modified and Cache-Control of response. Responses are revalidated after max-age and stored per
+    Authorization, so reverse proxy could serve repeated requests of the same client.
+    """
+    if validators is None:
+        return response
+    etag, last_modified, max_age = validators
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    patch_cache_control(response, max_age=max_age, must_revalidate=True)
+    patch_vary_headers(response, ['Authorization'])
+    return response
@@ -0,0 +1,43 @@
+import csv
+import json
+
+from django.conf import settings
+
+EXPORT_FIELDS = ['id', 'name', 'github_url', 'stargazers_count', 'forks_count', 'score', 'popularity',
+                 'popularity_fetched_at']
+
+STORED_FIELDS = [field for field in EXPORT_FIELDS if field != 'github_url']
+
+
+def export_rows(queryset, chunk_size=None):
+    """
+    Exported repos as dicts of EXPORT_FIELDS, read in chunks of `chunk_size` by db cursor
+    (server-side one where db supports it), so memory use does not depend on amount of repos.
+    """
+    rows = queryset.order_by('id').values_list(*STORED_FIELDS)
+    for values in rows.iterator(chunk_size=chunk_size or settings.POPULARITY_EXPORT_CHUNK_SIZE):
+        row = dict(zip(STORED_FIELDS, values))
+        row['github_url'] = f"https://github.com/{row['name']}/"
+        if row['popularity_fetched_at'] is not None:
+            row['popularity_fetched_at'] = row['popularity_fetched_at'].isoformat()
+        yield {field: row[field] for field in EXPORT_FIELDS}
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(row) + '\n'
+
+
+class LineBuffer:
+    """File-like object of csv.writer returning written line instead of buffering it."""
+
+    @staticmethod
+    def write(line):
+        return line
+
+
+def csv_lines(rows):
+    writer = csv.DictWriter(LineBuffer(), fieldnames=EXPORT_FIELDS)
+    yield writer.writeheader()
+    for row in rows:
+        yield writer.writerow(row)
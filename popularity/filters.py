@@ -0,0 +1,47 @@
+import coreapi
+import coreschema
+from rest_framework.filters import BaseFilterBackend, OrderingFilter
+
+# Upper bound of strings starting with a prefix.
+MAX_CHARACTER = '\U0010ffff'
+
+
+class RepoFilter(BaseFilterBackend):
+    """
+    Filter repos by `name` prefix and `popularity` label. Name prefix is range of unique name index
+    (name >= prefix AND name < prefix + max character), which every db serves from the index unlike LIKE.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        prefix = request.query_params.get('name')
+        if prefix:
+            queryset = queryset.filter(name__gte=prefix, name__lt=prefix + MAX_CHARACTER, name__startswith=prefix)
+        popularity = request.query_params.get('popularity')
+        if popularity:
+            queryset = queryset.filter(popularity=popularity)
+        return queryset
+
+    def get_schema_fields(self, view):
+        return [
+            coreapi.Field(name='name', required=False, location='query',
+                          schema=coreschema.String(description="Prefix of repo name, e.g. facebook/")),
+            coreapi.Field(name='popularity', required=False, location='query',
+                          schema=coreschema.Enum(["popular", "not popular"], description="Stored popularity.")),
+        ]
+
+
+class RepoOrderingFilter(OrderingFilter):
+    """
+    OrderingFilter by single field with id as tiebreaker, keyset pagination needs unique (field, id) ordering.
+    Repos without value of ordering field (score not fetched yet) are left out.
+    """
+
+    def get_ordering(self, request, queryset, view):
+        field = super().get_ordering(request, queryset, view)[0]
+        return [field, '-id' if field.startswith('-') else 'id']
+
+    def filter_queryset(self, request, queryset, view):
+        field = self.get_ordering(request, queryset, view)[0].lstrip('-')
+        if queryset.model._meta.get_field(field).null:
+            queryset = queryset.exclude(**{f'{field}__isnull': True})
+        return super().filter_queryset(request, queryset, view)
@@ -0,0 +1,122 @@
+import threading
+import time
+
+import requests
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import status
+
+
+def is_github_working(status_code):
+    """Github answered (404 of unknown repo included), neither failed nor refused the PERSONAL ACCESS TOKEN."""
+    return isinstance(status_code, int) and status_code < status.HTTP_500_INTERNAL_SERVER_ERROR and \
+        status_code != status.HTTP_401_UNAUTHORIZED
+
+
+class GithubReadiness:
+    """
+    Readiness of Github lookups without spending rate limit. Outcome of real Github calls younger than
+    `traffic_max_age` seconds is reused. Without recent traffic Github /rate_limit endpoint, which is not counted
+    against the rate limit, is probed at most every `probe_interval` seconds by all processes sharing `cache_alias`.
+    """
+    probe_key = 'github:readiness:probe'
+    probe_lock_key = 'github:readiness:probing'
+
+    def __init__(self, traffic_max_age, probe_interval, cache_alias):
+        self.traffic_max_age = traffic_max_age
+        self.probe_interval = probe_interval
+        self.cache_alias = cache_alias
+        self._last_call = None
+        self._lock = threading.Lock()
+
+    @property
+    def shared(self):
+        return caches[self.cache_alias]
+
+    def record(self, status_code, latency):
+        """Outcome of real Github call."""
+        with self._lock:
+            self._last_call = {'at': time.time(), 'status': status_code, 'latency': latency}
+
+    def clear(self):
+        with self._lock:
+            self._last_call = None
+        self.shared.delete_many([self.probe_key, self.probe_lock_key])
+
+    def observation(self):
+        """Returns (source, observation of Github) - recent traffic, recent probe or new probe."""
+        now = time.time()
+        with self._lock:
+            last_call = self._last_call
+        if last_call is not None and now - last_call['at'] < self.traffic_max_age:
+            return 'traffic', last_call
+        last_probe = self.shared.get(self.probe_key)
+        if last_probe is not None and now - last_probe['at'] < self.probe_interval:
+            return 'probe', last_probe
+        if last_probe is not None and not self.shared.add(self.probe_lock_key, 1, timeout=self.probe_interval):
+            # Another process is probing right now.
+            return 'probe', last_probe
+        last_probe = self.probe()
+        self.shared.set(self.probe_key, last_probe, timeout=None)
+        return 'probe', last_probe
+
+    @staticmethod
+    def probe():
+        """GET /rate_limit with every configured token, budgets of token pool are updated from the answers."""
+        from popularity.utils import github_session, github_token_pool
+
+        started = time.perf_counter()
+        status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        for personal_token in github_token_pool.configured_tokens():
+            try:
+                response = github_session.get(f'{settings.GITHUB_API_URL}/rate_limit',
+                                              headers={'Authorization': f'Token {personal_token}'},
+                                              timeout=(settings.GITHUB_CONNECT_TIMEOUT, settings.GITHUB_READ_TIMEOUT))
+            except requests.exceptions.Timeout:
+                status_code = status.HTTP_504_GATEWAY_TIMEOUT
+                break
+            except (requests.exceptions.ConnectionError, OSError):
+                status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+                break
+            status_code = response.status_code
+            if status_code != status.HTTP_200_OK:
+                break
+            for resource, limit in response.json().get('resources', {}).items():
+                github_token_pool.update(personal_token, {'X-RateLimit-Remaining': limit['remaining'],
+                                                          'X-RateLimit-Reset': limit['reset'],
+                                                          'X-RateLimit-Resource': resource})
+        return {'at': time.time(), 'status': status_code, 'latency': time.perf_counter() - started}
+
+    def check(self):
+        """Returns (ready, payload reporting Github status, latency and remaining rate limit)."""
+        from popularity.utils import github_token_pool
+
+        if not github_token_pool.configured_tokens():
+            return False, {'status': 'not ok', 'reason': "PERSONAL ACCESS TOKEN not granted on server"}
+        source, observation = self.observation()
+        budgets = github_token_pool.budgets()
+        retry_after = github_token_pool.retry_after()
+        ready = is_github_working(observation['status']) and retry_after is None
+        payload = {
+            'status': 'ok' if ready else 'not ok',
+            'github': {
+                'source': source,
+                'age': int(time.time() - observation['at']),
+                'status': observation['status'],
+                'latency_ms': round(observation['latency'] * 1000, 1),
+            },
+            'rate_limit': {
+                'remaining': sum(remaining for remaining, _ in budgets.values()),
+                'reset': max((reset for _, reset in budgets.values()), default=0),
+                'tokens': {token: {'remaining': remaining, 'reset': reset}
+                           for token, (remaining, reset) in budgets.items()},
+            },
+        }
+        if retry_after is not None:
+            payload['reason'] = "Github rate limit exhausted for all PERSONAL ACCESS TOKENs"
+        return ready, payload
+
+
+github_readiness = GithubReadiness(traffic_max_age=settings.POPULARITY_READINESS_TRAFFIC_MAX_AGE,
+                                   probe_interval=settings.POPULARITY_READINESS_PROBE_INTERVAL,
+                                   cache_alias=settings.GITHUB_CACHE_ALIAS)
@@ -0,0 +1,120 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+
+from popularity.models import RepoSample
+from popularity.utils import popularity_of_score
+
+SAMPLE_FIELDS = ['sampled_at', 'resolution', 'stargazers_count', 'forks_count', 'score']
+
+ROLLUP_LOCK_KEY = 'history:rollup'
+
+
+def start_of_hour(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def start_of_day(moment):
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def roll_up(source, target, bucket, cutoff, batch_size):
+    """
+    Replace `source` samples older than `cutoff` by the last sample of every `bucket` (start of hour / day).
+    Repos are rolled up in batches of `batch_size`, one transaction per batch. Returns amount of removed samples.
+    """
+    old_samples = RepoSample.objects.filter(resolution=source, sampled_at__lt=cutoff)
+    repo_ids = list(old_samples.order_by('repo_id').values_list('repo_id', flat=True).distinct())
+    removed = 0
+    for start in range(0, len(repo_ids), batch_size):
+        batch = old_samples.filter(repo_id__in=repo_ids[start:start + batch_size])
+        with transaction.atomic():
+            last_samples = {}
+            for repo_id, sampled_at, stargazers_count, forks_count, score in batch.order_by(
+                    'repo_id', 'sampled_at').values_list('repo_id', 'sampled_at', 'stargazers_count', 'forks_count',
+                                                         'score'):
+                last_samples[repo_id, bucket(sampled_at)] = (stargazers_count, forks_count, score)
+            RepoSample.objects.bulk_create([
+                RepoSample(repo_id=repo_id, resolution=target, sampled_at=sampled_at, stargazers_count=stargazers_count,
+                           forks_count=forks_count, score=score)
+                for (repo_id, sampled_at), (stargazers_count, forks_count, score) in last_samples.items()
+            ])
+            removed += batch.delete()[0]
+    return removed
+
+
+def rollup_history(now=None, batch_size=None):
+    """
+    Keep storage of history bounded: raw samples older than POPULARITY_HISTORY_RAW_RETENTION are rolled up to hourly,
+    hourly older than POPULARITY_HISTORY_HOURLY_RETENTION to daily ones, daily older than
+    POPULARITY_HISTORY_DAILY_RETENTION are deleted. Cutoffs are aligned to whole hours / days, so every bucket is
+    rolled up at once. Only one roll up runs at once in all processes sharing GITHUB_CACHE_ALIAS cache, concurrent
+    ones would insert the same hourly / daily samples twice. Returns amount of removed samples by resolution,
+    None when another roll up is running.
+    """
+    cache = caches[settings.GITHUB_CACHE_ALIAS]
+    if not cache.add(ROLLUP_LOCK_KEY, 1, timeout=settings.POPULARITY_HISTORY_ROLLUP_INTERVAL):
+        return None
+    try:
+        return _rollup_history(now or timezone.now(), batch_size or settings.POPULARITY_HISTORY_ROLLUP_BATCH_SIZE)
+    finally:
+        cache.delete(ROLLUP_LOCK_KEY)
+
+
+def _rollup_history(now, batch_size):
+    removed = {
+        RepoSample.RAW: roll_up(RepoSample.RAW, RepoSample.HOUR, start_of_hour,
+                                start_of_hour(now - timedelta(seconds=settings.POPULARITY_HISTORY_RAW_RETENTION)),
+                                batch_size),
+        RepoSample.HOUR: roll_up(RepoSample.HOUR, RepoSample.DAY, start_of_day,
+                                 start_of_day(now - timedelta(seconds=settings.POPULARITY_HISTORY_HOURLY_RETENTION)),
+                                 batch_size),
+    }
+    expired = RepoSample.objects.filter(
+        resolution=RepoSample.DAY,
+        sampled_at__lt=start_of_day(now - timedelta(seconds=settings.POPULARITY_HISTORY_DAILY_RETENTION)))
+    removed[RepoSample.DAY] = expired.delete()[0]
+    return removed
+
+
+def growth_rates(samples):
+    """Change of counts per day between the first and the last sample, None for less than a day of history."""
+    if len(samples) < 2:
+        return None
+    first, last = samples[0], samples[-1]
+    days = (last['sampled_at'] - first['sampled_at']).total_seconds() / (24 * 60 * 60)
+    if days < 1:
+        return None
+    return {
+        'days': round(days, 2),
+        'stargazers_per_day': round((last['stargazers_count'] - first['stargazers_count']) / days, 2),
+        'forks_per_day': round((last['forks_count'] - first['forks_count']) / days, 2),
+        'score_per_day': round((last['score'] - first['score']) / days, 2),
+    }
+
+
+def repo_history(repo, since=None, until=None, resolution=None):
+    """Samples of repo ordered by time with popularity, growth rates and crossings of popularity threshold."""
+    samples = RepoSample.objects.filter(repo=repo)
+    if since is not None:
+        samples = samples.filter(sampled_at__gte=since)
+    if until is not None:
+        samples = samples.filter(sampled_at__lt=until)
+    if resolution is not None:
+        samples = samples.filter(resolution=resolution)
+    series = list(samples.order_by('sampled_at').values(*SAMPLE_FIELDS))
+    crossings = []
+    for previous, sample in zip([None] + series, series):
+        sample['popularity'] = popularity_of_score(sample['score'])
+        if previous is not None and previous['popularity'] != sample['popularity']:
+            crossings.append({'sampled_at': sample['sampled_at'], 'popularity': sample['popularity']})
+    return {
+        'id': repo.id,
+        'name': repo.name,
+        'samples': series,
+        'growth': growth_rates(series),
+        'crossings': crossings,
+    }
@@ -0,0 +1,118 @@
+import codecs
+import csv
+import json
+from itertools import islice
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from popularity.models import Repo
+from popularity.utils import normalize_repo_name, GITHUB_REPO_NAME
+
+REPO_NAME_MAX_LENGTH = Repo._meta.get_field('name').max_length
+
+
+def decoded_lines(lines):
+    """Lines of bytes stream decoded as utf-8, read lazily."""
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    for line in lines:
+        yield decoder.decode(line) if isinstance(line, bytes) else line
+
+
+def ndjson_rows(lines):
+    """
+    (line number, name, error) of newline delimited JSON. Every line is a JSON string with repo name
+    or object with "name". Blank lines are ignored.
+    """
+    for line_number, line in enumerate(decoded_lines(lines), start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield line_number, None, "Not valid JSON."
+            continue
+        name = row.get('name') if isinstance(row, dict) else row
+        if not isinstance(name, str):
+            yield line_number, None, "Repo name not found."
+            continue
+        yield line_number, name, None
+
+
+def csv_rows(lines):
+    """(line number, name, error) of CSV with repo names in "name" column of header, or in the first column."""
+    reader = csv.reader(decoded_lines(lines))
+    column = 0
+    for row in reader:
+        if not row or not ''.join(row).strip():
+            continue
+        if reader.line_num == 1 and 'name' in [cell.strip().lower() for cell in row]:
+            column = [cell.strip().lower() for cell in row].index('name')
+            continue
+        if column >= len(row):
+            yield reader.line_num, None, "Repo name not found."
+            continue
+        yield reader.line_num, row[column], None
+
+
+class RepoImport:
+    """
+    Streaming import of repo names. Names are normalized as Repo.save does and inserted with bulk_create
+    in chunks of `batch_size`, one transaction per chunk. Names saved already (also earlier in the same input)
+    are skipped, so memory use does not depend on size of the input.
+    """
+    max_reported_errors = 20
+
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size or settings.POPULARITY_IMPORT_BATCH_SIZE
+        self.inserted = 0
+        self.skipped = 0
+        self.invalid = 0
+        self.errors = []
+
+    def run(self, rows):
+        names = self.valid_names(rows)
+        while True:
+            chunk = list(islice(names, self.batch_size))
+            if not chunk:
+                break
+            self.insert(chunk)
+        return self.report()
+
+    def valid_names(self, rows):
+        for line_number, name, error in rows:
+            if error is None:
+                name = normalize_repo_name(name.strip())
+                if len(name) > REPO_NAME_MAX_LENGTH:
+                    error = f"Repo name longer than {REPO_NAME_MAX_LENGTH} characters."
+                elif not GITHUB_REPO_NAME.match(name):
+                    error = "Repo name not in github_user/repo_name format."
+            if error is not None:
+                self.invalid += 1
+                if len(self.errors) < self.max_reported_errors:
+                    self.errors.append({'line': line_number, 'error': error})
+                continue
+            yield name
+
+    def insert(self, chunk):
+        names = list(dict.fromkeys(chunk))
+        self.skipped += len(chunk) - len(names)
+        existing, conflict = set(), None
+        while True:
+            saved = set(Repo.objects.filter(name__in=names).values_list('name', flat=True))
+            if conflict is not None and saved == existing:
+                raise conflict
+            existing = saved
+            new_names = [name for name in names if name not in existing]
+            try:
+                with transaction.atomic():
+                    Repo.objects.bulk_create([Repo(name=name, name_key=name.lower()) for name in new_names])
+                break
+            except IntegrityError as error:
+                # Some names were saved concurrently since they were looked up, they are skipped on retry.
+                conflict = error
+        self.skipped += len(existing)
+        self.inserted += len(new_names)
+
+    def report(self):
+        return {'inserted': self.inserted, 'skipped': self.skipped, 'invalid': self.invalid, 'errors': self.errors}
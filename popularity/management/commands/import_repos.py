@@ -0,0 +1,35 @@
+import json
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from popularity.imports import RepoImport, ndjson_rows, csv_rows
+
+ROWS = {
+    'ndjson': ndjson_rows,
+    'csv': csv_rows,
+}
+
+
+class Command(BaseCommand):
+    help = "Save repos from newline delimited JSON or CSV file with repo names, streamed in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File with repo names, - reads standard input.")
+        parser.add_argument('--format', choices=sorted(ROWS),
+                            help="Format of the file, by default taken from its extension (ndjson for stdin).")
+        parser.add_argument('--batch-size', type=int, default=settings.POPULARITY_IMPORT_BATCH_SIZE,
+                            help="Amount of names inserted at once.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        input_format = options['format'] or ('csv' if path.lower().endswith('.csv') else 'ndjson')
+        rows = ROWS[input_format]
+        importer = RepoImport(batch_size=options['batch_size'])
+        if path == '-':
+            report = importer.run(rows(sys.stdin.buffer))
+        else:
+            with open(path, 'rb') as lines:
+                report = importer.run(rows(lines))
+        self.stdout.write(json.dumps(report))
@@ -0,0 +1,30 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from popularity.refresh import RefreshWorker
+
+
+class Command(BaseCommand):
+    help = "Keep stored popularity of saved repos fresh within share of Github rate limit."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--budget-fraction', type=float, default=settings.POPULARITY_REFRESH_BUDGET_FRACTION,
+                            help="Share of hourly Github rate limit the worker may use.")
+        parser.add_argument('--workers', type=int, default=1,
+                            help="Amount of refresh_popularity workers sharing the rate limit budget.")
+        parser.add_argument('--batch-size', type=int, default=settings.POPULARITY_REFRESH_BATCH_SIZE,
+                            help="Amount of repos leased by worker at once.")
+        parser.add_argument('--once', action='store_true', help="Refresh repos due now and exit.")
+        parser.add_argument('--report-interval', type=int, default=60,
+                            help="Seconds between throughput / lag summaries.")
+
+    def handle(self, *args, **options):
+        worker = RefreshWorker(budget_fraction=options['budget_fraction'], workers=options['workers'],
+                               batch_size=options['batch_size'])
+        try:
+            worker.run(once=options['once'], report_interval=options['report_interval'],
+                       report=lambda summary: self.stdout.write(json.dumps(summary)))
+        except KeyboardInterrupt:
+            self.stdout.write(json.dumps(worker.summary()))
@@ -0,0 +1,21 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from popularity.history import rollup_history
+
+
+class Command(BaseCommand):
+    help = "Roll up popularity history to hourly and daily samples and delete the expired ones."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.POPULARITY_HISTORY_ROLLUP_BATCH_SIZE,
+                            help="Amount of repos rolled up per transaction.")
+
+    def handle(self, *args, **options):
+        removed = rollup_history(batch_size=options['batch_size'])
+        if removed is None:
+            self.stderr.write("Another roll up is running.")
+            return
+        self.stdout.write(json.dumps(removed))
@@ -0,0 +1,20 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from popularity.scoring import Scorer, rescore
+
+
+class Command(BaseCommand):
+    help = "Score stored repos with given weights and threshold, report popularity flips and optionally save them."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stars-weight', type=float, help="Weight of stars, POPULARITY_STARS_WEIGHT by default.")
+        parser.add_argument('--forks-weight', type=float, help="Weight of forks, POPULARITY_FORKS_WEIGHT by default.")
+        parser.add_argument('--threshold', type=int, help="Score of popular repo, POPULARITY_THRESHOLD by default.")
+        parser.add_argument('--apply', action='store_true', help="Save changed scores and popularity.")
+
+    def handle(self, *args, **options):
+        scorer = Scorer(stars_weight=options['stars_weight'], forks_weight=options['forks_weight'],
+                        threshold=options['threshold'])
+        self.stdout.write(json.dumps(rescore(scorer, apply=options['apply'])))
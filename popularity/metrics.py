@@ -0,0 +1,320 @@
+import bisect
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from popularity.health import github_readiness
+from popularity.timing import timed
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# name: (type, help, histogram buckets)
+METRICS = {
+    'github_request_duration_seconds': ('histogram', 'Latency of Github Api calls by response status.',
+                                        LATENCY_BUCKETS),
+    'http_request_duration_seconds': ('histogram', 'Latency of Api requests by view and DRF action.',
+                                      LATENCY_BUCKETS),
+    'popularity_results_total': ('counter', 'Popularity calculated from Github counts by result.', None),
+    'github_cache_hits_total': ('counter', 'Github lookups served from fresh cache entry.', None),
+    'github_cache_misses_total': ('counter', 'Github lookups answered by Github with new counts.', None),
+    'github_cache_revalidations_total': ('counter', 'Stale cache entries confirmed by Github with 304.', None),
+    'github_cache_evictions_total': ('counter', 'Entries evicted from in-process cache LRU.', None),
+    'github_cache_entries': ('gauge', 'Entries in in-process cache LRU summed over processes.', None),
+    'github_rate_limit_remaining': ('gauge', 'Github calls left in rate limit window of token.', None),
+    'github_rate_limit_reset_timestamp_seconds': ('gauge', 'Unix time rate limit window of token resets.', None),
+}
+
+
+def format_labels(labels):
+    return ','.join(f'{name}="{value}"' for name, value in sorted(labels.items()))
+
+
+def merge_shard(total, shard):
+    """Add recorded values of `shard` (counters and histograms) to `total`."""
+    for key, value in dict(shard).items():
+        if isinstance(value, list):
+            histogram = total.setdefault(key, [0] * len(value))
+            for index, amount in enumerate(list(value)):
+                histogram[index] += amount
+        else:
+            total[key] = total.get(key, 0) + value
+
+
+def read_snapshot(path):
+    try:
+        with open(path) as snapshot_file:
+            return json.load(snapshot_file)
+    except (OSError, ValueError):
+        return None
+
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # Running process of another user.
+        return True
+    return True
+
+
+class Metrics:
+    """
+    Counters and histograms of worker process. Every thread records into its own shard without locking,
+    shards are summed only when metrics are collected. Shards of finished threads are folded into single
+    process-wide shard. With `directory` every process saves its snapshot there (at most every `flush_interval`
+    seconds), /metrics of any process aggregates snapshots of all of them. Counters and histograms of exited
+    processes are folded into aggregate snapshot, so summed totals never go down. Gauges of snapshots older than
+    `snapshot_max_age` seconds (idle or hung processes) are left out.
+    """
+    aggregate_name = 'exited.json'
+
+    def __init__(self, directory=None, flush_interval=10, snapshot_max_age=300):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.snapshot_max_age = snapshot_max_age
+        self.snapshot_name = f'{os.getpid()}-{uuid.uuid4().hex}.json'
+        self._local = threading.local()
+        # (thread, shard) of threads recording metrics
+        self._shards = []
+        self._finished = {}
+        self._shards_lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                self._fold_finished()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _fold_finished(self):
+        """Move shards of finished threads to the process-wide one, called with shards lock held."""
+        running = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                running.append((thread, shard))
+            else:
+                merge_shard(self._finished, shard)
+        self._shards = running
+
+    def inc(self, name, amount=1, **labels):
+        shard = self._shard()
+        key = name, format_labels(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        shard = self._shard()
+        key = name, format_labels(labels)
+        histogram = shard.get(key)
+        if histogram is None:
+            # Count of observations per bucket (the last one is +Inf) followed by sum of observed values.
+            histogram = shard[key] = [0] * (len(METRICS[name][2]) + 2)
+        histogram[bisect.bisect_left(METRICS[name][2], value)] += 1
+        histogram[-1] += value
+
+    def snapshot(self):
+        """Recorded values of this process as JSON serializable {'counters': [...], 'histograms': [...], ...}."""
+        from popularity.utils import github_cache, github_token_pool
+
+        with self._shards_lock:
+            self._fold_finished()
+            total = {}
+            merge_shard(total, self._finished)
+            shards = [shard for _, shard in self._shards]
+        for shard in shards:
+            merge_shard(total, shard)
+        counters, histograms = defaultdict(int), {}
+        for key, value in total.items():
+            if isinstance(value, list):
+                histograms[key] = value
+            else:
+                counters[key] += value
+        cache_stats = github_cache.stats()
+        for counter in ('hits', 'misses', 'revalidations', 'evictions'):
+            counters[(f'github_cache_{counter}_total', '')] += cache_stats[counter]
+        return {
+            'counters': [[name, labels, value] for (name, labels), value in counters.items()],
+            'histograms': [[name, labels, value] for (name, labels), value in histograms.items()],
+            'cache_entries': cache_stats['size'],
+            'rate_limits': github_token_pool.stats(),
+        }
+
+    def flush(self):
+        """Save snapshot of this process for /metrics of other processes, atomically replacing the older one."""
+        self._flushed_at = time.monotonic()
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._write(self.snapshot_name, self.snapshot())
+
+    def _write(self, name, snapshot):
+        descriptor, path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(descriptor, 'w') as snapshot_file:
+            json.dump(snapshot, snapshot_file)
+        os.replace(path, os.path.join(self.directory, name))
+
+    @property
+    def flush_due(self):
+        return bool(self.directory) and time.monotonic() - self._flushed_at >= self.flush_interval
+
+    def maybe_flush(self):
+        if self.flush_due:
+            self.flush()
+
+    def snapshots(self):
+        """Snapshots of all processes, the current one taken now, exited ones as single aggregate."""
+        if not self.directory:
+            return [self.snapshot()]
+        self.flush()
+        now = time.time()
+        with self._directory_lock():
+            snapshots = [self._fold_exited()]
+            for path in glob.glob(os.path.join(self.directory, '*.json')):
+                if os.path.basename(path) == self.aggregate_name:
+                    continue
+                snapshot = read_snapshot(path)
+                if snapshot is None:
+                    continue
+                try:
+                    stale = now - os.path.getmtime(path) > self.snapshot_max_age
+                except OSError:
+                    continue
+                if stale:
+                    # Counts of idle process stay in totals, its gauges are outdated.
+                    snapshot.update(cache_entries=0, rate_limits={})
+                snapshots.append(snapshot)
+        return snapshots
+
+    @contextmanager
+    def _directory_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.directory, '.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _fold_exited(self):
+        """
+        Add counters and histograms of exited processes to aggregate snapshot and delete their snapshots, called
+        with directory lock held. Names of folded snapshots are kept until they are deleted, so a snapshot left
+        behind by interrupted fold is not counted twice. Without file locks snapshots are kept as they are.
+        """
+        aggregate = read_snapshot(os.path.join(self.directory, self.aggregate_name)) or {
+            'counters': [], 'histograms': [], 'cache_entries': 0, 'rate_limits': {}, 'folded': []}
+        if fcntl is None:
+            return aggregate
+        exited = []
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            pid = os.path.basename(path).partition('-')[0]
+            if pid.isdigit() and not is_running(int(pid)):
+                exited.append(path)
+        if not exited:
+            return aggregate
+        folded = {name for name in aggregate['folded'] if os.path.exists(os.path.join(self.directory, name))}
+        total = {}
+        merge_shard(total, {(name, labels): value
+                            for name, labels, value in aggregate['counters'] + aggregate['histograms']})
+        for path in exited:
+            snapshot = read_snapshot(path)
+            if snapshot is None or os.path.basename(path) in folded:
+                continue
+            merge_shard(total, {(name, labels): value
+                                for name, labels, value in snapshot['counters'] + snapshot['histograms']})
+            folded.add(os.path.basename(path))
+        aggregate.update(
+            counters=[[name, labels, value] for (name, labels), value in total.items() if not isinstance(value, list)],
+            histograms=[[name, labels, value] for (name, labels), value in total.items() if isinstance(value, list)],
+            folded=sorted(folded))
+        self._write(self.aggregate_name, aggregate)
+        for path in exited:
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+        return aggregate
+
+    def exposition(self):
+        """All processes aggregated in Prometheus text exposition format."""
+        counters, histograms, rate_limits = defaultdict(int), {}, {}
+        cache_entries = 0
+        for snapshot in self.snapshots():
+            for name, labels, value in snapshot['counters']:
+                counters[(name, labels)] += value
+            for name, labels, value in snapshot['histograms']:
+                histogram = histograms.setdefault((name, labels), [0] * len(value))
+                for index, amount in enumerate(value):
+                    histogram[index] += amount
+            cache_entries += snapshot['cache_entries']
+            for token, limit in snapshot['rate_limits'].items():
+                # Processes see the same window of token, the latest one with the fewest calls left is current.
+                known = rate_limits.get(token)
+                if known is None or (limit['reset'], -limit['remaining']) > (known['reset'], -known['remaining']):
+                    rate_limits[token] = limit
+        samples = defaultdict(list)
+        for (name, labels), value in counters.items():
+            samples[name].append((name, labels, value))
+        for (name, labels), value in histograms.items():
+            cumulative = 0
+            for bound, amount in zip(list(METRICS[name][2]) + ['+Inf'], value[:-1]):
+                cumulative += amount
+                bucket_labels = ','.join(filter(None, [labels, f'le="{bound}"']))
+                samples[name].append((f'{name}_bucket', bucket_labels, cumulative))
+            samples[name].append((f'{name}_sum', labels, round(value[-1], 6)))
+            samples[name].append((f'{name}_count', labels, cumulative))
+        samples['github_cache_entries'].append(('github_cache_entries', '', cache_entries))
+        for token_resource, limit in sorted(rate_limits.items()):
+            token, _, resource = token_resource.partition(':')
+            labels = format_labels({'token': token, 'resource': resource})
+            samples['github_rate_limit_remaining'].append(('github_rate_limit_remaining', labels,
+                                                           limit['remaining']))
+            samples['github_rate_limit_reset_timestamp_seconds'].append(
+                ('github_rate_limit_reset_timestamp_seconds', labels, limit['reset']))
+        lines = []
+        for name, (metric_type, help_text, _) in METRICS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            for sample_name, labels, value in samples.get(name, []):
+                lines.append(f'{sample_name}{{{labels}}} {value}' if labels else f'{sample_name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics(directory=settings.POPULARITY_METRICS_DIR, flush_interval=settings.POPULARITY_METRICS_FLUSH_INTERVAL,
+                  snapshot_max_age=settings.POPULARITY_METRICS_SNAPSHOT_MAX_AGE)
+
+
+@contextmanager
+def observed_github_call():
+    """
+    Time Github call for Server-Timing and github_request_duration_seconds histogram, its outcome is reused by
+    readiness check. Caller sets `call['status']` of response, calls failing without response have status="error".
+    """
+    started = time.perf_counter()
+    call = {'status': 'error'}
+    try:
+        with timed('github'):
+            yield call
+    finally:
+        latency = time.perf_counter() - started
+        metrics.observe('github_request_duration_seconds', latency, status=call['status'])
+        github_readiness.record(call['status'], latency)
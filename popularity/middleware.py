@@ -0,0 +1,98 @@
+import asyncio
+import json
+import logging
+import random
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from popularity.metrics import metrics
+from popularity.timing import current_timings, RequestTimings, StackSampler
+
+logger = logging.getLogger('popularity.timing')
+profile_logger = logging.getLogger('popularity.profile')
+
+stack_sampler = StackSampler(interval=settings.POPULARITY_PROFILE_INTERVAL)
+
+
+def view_labels(request):
+    """Labels of request latency: view class and DRF action (HTTP method for views without actions)."""
+    resolver_match = getattr(request, 'resolver_match', None)
+    if resolver_match is None:
+        return {'view': 'unresolved', 'action': request.method.lower()}
+    view = getattr(resolver_match.func, 'cls', None) or getattr(resolver_match.func, 'view_class', None)
+    actions = getattr(resolver_match.func, 'actions', None) or {}
+    return {'view': view.__name__ if view is not None else resolver_match.func.__name__,
+            'action': actions.get(request.method.lower(), request.method.lower())}
+
+
+class ServerTimingMiddleware:
+    """
+    Times phases of request (Github calls, db queries, authentication, serialization) and the total.
+    They are sent in Server-Timing header and logged as JSON line, requests slower than
+    POPULARITY_SLOW_REQUEST_THRESHOLD seconds at WARNING. The total is observed by http_request_duration_seconds
+    metric. With POPULARITY_PROFILE_SLOW_REQUESTS sampled requests are profiled and the hottest stacks of slow ones
+    are logged. Async requests share event loop thread with each other, so they are not profiled.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        timings = self.start()
+        profiled = settings.POPULARITY_PROFILE_SLOW_REQUESTS and \
+            random.random() < settings.POPULARITY_PROFILE_SAMPLE_RATE
+        watch = stack_sampler.watch(threading.get_ident()) if profiled else None
+        try:
+            response = self.get_response(request)
+        finally:
+            current_timings.set(None)
+            stacks = stack_sampler.unwatch(watch) if profiled else None
+        response = self.finish(request, response, timings, stacks)
+        metrics.maybe_flush()
+        return response
+
+    async def __acall__(self, request):
+        timings = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timings.set(None)
+        response = self.finish(request, response, timings, None)
+        if metrics.flush_due:
+            # Snapshot file is written off the event loop.
+            await sync_to_async(metrics.flush, thread_sensitive=False)()
+        return response
+
+    @staticmethod
+    def start():
+        timings = RequestTimings()
+        current_timings.set(timings)
+        return timings
+
+    @staticmethod
+    def finish(request, response, timings, stacks):
+        total = timings.total
+        response['Server-Timing'] = timings.server_timing(total)
+        metrics.observe('http_request_duration_seconds', total, **view_labels(request))
+        slow = total >= settings.POPULARITY_SLOW_REQUEST_THRESHOLD
+        line = dict(method=request.method, path=request.path, status=response.status_code,
+                    **timings.as_dict(total))
+        logger.log(logging.WARNING if slow else logging.INFO, json.dumps(line))
+        if slow and stacks:
+            profile_logger.warning(json.dumps({
+                'method': request.method,
+                'path': request.path,
+                'total_ms': line['total_ms'],
+                'samples': sum(stacks.values()),
+                'stacks': [{'samples': samples, 'stack': list(stack)}
+                           for stack, samples in stacks.most_common(settings.POPULARITY_PROFILE_TOP_STACKS)],
+            }))
+        return response
@@ -0,0 +1,43 @@
+# Generated by Django 3.1.5 on 2026-10-18 06:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('popularity', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='repo',
+            name='forks_count',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='repo',
+            name='github_etag',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='repo',
+            name='popularity',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='repo',
+            name='popularity_fetched_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='repo',
+            name='score',
+            field=models.PositiveIntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='repo',
+            name='stargazers_count',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.5 on 2026-10-18 06:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('popularity', '0002_repo_stored_popularity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='repo',
+            name='read_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.1.5 on 2026-10-18 06:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('popularity', '0003_repo_read_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='repo',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='repo',
+            name='lease_owner',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='repo',
+            name='refresh_due_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
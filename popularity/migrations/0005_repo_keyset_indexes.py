@@ -0,0 +1,35 @@
+# Generated by Django 3.1.5 on 2026-10-18 06:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('popularity', '0004_repo_refresh_lease'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='repo',
+            name='popularity',
+            field=models.CharField(blank=True, default='', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='repo',
+            name='score',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='repo',
+            index=models.Index(fields=['created', 'id'], name='repo_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='repo',
+            index=models.Index(fields=['popularity', 'created', 'id'], name='repo_popularity_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='repo',
+            index=models.Index(fields=['score', 'id'], name='repo_score_id_idx'),
+        ),
+    ]
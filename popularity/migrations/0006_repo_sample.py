@@ -0,0 +1,37 @@
+# Generated by Django 3.1.5 on 2026-10-18 06:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('popularity', '0005_repo_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RepoSample',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.CharField(choices=[('raw', 'raw'), ('hour', 'hourly'), ('day', 'daily')], default='raw', max_length=4)),
+                ('sampled_at', models.DateTimeField()),
+                ('stargazers_count', models.PositiveIntegerField()),
+                ('forks_count', models.PositiveIntegerField()),
+                ('score', models.PositiveIntegerField()),
+                ('repo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='samples', to='popularity.repo')),
+            ],
+            options={
+                'ordering': ['sampled_at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='reposample',
+            index=models.Index(fields=['repo', 'sampled_at'], name='sample_repo_sampled_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reposample',
+            index=models.Index(fields=['resolution', 'repo', 'sampled_at'], name='sample_resolution_repo_idx'),
+        ),
+    ]
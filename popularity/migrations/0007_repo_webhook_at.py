@@ -0,0 +1,18 @@
+# Generated by Django 3.1.5 on 2026-10-18 06:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('popularity', '0006_repo_sample'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='repo',
+            name='webhook_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.1.5 on 2026-10-18 07:00
+
+from django.db import migrations, models
+
+
+def fill_name_keys(apps, schema_editor):
+    Repo = apps.get_model('popularity', 'Repo')
+    repos = list(Repo.objects.only('id', 'name'))
+    for repo in repos:
+        repo.name_key = repo.name.lower()
+    Repo.objects.bulk_update(repos, ['name_key'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('popularity', '0007_repo_webhook_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='repo',
+            name='name_key',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=200),
+        ),
+        migrations.RunPython(fill_name_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.5 on 2026-10-18 07:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('popularity', '0008_repo_name_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='repo',
+            name='updated',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
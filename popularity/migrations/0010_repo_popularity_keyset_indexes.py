@@ -0,0 +1,21 @@
+# Generated by Django 3.1.5 on 2026-10-18 07:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('popularity', '0009_repo_updated'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='repo',
+            index=models.Index(fields=['popularity', 'score', 'id'], name='repo_popularity_score_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='repo',
+            index=models.Index(fields=['popularity', 'name', 'id'], name='repo_popularity_name_idx'),
+        ),
+    ]
@@ -1,26 +1,214 @@
-from django.db import models
+from collections import namedtuple
+from datetime import timedelta
 
-from popularity.utils import get_github_api_response
+from django.conf import settings
+from django.db import models, transaction, connections
+from django.db.models import F, Q
+from django.utils import timezone
+from rest_framework import status
+
+from popularity.utils import fetch_github_repo, normalize_repo_name, calculate_popularity, calculate_score, \
+    GithubRepoCounts, refresh_interval, repo_name_key
+
+
+# Result of popularity lookup. `age` in seconds of served popularity, `warning` code for stale one:
+# 110 served stale while revalidated in background, 111 served stale as Github lookup failed.
+PopularityLookup = namedtuple('PopularityLookup', ['status', 'info', 'age', 'warning'])
+STALE_WARNING = 110
+REVALIDATION_FAILED_WARNING = 111
+
+
+class RepoQuerySet(models.QuerySet):
+
+    def due_for_refresh(self, now):
+        """Repos with refresh due and not leased by any live refresh worker."""
+        return self.filter(Q(refresh_due_at__isnull=True) | Q(refresh_due_at__lte=now),
+                           Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lte=now))
+
+    def claim_refresh_batch(self, owner, size, lease_seconds):
+        """
+        Lease up to `size` most overdue repos to refresh worker `owner` for `lease_seconds`.
+        Rows are locked with SELECT ... FOR UPDATE SKIP LOCKED where db supports it. Elsewhere (SQLite) they are
+        claimed with conditional UPDATE, which skips rows leased by another worker in the meantime.
+        Leases of crashed workers expire and their repos are claimed again.
+        """
+        now = timezone.now()
+        expires_at = now + timedelta(seconds=lease_seconds)
+        candidates = self.due_for_refresh(now).order_by(F('refresh_due_at').asc(nulls_first=True), 'id')
+        with transaction.atomic(using=self.db):
+            if connections[self.db].features.has_select_for_update_skip_locked:
+                repo_ids = list(candidates.select_for_update(skip_locked=True).values_list('id', flat=True)[:size])
+                claimed = self.filter(pk__in=repo_ids)
+            else:
+                repo_ids = list(candidates.values_list('id', flat=True)[:size])
+                claimed = self.due_for_refresh(now).filter(pk__in=repo_ids)
+            claimed.update(lease_owner=owner, lease_expires_at=expires_at)
+        return list(self.filter(lease_owner=owner, lease_expires_at=expires_at)
+                    .order_by(F('refresh_due_at').asc(nulls_first=True), 'id'))
+
+    def release_leases(self, owner):
+        return self.filter(lease_owner=owner).update(lease_owner='', lease_expires_at=None)
 
 
 class Repo(models.Model):
     created = models.DateTimeField(auto_now_add=True)
+    # Version of repo representation, ETag and Last-Modified of its responses are derived from it
+    updated = models.DateTimeField(auto_now=True)
     # Name of github repo should be in github format to identify  github_user/repo_name e.g. facebook/react
     name = models.CharField(max_length=200, blank=True, default='', unique=True)
+    # Lower case name, repos are looked up by name case insensitively as Github does
+    name_key = models.CharField(max_length=200, blank=True, default='', db_index=True, editable=False)
+    # Last counts fetched from Github, popularity is served from them while younger than POPULARITY_MAX_AGE
+    stargazers_count = models.PositiveIntegerField(null=True, blank=True)
+    forks_count = models.PositiveIntegerField(null=True, blank=True)
+    score = models.PositiveIntegerField(null=True, blank=True)
+    popularity = models.CharField(max_length=20, blank=True, default='')
+    popularity_fetched_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    github_etag = models.CharField(max_length=100, blank=True, default='')
+    # Reads of popularity, hot repos are refreshed more often by refresh_popularity worker
+    read_count = models.PositiveIntegerField(default=0)
+    # Refresh queue of refresh_popularity workers, repos are leased to single worker at a time
+    refresh_due_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    lease_owner = models.CharField(max_length=100, blank=True, default='', db_index=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    # Last Github webhook event of repo, counts of watched repos are kept fresh by webhooks instead of polling
+    webhook_at = models.DateTimeField(null=True, blank=True)
+
+    objects = RepoQuerySet.as_manager()
 
     class Meta:
         ordering = ['created']
+        # Keyset pagination of repo list: pages ordered by (created, id), (score, id) or unique name,
+        # optionally filtered by popularity.
+        indexes = [
+            models.Index(fields=['created', 'id'], name='repo_created_id_idx'),
+            models.Index(fields=['popularity', 'created', 'id'], name='repo_popularity_created_idx'),
+            models.Index(fields=['score', 'id'], name='repo_score_id_idx'),
+            models.Index(fields=['popularity', 'score', 'id'], name='repo_popularity_score_idx'),
+            models.Index(fields=['popularity', 'name', 'id'], name='repo_popularity_name_idx'),
+        ]
 
     @property
     def popular_status(self):
-        return get_github_api_response(repo_name=self.name)
+        lookup = self.lookup_popularity()
+        return lookup.status, lookup.info
+
+    def lookup_popularity(self):
+        """
+        Serve stored popularity younger than POPULARITY_MAX_AGE. Older one is still served for
+        POPULARITY_STALE_WHILE_REVALIDATE seconds (caller should revalidate it in background), later it is
+        refreshed from Github. When Github fails, stored popularity is served for POPULARITY_STALE_IF_ERROR seconds.
+        """
+        lookup = self.stored_lookup()
+        if lookup is not None:
+            return lookup
+        age = self.popularity_age
+        _status, info = self.refresh_popularity()
+        return self.refreshed_lookup(age, _status, info)
+
+    def stored_lookup(self):
+        """Lookup served from stored popularity, None when Github has to be asked."""
+        age = self.popularity_age
+        if age is not None and (age < settings.POPULARITY_MAX_AGE or self.is_watched):
+            return PopularityLookup(status.HTTP_200_OK, self.popularity, age, None)
+        if age is not None and age < settings.POPULARITY_MAX_AGE + settings.POPULARITY_STALE_WHILE_REVALIDATE:
+            return PopularityLookup(status.HTTP_200_OK, self.popularity, age, STALE_WARNING)
+        return None
+
+    def refreshed_lookup(self, age, _status, info):
+        """Lookup after refresh from Github, `age` of popularity stored before the refresh."""
+        if _status == status.HTTP_200_OK:
+            return PopularityLookup(_status, self.popularity, 0, None)
+        upstream_failed = _status >= status.HTTP_500_INTERNAL_SERVER_ERROR or \
+            _status in (status.HTTP_403_FORBIDDEN, status.HTTP_429_TOO_MANY_REQUESTS)
+        if upstream_failed and age is not None and \
+                age < settings.POPULARITY_MAX_AGE + settings.POPULARITY_STALE_IF_ERROR:
+            return PopularityLookup(status.HTTP_200_OK, self.popularity, age, REVALIDATION_FAILED_WARNING)
+        return PopularityLookup(_status, info, None, None)
+
+    def refresh_popularity(self):
+        _status, info = fetch_github_repo(repo_name=self.name, known=self.stored_counts)
+        if _status == status.HTTP_200_OK:
+            self.update_popularity(num_stars=info.num_stars, num_forks=info.num_forks, etag=info.etag)
+        return _status, info
+
+    @property
+    def stored_counts(self):
+        if self.popularity_fetched_at is None:
+            return None
+        return GithubRepoCounts(self.stargazers_count, self.forks_count, self.github_etag or None, None, 0)
+
+    @property
+    def popularity_age(self):
+        if self.popularity_fetched_at is None:
+            return None
+        return max(0, int((timezone.now() - self.popularity_fetched_at).total_seconds()))
+
+    def is_popularity_fresh(self):
+        return self.popularity_fetched_at is not None and \
+            (self.popularity_age < settings.POPULARITY_MAX_AGE or self.is_watched)
+
+    @property
+    def is_watched(self):
+        """Webhook events arrived within POPULARITY_WEBHOOK_WATCH_PERIOD, stored counts follow Github."""
+        return self.webhook_at is not None and \
+            (timezone.now() - self.webhook_at).total_seconds() < settings.POPULARITY_WEBHOOK_WATCH_PERIOD
+
+    def update_popularity(self, num_stars, num_forks, etag=None, watched_at=None):
+        """
+        Store counts fetched from Github or, with `watched_at`, received by webhook. Watched repos are polled
+        only when no webhook event arrives for POPULARITY_WEBHOOK_WATCH_PERIOD.
+        """
+        self.stargazers_count = num_stars
+        self.forks_count = num_forks
+        self.score = calculate_score(num_stars=num_stars, num_forks=num_forks)
+        self.popularity = calculate_popularity(num_stars=num_stars, num_forks=num_forks)
+        self.popularity_fetched_at = timezone.now()
+        self.github_etag = etag or ''
+        self.refresh_due_at = self.popularity_fetched_at + timedelta(seconds=refresh_interval(self.score,
+                                                                                               self.read_count))
+        update_fields = ['stargazers_count', 'forks_count', 'score', 'popularity', 'popularity_fetched_at',
+                         'github_etag', 'refresh_due_at', 'updated']
+        if watched_at is not None:
+            self.webhook_at = watched_at
+            self.refresh_due_at = watched_at + timedelta(seconds=settings.POPULARITY_WEBHOOK_WATCH_PERIOD)
+            update_fields.append('webhook_at')
+        self.save(update_fields=update_fields)
+        RepoSample.objects.create(repo=self, sampled_at=self.popularity_fetched_at, stargazers_count=num_stars,
+                                  forks_count=num_forks, score=self.score)
 
     @property
     def github_url(self):
         return f"https://github.com/{self.name}/"
 
     def save(self, *args, **kwargs):
-        self.name = self.name.replace("https://github.com", ''). \
-            replace("http://github.com", ''). \
-            rstrip("/").lstrip("/")
+        self.name = normalize_repo_name(self.name)
+        self.name_key = repo_name_key(self.name)
         super(Repo, self).save(*args, **kwargs)
+
+
+class RepoSample(models.Model):
+    """
+    Counts fetched from Github over time. Raw samples are rolled up to the last sample of every hour, hourly ones
+    to the last sample of every day and daily ones are dropped after retention (see popularity.history).
+    """
+    RAW = 'raw'
+    HOUR = 'hour'
+    DAY = 'day'
+    RESOLUTIONS = [(RAW, 'raw'), (HOUR, 'hourly'), (DAY, 'daily')]
+
+    repo = models.ForeignKey(Repo, related_name='samples', on_delete=models.CASCADE)
+    resolution = models.CharField(max_length=4, choices=RESOLUTIONS, default=RAW)
+    # Time of raw sample, start of hour or day of rolled up one
+    sampled_at = models.DateTimeField()
+    stargazers_count = models.PositiveIntegerField()
+    forks_count = models.PositiveIntegerField()
+    score = models.PositiveIntegerField()
+
+    class Meta:
+        ordering = ['sampled_at']
+        # History of repo is range of (repo, sampled_at), rollups scan old samples of resolution repo by repo.
+        indexes = [
+            models.Index(fields=['repo', 'sampled_at'], name='sample_repo_sampled_at_idx'),
+            models.Index(fields=['resolution', 'repo', 'sampled_at'], name='sample_resolution_repo_idx'),
+        ]
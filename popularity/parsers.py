@@ -0,0 +1,19 @@
+from rest_framework.parsers import BaseParser
+
+from popularity.imports import ndjson_rows, csv_rows
+
+
+class NDJSONParser(BaseParser):
+    """Newline delimited JSON parsed lazily into (line number, name, error) rows while request body is read."""
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        return ndjson_rows(stream)
+
+
+class CSVParser(BaseParser):
+    """CSV parsed lazily into (line number, name, error) rows while request body is read."""
+    media_type = 'text/csv'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        return csv_rows(stream)
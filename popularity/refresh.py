@@ -0,0 +1,198 @@
+import os
+import socket
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F
+from django.utils import timezone
+from rest_framework import status
+
+from popularity.history import rollup_history
+from popularity.metrics import metrics
+from popularity.models import Repo
+from popularity.utils import GithubTokenPool, fetch_github_graphql_repos, github_token_pool
+
+
+class RepoReadCounter:
+    """Buffer of popularity reads per repo, flushed to Repo.read_count at most every flush_interval seconds."""
+
+    def __init__(self, flush_interval):
+        self.flush_interval = flush_interval
+        self._reads = Counter()
+        self._lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+
+    def record(self, repo_id):
+        with self._lock:
+            self._reads[repo_id] += 1
+            flush_due = time.monotonic() - self._flushed_at >= self.flush_interval
+        if flush_due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            reads, self._reads = self._reads, Counter()
+            self._flushed_at = time.monotonic()
+        repo_ids_by_reads = defaultdict(list)
+        for repo_id, amount in reads.items():
+            repo_ids_by_reads[amount].append(repo_id)
+        for amount, repo_ids in repo_ids_by_reads.items():
+            Repo.objects.filter(pk__in=repo_ids).update(read_count=F('read_count') + amount)
+
+
+repo_reads = RepoReadCounter(flush_interval=settings.POPULARITY_READS_FLUSH_INTERVAL)
+
+
+revalidation_executor = ThreadPoolExecutor(max_workers=settings.POPULARITY_REVALIDATION_WORKERS,
+                                           thread_name_prefix='revalidate')
+_revalidating = set()
+_revalidating_lock = threading.Lock()
+
+
+def revalidate_in_background(repo_id):
+    """Refresh stale popularity of repo off the request thread, at most one revalidation per repo at once."""
+    with _revalidating_lock:
+        if repo_id in _revalidating:
+            return
+        _revalidating.add(repo_id)
+    revalidation_executor.submit(_revalidate, repo_id)
+
+
+def _revalidate(repo_id):
+    try:
+        repo = Repo.objects.filter(pk=repo_id).first()
+        if repo is not None and not repo.is_popularity_fresh():
+            repo.refresh_popularity()
+    finally:
+        with _revalidating_lock:
+            _revalidating.discard(repo_id)
+        connection.close()
+
+
+class RefreshWorker:
+    """
+    Keeps stored popularity of all repos fresh. Most overdue repos (Repo.refresh_due_at) are leased in batches,
+    so many workers on many nodes split the table without refreshing the same repo twice. Refreshes are spaced
+    so that all `workers` together use at most `budget_fraction` of hourly Github rate limit. With
+    GITHUB_BACKEND = 'graphql' leased repos are refreshed by one GraphQL request per GITHUB_GRAPHQL_BATCH_SIZE repos.
+    """
+    reads_decay_interval = 60 * 60
+
+    def __init__(self, budget_fraction, workers=1, batch_size=None, owner=None, clock=time.time, sleep=time.sleep):
+        self.budget_fraction = budget_fraction
+        self.workers = workers
+        self.batch_size = batch_size or settings.POPULARITY_REFRESH_BATCH_SIZE
+        self.owner = owner or f'{socket.gethostname()}:{os.getpid()}'
+        self.clock = clock
+        self.sleep = sleep
+        self.started = self.clock()
+        self.refreshed = 0
+        self.failed = 0
+        self.total_lag = 0
+        self.max_lag = 0
+        self._decayed_at = self.started
+        self._rolled_up_at = None
+
+    @property
+    def budget_per_hour(self):
+        tokens = max(1, len(github_token_pool.configured_tokens()))
+        return max(1, int(self.budget_fraction * GithubTokenPool.default_limit * tokens / self.workers))
+
+    @property
+    def spacing(self):
+        return 60 * 60 / self.budget_per_hour
+
+    @property
+    def lease_seconds(self):
+        """Lease covering refresh of whole batch twice, expired leases of crashed workers are taken over."""
+        return int(2 * self.batch_size * self.spacing) + 60
+
+    def refresh(self, repo, fetched=None):
+        """Refresh stored popularity of repo, `fetched` (status, counts) of batched lookup are stored instead."""
+        lag = (timezone.now() - repo.refresh_due_at).total_seconds() if repo.refresh_due_at else 0
+        if fetched is None:
+            _status, _ = repo.refresh_popularity()
+        else:
+            _status, counts = fetched
+            if _status == status.HTTP_200_OK:
+                repo.update_popularity(num_stars=counts.num_stars, num_forks=counts.num_forks)
+        if _status == status.HTTP_200_OK:
+            self.refreshed += 1
+            self.total_lag += max(0, lag)
+            self.max_lag = max(self.max_lag, lag)
+        else:
+            self.failed += 1
+            Repo.objects.filter(pk=repo.pk).update(
+                refresh_due_at=timezone.now() + timedelta(seconds=settings.POPULARITY_REFRESH_MIN_INTERVAL))
+
+    def refresh_batch(self):
+        """Lease and refresh batch of the most overdue repos. Returns amount of refreshed repos."""
+        batch = Repo.objects.claim_refresh_batch(owner=self.owner, size=self.batch_size,
+                                                 lease_seconds=self.lease_seconds)
+        try:
+            if settings.GITHUB_BACKEND == 'graphql':
+                self.refresh_graphql(batch)
+            else:
+                for repo in batch:
+                    self.refresh(repo)
+                    self.sleep(self.spacing)
+        finally:
+            Repo.objects.release_leases(self.owner)
+        return len(batch)
+
+    def refresh_graphql(self, batch):
+        """Refresh repos with one GraphQL request per GITHUB_GRAPHQL_BATCH_SIZE of them, spaced as single calls."""
+        graphql_batch_size = settings.GITHUB_GRAPHQL_BATCH_SIZE
+        for start in range(0, len(batch), graphql_batch_size):
+            repos = batch[start:start + graphql_batch_size]
+            results = fetch_github_graphql_repos([repo.name for repo in repos])
+            for repo in repos:
+                self.refresh(repo, fetched=results[repo.name])
+            self.sleep(self.spacing)
+
+    def decay_reads(self):
+        """Halve read counts every hour, so hotness follows recent traffic."""
+        if self.clock() - self._decayed_at >= self.reads_decay_interval:
+            Repo.objects.filter(read_count__gt=0).update(read_count=F('read_count') / 2)
+            self._decayed_at = self.clock()
+
+    def rollup_history(self):
+        """Roll up popularity history every POPULARITY_HISTORY_ROLLUP_INTERVAL seconds, the first time at start."""
+        if self._rolled_up_at is None or \
+                self.clock() - self._rolled_up_at >= settings.POPULARITY_HISTORY_ROLLUP_INTERVAL:
+            rollup_history()
+            self._rolled_up_at = self.clock()
+
+    def summary(self):
+        elapsed = max(self.clock() - self.started, 1e-9)
+        return {
+            'owner': self.owner,
+            'refreshed': self.refreshed,
+            'failed': self.failed,
+            'per_minute': round(self.refreshed * 60 / elapsed, 2),
+            'avg_lag_seconds': round(self.total_lag / self.refreshed, 2) if self.refreshed else 0,
+            'max_lag_seconds': round(self.max_lag, 2),
+            'due': Repo.objects.due_for_refresh(timezone.now()).count(),
+            'budget_per_hour': self.budget_per_hour,
+        }
+
+    def run(self, once=False, idle_sleep=5, report_interval=60, report=None):
+        reported_at = self.clock()
+        while True:
+            if not self.refresh_batch():
+                if once:
+                    break
+                self.sleep(idle_sleep)
+            self.decay_reads()
+            self.rollup_history()
+            metrics.maybe_flush()
+            if report is not None and self.clock() - reported_at >= report_interval:
+                report(self.summary())
+                reported_at = self.clock()
+        if report is not None:
+            report(self.summary())
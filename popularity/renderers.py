@@ -0,0 +1,47 @@
+import csv
+import io
+
+from rest_framework.renderers import JSONRenderer, BrowsableAPIRenderer, BaseRenderer
+
+from popularity.timing import timed
+
+
+class TimedJSONRenderer(JSONRenderer):
+    """JSONRenderer recording serialization time of request (Server-Timing `serialize`)."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timed('serialize'):
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+class TimedBrowsableAPIRenderer(BrowsableAPIRenderer):
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timed('serialize'):
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+class NDJSONRenderer(JSONRenderer):
+    """Newline delimited JSON. Exports stream their lines, other responses (errors) are rendered as single line."""
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return super().render(data, accepted_media_type, renderer_context) + b'\n'
+
+
+class CSVRenderer(BaseRenderer):
+    """CSV. Exports stream their lines, other responses (errors) are rendered as header and single row."""
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        rows = data if isinstance(data, list) else [data]
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=list(rows[0]) if rows else [])
+        writer.writeheader()
+        writer.writerows(rows)
+        return buffer.getvalue().encode(self.charset)
@@ -0,0 +1,101 @@
+import logging
+import time
+from array import array
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from popularity.models import Repo
+from popularity.utils import POPULAR_REPO_RESULT, NOT_POPULAR_REPO_RESULT
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+logger = logging.getLogger('popularity.scoring')
+
+
+class Scorer:
+    """
+    Scores and popularity of whole columns of stars and forks at once by vectorized NumPy array operations.
+    Without NumPy (degraded mode) columns are scored by a Python loop over compact arrays, about hundred times
+    slower. Weights and threshold default to POPULARITY_STARS_WEIGHT, POPULARITY_FORKS_WEIGHT and
+    POPULARITY_THRESHOLD.
+    """
+
+    def __init__(self, stars_weight=None, forks_weight=None, threshold=None):
+        self.stars_weight = settings.POPULARITY_STARS_WEIGHT if stars_weight is None else stars_weight
+        self.forks_weight = settings.POPULARITY_FORKS_WEIGHT if forks_weight is None else forks_weight
+        self.threshold = settings.POPULARITY_THRESHOLD if threshold is None else threshold
+
+    def scores(self, stars, forks):
+        if numpy is not None:
+            scores = numpy.asarray(stars) * self.stars_weight + numpy.asarray(forks) * self.forks_weight
+            return scores.astype(numpy.int64)
+        return array('q', [int(num_stars * self.stars_weight + num_forks * self.forks_weight)
+                           for num_stars, num_forks in zip(stars, forks)])
+
+    def popular(self, scores):
+        if numpy is not None:
+            return numpy.asarray(scores) >= self.threshold
+        return array('b', [score >= self.threshold for score in scores])
+
+
+def load_columns(queryset, chunk_size=None):
+    """
+    (ids, stars, forks, scores, popular) columns of scored repos as arrays of 64 bit integers
+    (8 bytes per value instead of a Python object), read from db cursor in chunks.
+    """
+    columns = [array('q') for _ in range(5)]
+    rows = queryset.filter(score__isnull=False).order_by('id').values_list(
+        'id', 'stargazers_count', 'forks_count', 'score', 'popularity')
+    for repo_id, num_stars, num_forks, score, popularity in rows.iterator(
+            chunk_size=chunk_size or settings.POPULARITY_EXPORT_CHUNK_SIZE):
+        for column, value in zip(columns, (repo_id, num_stars, num_forks, score, popularity == POPULAR_REPO_RESULT)):
+            column.append(value)
+    if numpy is not None:
+        return [numpy.frombuffer(column, dtype=numpy.int64) for column in columns]
+    return columns
+
+
+def rescore(scorer, queryset=None, apply=False, batch_size=None):
+    """
+    Score all stored repos with `scorer`, e.g. to see what flips with other threshold. With `apply` changed scores
+    and popularity are saved in batches of `batch_size`. Returns counts of scored, changed and flipped repos.
+    """
+    ids, stars, forks, scores, popular = load_columns(Repo.objects.all() if queryset is None else queryset)
+    if numpy is None:
+        logger.warning("NumPy not installed, repos are scored by Python loop.")
+    started = time.perf_counter()
+    new_scores = scorer.scores(stars, forks)
+    new_popular = scorer.popular(new_scores)
+    if numpy is not None:
+        popular = popular.astype(bool)
+        changed = numpy.flatnonzero((new_scores != scores) | (new_popular != popular)).tolist()
+        to_popular = int(numpy.count_nonzero(new_popular & ~popular))
+        to_not_popular = int(numpy.count_nonzero(popular & ~new_popular))
+    else:
+        changed = [index for index in range(len(ids))
+                   if new_scores[index] != scores[index] or new_popular[index] != popular[index]]
+        to_popular = sum(1 for index in changed if new_popular[index] and not popular[index])
+        to_not_popular = sum(1 for index in changed if popular[index] and not new_popular[index])
+    seconds = time.perf_counter() - started
+    if apply:
+        batch_size = batch_size or settings.POPULARITY_IMPORT_BATCH_SIZE
+        updated = timezone.now()
+        for start in range(0, len(changed), batch_size):
+            with transaction.atomic():
+                Repo.objects.bulk_update([
+                    Repo(id=int(ids[index]), score=int(new_scores[index]), updated=updated,
+                         popularity=POPULAR_REPO_RESULT if new_popular[index] else NOT_POPULAR_REPO_RESULT)
+                    for index in changed[start:start + batch_size]], ['score', 'popularity', 'updated'])
+    return {
+        'scored': len(ids),
+        'changed': len(changed),
+        'to_popular': to_popular,
+        'to_not_popular': to_not_popular,
+        'scoring_ms': round(seconds * 1000, 3),
+        'applied': apply,
+    }
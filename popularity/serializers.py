@@ -1,6 +1,8 @@
+from django.conf import settings
 from rest_framework import serializers
 
-from popularity.models import Repo
+from popularity.models import Repo, RepoSample
+from popularity.utils import repo_name_key, GITHUB_REPO_NAME
 
 
 class RepoSerializer(serializers.HyperlinkedModelSerializer):
@@ -12,4 +14,45 @@ class RepoSerializer(serializers.HyperlinkedModelSerializer):
 class RepoSerializerDetail(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = Repo
-        fields = ['id', 'created', 'name', 'github_url', 'url']
+        fields = ['id', 'created', 'name', 'github_url', 'url', 'stargazers_count', 'forks_count', 'score',
+                  'popularity', 'popularity_fetched_at']
+        read_only_fields = ['stargazers_count', 'forks_count', 'score', 'popularity', 'popularity_fetched_at']
+
+
+class BulkPopularitySerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False, default=list)
+    names = serializers.ListField(child=serializers.CharField(max_length=200), required=False, default=list)
+
+    def validate(self, attrs):
+        amount = len(attrs['ids']) + len(attrs['names'])
+        if not amount:
+            raise serializers.ValidationError("Provide ids or names of repos.")
+        if amount > settings.GITHUB_BULK_MAX_REPOS:
+            raise serializers.ValidationError(f"Up to {settings.GITHUB_BULK_MAX_REPOS} repos could be checked at once.")
+        return attrs
+
+
+class RepoExportFilterSerializer(serializers.Serializer):
+    popular = serializers.BooleanField(required=False)
+    updated_since = serializers.DateTimeField(required=False)
+
+
+class RepoHistoryFilterSerializer(serializers.Serializer):
+    since = serializers.DateTimeField(required=False)
+    until = serializers.DateTimeField(required=False)
+    resolution = serializers.ChoiceField(choices=RepoSample.RESOLUTIONS, required=False)
+
+
+class PopularityQuerySerializer(serializers.Serializer):
+    repo = serializers.CharField(max_length=200)
+
+    @staticmethod
+    def validate_repo(value):
+        name = repo_name_key(value.strip())
+        if not GITHUB_REPO_NAME.match(name):
+            raise serializers.ValidationError("Repo name not in github_user/repo_name format.")
+        return name
+
+
+class LeaderboardQuerySerializer(serializers.Serializer):
+    limit = serializers.IntegerField(min_value=1, max_value=settings.POPULARITY_LEADERBOARD_MAX_LIMIT, default=100)
@@ -1,21 +1,72 @@
-from unittest.mock import patch
-
-from django.test import TestCase
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import tempfile
+from datetime import timedelta
+from io import StringIO
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import skipUnless
+from unittest.mock import Mock, patch
+
+import requests
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import TestCase, override_settings, AsyncRequestFactory
 # Create your tests here.
 from django.urls import resolve, reverse
+from django.utils import timezone
 from djoser.urls.base import User
 from rest_framework import status
-
-from popularity import views
-from popularity.models import Repo
-from popularity.utils import calculate_popularity, POPULAR_REPO_RESULT, NOT_POPULAR_REPO_RESULT
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from benchmarks.fake_github import FakeGithubServer
+from benchmarks.fake_memcached import FakeMemcachedServer
+from popularity import views, async_views, scoring
+from popularity.authentication import token_users
+from popularity.async_client import async_fetch_github_repo
+from popularity.exports import export_rows
+from popularity.health import github_readiness
+from popularity.history import ROLLUP_LOCK_KEY, rollup_history
+from popularity.imports import RepoImport, ndjson_rows
+from popularity.metrics import Metrics
+from popularity.middleware import ServerTimingMiddleware
+from popularity.models import Repo, RepoSample
+from popularity.refresh import RefreshWorker, RepoReadCounter
+from popularity.scoring import Scorer, rescore
+from popularity.timing import StackSampler
+from popularity.utils import calculate_popularity, POPULAR_REPO_RESULT, NOT_POPULAR_REPO_RESULT, github_cache, \
+    get_github_api_response, GithubRepoCache, refresh_interval, github_session, GithubRetry, bulk_get_github_api_response, \
+    GithubTokenPool, GithubTokensExhausted, github_token_pool, SingleFlight, normalize_repo_name
+from popularity.webhooks import webhook_batcher
 
 WRONG_TOKEN_VALUE_GOOD_FORMAT = "657e8d9bae9a642fb24503ff2dffb70c5e904401"
 
 
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'KEY_PREFIX': 'popularity',
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
+    }
+})
+class PopularityTestCase(TestCase):
+    """Tests run against in-process cache, so they neither leave cache files behind nor touch cache of servers."""
+
+
 class MockRequestsToGithubPopularRepo:
     def __init__(self):
         self.status_code = 200
+        self.headers = {}
 
     @staticmethod
     def json():
@@ -28,6 +79,7 @@ class MockRequestsToGithubPopularRepo:
 class MockRequestsToGithubNotPopularRepo:
     def __init__(self):
         self.status_code = 200
+        self.headers = {}
 
     @staticmethod
     def json():
@@ -41,9 +93,37 @@ class MockRequestsToGithubNotExistingRepo:
     def __init__(self):
         self.status_code = 404
         self.reason = "not existing"
+        self.headers = {}
+
+
+class MockRequestsToGithubPopularRepoWithEtag(MockRequestsToGithubPopularRepo):
+    def __init__(self):
+        super().__init__()
+        self.headers = {'ETag': '"etag_value"'}
+
+
+class MockRequestsToGithubNotModified:
+    def __init__(self):
+        self.status_code = 304
+        self.reason = "Not Modified"
+        self.headers = {'ETag': '"etag_value"'}
+
 
+class MockRequestsToGithubServerError:
+    def __init__(self):
+        self.status_code = 502
+        self.reason = "Bad Gateway"
+        self.headers = {}
 
-class SmokeTests(TestCase):
+
+class MockRequestsToGithubRateLimited:
+    def __init__(self):
+        self.status_code = 403
+        self.reason = "rate limit exceeded"
+        self.headers = {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': str(int(time.time()) + 600)}
+
+
+class SmokeTests(PopularityTestCase):
     """Test Repo models, urls smoke test"""
 
     def setUp(self):
@@ -69,10 +149,11 @@ class SmokeTests(TestCase):
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
 
 
-class SingleRepoTest(TestCase):
+class SingleRepoTest(PopularityTestCase):
     """Test Addition of new repos, details about single repo"""
 
     def setUp(self):
+        github_cache.clear()
         self.user = User.objects.create_user('test', 'test@email.com', 'testtest')
         self.client.force_login(self.user)
 
@@ -119,7 +200,7 @@ class SingleRepoTest(TestCase):
         self.assertEquals(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
 
     @patch("os.environ.get", return_value="test_personal_access_token_in_env")
-    @patch("requests.get", return_value=MockRequestsToGithubPopularRepo())
+    @patch("popularity.utils.github_session.get", return_value=MockRequestsToGithubPopularRepo())
     def test_single_repo_popularity_valid_response_from_github_popular(self, mocked_env, mocked_requests):
         """Test popularity when token granted on server and github api responsible. Check popular repo."""
         response = self.call_github_rest_api_for_popularity()
@@ -127,7 +208,7 @@ class SingleRepoTest(TestCase):
         self.assertEquals(response.json(), 'popular')
 
     @patch("os.environ.get", return_value="test_personal_access_token_in_env")
-    @patch("requests.get", return_value=MockRequestsToGithubNotPopularRepo())
+    @patch("popularity.utils.github_session.get", return_value=MockRequestsToGithubNotPopularRepo())
     def test_single_repo_popularity_valid_response_from_github_not_popular(self, mocked_env, mocked_requests):
         """Test popularity when token granted on server and github api responsible. Check not popular repo."""
         response = self.call_github_rest_api_for_popularity()
@@ -142,7 +223,7 @@ class SingleRepoTest(TestCase):
         return response
 
 
-class RepoListTest(TestCase):
+class RepoListTest(PopularityTestCase):
     """Test Addition of new repos, details about single repo"""
     repo_list_url = reverse('repo-list')
 
@@ -152,21 +233,50 @@ class RepoListTest(TestCase):
 
     def test_pagination_visible(self):
         repo_name = "test_user/test_name"
-        initial_count = Repo.objects.count()
-        amount_of_new_repo = 100
+        amount_of_new_repo = 25
 
         for i in range(amount_of_new_repo):
             self.client.post(f'{self.repo_list_url}', data={"name": f"{repo_name}{i}"})
-        actual_count = initial_count + amount_of_new_repo
-        self.assertEquals(actual_count, initial_count + amount_of_new_repo)
         response_json = self.client.get(self.repo_list_url).json()
-        self.assertEquals(response_json.get('count'), actual_count)
-        self.assertEquals(response_json.get('next'), f'http://testserver{self.repo_list_url}?page=2')
+        self.assertNotIn('count', response_json)
         self.assertEquals(response_json.get('previous'), None)
-        response_next_page_json = self.client.get(f'http://testserver{self.repo_list_url}?page=2').json()
-        self.assertEquals(response_next_page_json.get('count'), actual_count)
-        self.assertEquals(response_next_page_json.get('previous'), f'http://testserver{self.repo_list_url}')
-        self.assertEquals(response_next_page_json.get('next'), f'http://testserver{self.repo_list_url}?page=3')
+        self.assertEquals(len(response_json.get('results')), 10)
+        response_next_page_json = self.client.get(response_json.get('next')).json()
+        self.assertEquals([repo['name'] for repo in response_next_page_json.get('results')],
+                          [f"{repo_name}{i}" for i in range(10, 20)])
+        response_previous_page_json = self.client.get(response_next_page_json.get('previous')).json()
+        self.assertEquals(response_previous_page_json.get('results'), response_json.get('results'))
+        response_last_page_json = self.client.get(response_next_page_json.get('next')).json()
+        self.assertEquals(len(response_last_page_json.get('results')), 5)
+        self.assertEquals(response_last_page_json.get('next'), None)
+
+    def test_pages_of_repos_created_at_once(self):
+        created = timezone.now()
+        Repo.objects.bulk_create([Repo(name=f"user/repo{i}") for i in range(15)])
+        Repo.objects.update(created=created)
+        names, url = [], self.repo_list_url
+        while url:
+            with self.assertNumQueries(3):
+                response_json = self.client.get(url).json()
+            names += [repo['name'] for repo in response_json.get('results')]
+            url = response_json.get('next')
+        self.assertEquals(names, [f"user/repo{i}" for i in range(15)])
+
+    def test_filter_and_ordering(self):
+        for name, stars in [("facebook/react", 200000), ("facebook/jest", 30), ("django/django", 60000)]:
+            Repo.objects.create(name=name).update_popularity(num_stars=stars, num_forks=0)
+        Repo.objects.create(name="facebook/unknown")
+        response_json = self.client.get(self.repo_list_url, {'name': 'facebook/', 'ordering': '-score'}).json()
+        self.assertEquals([repo['name'] for repo in response_json.get('results')], ["facebook/react", "facebook/jest"])
+        response_json = self.client.get(self.repo_list_url, {'popularity': POPULAR_REPO_RESULT, 'ordering': 'name',
+                                                             'page_size': 1}).json()
+        self.assertEquals([repo['name'] for repo in response_json.get('results')], ["django/django"])
+        response_json = self.client.get(response_json.get('next')).json()
+        self.assertEquals([repo['name'] for repo in response_json.get('results')], ["facebook/react"])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.repo_list_url, {'cursor': 'cD1ub3Rqc29u'})
+        self.assertEquals(response.status_code, status.HTTP_404_NOT_FOUND)
 
     def test_check_name_addition(self):
         repo_name = "test_user/test_name"
@@ -194,10 +304,11 @@ class RepoListTest(TestCase):
         self.assertEquals(response.get('name'), repo_name.replace('http://github.com/', ''))
 
 
-class AuthorizationSmokeTest(TestCase):
+class AuthorizationSmokeTest(PopularityTestCase):
     """Smoke test if only auth users could use repos urls"""
 
     def setUp(self):
+        github_cache.clear()
         self.test_id = 3
         not_existing_repo_name = 'repo_user/repo_name'
         self.repo3 = Repo.objects.create(name=not_existing_repo_name, id=self.test_id)
@@ -213,25 +324,25 @@ class AuthorizationSmokeTest(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
     @patch("os.environ.get", return_value="proper_and_working_personal_access_token_value")
-    @patch("requests.get", return_value=MockRequestsToGithubNotExistingRepo())
+    @patch("popularity.utils.github_session.get", return_value=MockRequestsToGithubNotExistingRepo())
     def test_single_repo_nonexisting_in_github(self, mocked, mocked_requests):
         response = self.client.get(f'/api/v1/repos/{self.test_id}/popular/', follow=True)
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
     @patch("os.environ.get", return_value="proper_and_working_personal_access_token_value")
-    @patch("requests.get", return_value=MockRequestsToGithubNotExistingRepo())
+    @patch("popularity.utils.github_session.get", return_value=MockRequestsToGithubNotExistingRepo())
     def test_single_repo_popular_nonexisting_in_github(self, mocked, mocked_requests):
         response = self.client.get(f'/api/v1/repos/{self.test_id}/popular/', follow=True)
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
     @patch("os.environ.get", return_value="proper_and_working_personal_access_token_value")
-    @patch("requests.get", return_value=MockRequestsToGithubPopularRepo())
+    @patch("popularity.utils.github_session.get", return_value=MockRequestsToGithubPopularRepo())
     def test_single_repo_popular_existing_in_github(self, mocked, mocked_requests):
         response = self.client.get(f'/api/v1/repos/{self.test_id}/popular/', follow=True)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
 
-class DocumentationTest(TestCase):
+class DocumentationTest(PopularityTestCase):
     """Check availability of Doc pages """
 
     def test_schema_json_available(self):
@@ -251,7 +362,7 @@ class DocumentationTest(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
 
-class PopularityCheckerTest(TestCase):
+class PopularityCheckerTest(PopularityTestCase):
     """Check if calculate popularity function returns proper results for different amount of stars, forks"""
 
     def test_check_score_positive_cases(self):
@@ -268,10 +379,18 @@ class PopularityCheckerTest(TestCase):
         self.assertEquals(calculate_popularity(num_stars=99, num_forks=200), NOT_POPULAR_REPO_RESULT)
         self.assertEquals(calculate_popularity(num_stars=0, num_forks=0), NOT_POPULAR_REPO_RESULT)
 
+    @override_settings(POPULARITY_STARS_WEIGHT=1, POPULARITY_FORKS_WEIGHT=5, POPULARITY_THRESHOLD=1000)
+    def test_configured_weights_and_threshold(self):
+        self.assertEquals(calculate_popularity(num_stars=500, num_forks=100), POPULAR_REPO_RESULT)
+        self.assertEquals(calculate_popularity(num_stars=900, num_forks=0), NOT_POPULAR_REPO_RESULT)
+
 
-class HealthCheckTest(TestCase):
+class HealthCheckTest(PopularityTestCase):
     """Check if health-check pages are present and properly serviced"""
 
+    def setUp(self):
+        github_cache.clear()
+
     def test_health_check_url(self):
         found = resolve('/health_check/')
         self.assertEquals(found.func.view_class, views.HealthCheckView)
@@ -282,7 +401,7 @@ class HealthCheckTest(TestCase):
         self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
 
     @patch("os.environ.get", return_value="proper_and_working_personal_access_token_value")
-    @patch("requests.get", return_value=MockRequestsToGithubPopularRepo())
+    @patch("popularity.utils.github_session.get", return_value=MockRequestsToGithubPopularRepo())
     def test_health_check_connection_to_github_ok_token_ok(self, mocked_env, mocked_requests):
         response = self.client.get('/health_check/', follow=True)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
@@ -296,3 +415,1202 @@ class HealthCheckTest(TestCase):
     def test_health_check_connection_to_github_token_value_wrong(self, mocked_env):
         response = self.client.get('/health_check/', follow=True)
         self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class GithubRepoCacheTest(PopularityTestCase):
+    """Check conditional-request cache used for lookups of Github Rest Api"""
+    repo_name = "facebook/react"
+
+    def setUp(self):
+        github_cache.clear()
+
+    @patch("os.environ.get", return_value="proper_and_working_personal_access_token_value")
+    @patch("popularity.utils.github_session.get", return_value=MockRequestsToGithubPopularRepoWithEtag())
+    def test_fresh_entry_served_without_github_call(self, mocked_requests, mocked_env):
+        self.assertEquals(get_github_api_response(self.repo_name), (status.HTTP_200_OK, POPULAR_REPO_RESULT))
+        self.assertEquals(get_github_api_response(self.repo_name), (status.HTTP_200_OK, POPULAR_REPO_RESULT))
+        self.assertEquals(mocked_requests.call_count, 1)
+        self.assertEquals(github_cache.hits, 1)
+        self.assertEquals(github_cache.misses, 1)
+
+    @patch("os.environ.get", return_value="proper_and_working_personal_access_token_value")
+    def test_expired_entry_revalidated_with_etag(self, mocked_env):
+        with patch("popularity.utils.github_session.get", return_value=MockRequestsToGithubPopularRepoWithEtag()):
+            get_github_api_response(self.repo_name)
+        with patch.object(github_cache, 'ttl', 0), \
+                patch("popularity.utils.github_session.get", return_value=MockRequestsToGithubNotModified()) as mocked_requests:
+            self.assertEquals(get_github_api_response(self.repo_name), (status.HTTP_200_OK, POPULAR_REPO_RESULT))
+        self.assertEquals(mocked_requests.call_args[1]['headers']['If-None-Match'], '"etag_value"')
+        self.assertEquals(github_cache.revalidations, 1)
+
+    def test_least_recently_used_entry_evicted(self):
+        cache = GithubRepoCache(max_size=2, ttl=60)
+        cache.set("user/first", 1, 1)
+        cache.set("user/second", 2, 2)
+        cache.get("user/first")
+        cache.set("user/third", 3, 3)
+        self.assertIsNone(cache.get("user/second"))
+        self.assertIsNotNone(cache.get("user/first"))
+        self.assertEquals(cache.evictions, 1)
+
+
+class GithubClientTest(PopularityTestCase):
+    """Check pooled client used for communication with Github Rest Api"""
+
+    def setUp(self):
+        github_cache.clear()
+
+    def test_session_pooled_with_retries(self):
+        adapter = github_session.get_adapter(settings.GITHUB_API_URL)
+        self.assertIsInstance(adapter.max_retries, GithubRetry)
+        self.assertEquals(adapter.max_retries.total, settings.GITHUB_MAX_RETRIES)
+        self.assertEquals(adapter._pool_maxsize, settings.GITHUB_POOL_MAXSIZE)
+
+    @patch("os.environ.get", return_value="proper_and_working_personal_access_token_value")
+    @patch("popularity.utils.github_session.get", side_effect=requests.exceptions.ReadTimeout())
+    def test_timeout_reported_as_gateway_timeout(self, mocked_requests, mocked_env):
+        _status, _ = get_github_api_response("facebook/react")
+        self.assertEquals(_status, status.HTTP_504_GATEWAY_TIMEOUT)
+        self.assertEquals(mocked_requests.call_args[1]['timeout'],
+                          (settings.GITHUB_CONNECT_TIMEOUT, settings.GITHUB_READ_TIMEOUT))
+
+    def test_retry_only_secondary_rate_limit_forbidden(self):
+        retry = GithubRetry(total=2, status_forcelist=[403, 502])
+        self.assertFalse(retry.is_retry('GET', 403))
+        self.assertTrue(retry.is_retry('GET', 403, has_retry_after=True))
+        self.assertTrue(retry.is_retry('GET', 502))
+        self.assertFalse(retry.is_retry('GET', 404))
+
+    def test_backoff_jittered_within_exponential_bound(self):
+        retry = GithubRetry(total=5, backoff_factor=1)
+        for _ in range(3):
+            retry = retry.increment(method='GET', url='/repos/facebook/react')
+        for _ in range(20):
+            self.assertTrue(0 <= retry.get_backoff_time() <= 4)
+
+
+class BulkPopularityTest(PopularityTestCase):
+    """Check popularity of many repos checked in one call"""
+    bulk_url = reverse('repo-popular-bulk')
+
+    def setUp(self):
+        github_cache.clear()
+        self.repo = Repo.objects.create(name='facebook/react')
+        self.user = User.objects.create_user('test', 'test@email.com', 'testtest')
+        self.client.force_login(self.user)
+
+    @staticmethod
+    def github_response_by_url(url, **kwargs):
+        if url.endswith('/not_existing'):
+            return MockRequestsToGithubNotExistingRepo()
+        return MockRequestsToGithubPopularRepo()
+
+    @patch("os.environ.get", return_value="proper_and_working_personal_access_token_value")
+    def test_results_reported_per_repo(self, mocked_env):
+        with patch("popularity.utils.github_session.get", side_effect=self.github_response_by_url):
+            response = self.client.post(self.bulk_url, data={
+                "ids": [self.repo.id, 999],
+                "names": ["https://github.com/user/not_existing", "facebook/react"]
+            }, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {
+            "facebook/react": {"id": self.repo.id, "status": 200, "result": POPULAR_REPO_RESULT},
+            "user/not_existing": {"id": None, "status": 404, "result": "not existing"},
+            "999": {"id": 999, "status": 404, "result": "Not found."},
+        })
+
+    @patch("os.environ.get", return_value="proper_and_working_personal_access_token_value")
+    def test_invalid_names_not_looked_up(self, mocked_env):
+        invalid = ["a/b/../../user", "a/b?x=1", "a/..", "a/b#c"]
+        with patch("popularity.utils.github_session.get", side_effect=self.github_response_by_url) as mocked:
+            response = self.client.post(self.bulk_url, data={"names": invalid + ["facebook/react"]},
+                                        content_type='application/json')
+        self.assertEqual(mocked.call_count, 1)
+        results = response.json()
+        self.assertEqual(results.pop("facebook/react")["status"], 200)
+        self.assertEqual(sorted(results), sorted(invalid))
+        self.assertEqual({result["status"] for result in results.values()}, {400})
+
+    @patch("os.environ.get", return_value="proper_and_working_personal_access_token_value")
+    def test_lookups_done_concurrently(self, mocked_env):
+        def slow_github_response(url, **kwargs):
+            time.sleep(0.2)
+            return MockRequestsToGithubPopularRepo()
+
+        names = [f"user/repo{i}" for i in range(8)]
+        start = time.monotonic()
+        with patch("popularity.utils.github_session.get", side_effect=slow_github_response):
+            response = self.client.post(self.bulk_url, data={"names": names}, content_type='application/json')
+        self.assertLess(time.monotonic() - start, 0.2 * len(names) / 2)
+        self.assertEqual(len(response.json()), len(names))
+
+    def test_empty_batch_rejected(self):
+        response = self.client.post(self.bulk_url, data={}, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@patch.dict(os.environ, {"PERSONAL_ACCESS_TOKEN": "proper_and_working_personal_access_token_value"})
+class GraphqlBackendTest(PopularityTestCase):
+    """Check batched lookups with Github GraphQL Api against local fake Github server"""
+
+    def setUp(self):
+        github_cache.clear()
+        self.github = FakeGithubServer(repos={"facebook/react": (200000, 40000), "user/small": (10, 1)}).start()
+        self.addCleanup(self.github.stop)
+
+    def test_many_repos_looked_up_in_batches(self):
+        with override_settings(GITHUB_BACKEND='graphql', GITHUB_GRAPHQL_BATCH_SIZE=2,
+                               GITHUB_GRAPHQL_URL=f'{self.github.url}/graphql'):
+            results = bulk_get_github_api_response(["facebook/react", "user/small", "user/not_existing"])
+        self.assertEquals(results, {
+            "facebook/react": (status.HTTP_200_OK, POPULAR_REPO_RESULT),
+            "user/small": (status.HTTP_200_OK, NOT_POPULAR_REPO_RESULT),
+            "user/not_existing": (status.HTTP_404_NOT_FOUND, "Not Found"),
+        })
+        self.assertEquals(self.github.calls, 2)
+
+    def test_graphql_results_cached(self):
+        with override_settings(GITHUB_BACKEND='graphql', GITHUB_GRAPHQL_URL=f'{self.github.url}/graphql'):
+            bulk_get_github_api_response(["facebook/react"])
+            bulk_get_github_api_response(["facebook/react"])
+        self.assertEquals(self.github.calls, 1)
+        self.assertEquals(github_cache.hits, 1)
+
+    def test_failed_batch_reported_for_its_repos(self):
+        def batch_failing_for_small(repo_names):
+            if "user/small" in repo_names:
+                raise ValueError("malformed response")
+            return {repo_name: (status.HTTP_404_NOT_FOUND, "Not Found") for repo_name in repo_names}
+
+        with override_settings(GITHUB_BACKEND='graphql', GITHUB_GRAPHQL_BATCH_SIZE=1), \
+                patch("popularity.utils._get_github_graphql_batch", side_effect=batch_failing_for_small):
+            results = bulk_get_github_api_response(["user/small", "user/not_existing"])
+        self.assertEquals(results, {
+            "user/small": (status.HTTP_500_INTERNAL_SERVER_ERROR, "Github GraphQL Api response not processed"),
+            "user/not_existing": (status.HTTP_404_NOT_FOUND, "Not Found"),
+        })
+
+
+class GithubTokenPoolTest(PopularityTestCase):
+    """Check scheduling of lookups over many PERSONAL ACCESS TOKENs"""
+
+    def setUp(self):
+        github_cache.clear()
+        github_token_pool.clear()
+        self.addCleanup(github_token_pool.clear)
+
+    @patch.dict(os.environ, {"PERSONAL_ACCESS_TOKENS": "token_a, token_b", "PERSONAL_ACCESS_TOKEN": "token_c"})
+    def test_token_with_most_remaining_budget_chosen(self):
+        pool = GithubTokenPool()
+        reset = str(int(time.time()) + 600)
+        pool.update("token_a", {'X-RateLimit-Remaining': '10', 'X-RateLimit-Reset': reset})
+        pool.update("token_b", {'X-RateLimit-Remaining': '4000', 'X-RateLimit-Reset': reset})
+        pool.update("token_c", {'X-RateLimit-Remaining': '300', 'X-RateLimit-Reset': reset})
+        self.assertEquals(pool.acquire(), "token_b")
+
+    @patch.dict(os.environ, {"PERSONAL_ACCESS_TOKENS": "token_a,token_b", "PERSONAL_ACCESS_TOKEN": ""})
+    def test_exhausted_tokens_parked_until_reset(self):
+        pool = GithubTokenPool()
+        pool.update("token_a", {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': str(int(time.time()) + 60)})
+        pool.update("token_b", {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': str(int(time.time()) - 1)})
+        self.assertEquals(pool.acquire(), "token_b")
+        pool.update("token_b", {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': str(int(time.time()) + 30)})
+        with self.assertRaises(GithubTokensExhausted) as exhausted:
+            pool.acquire()
+        self.assertTrue(0 < exhausted.exception.retry_after <= 31)
+
+    @patch.dict(os.environ, {"PERSONAL_ACCESS_TOKENS": "token_a,token_b", "PERSONAL_ACCESS_TOKEN": ""})
+    def test_rate_limited_lookup_moved_to_next_token(self):
+        responses = [MockRequestsToGithubRateLimited(), MockRequestsToGithubPopularRepo()]
+        with patch("popularity.utils.github_session.get", side_effect=responses) as mocked_requests:
+            self.assertEquals(get_github_api_response("facebook/react"), (status.HTTP_200_OK, POPULAR_REPO_RESULT))
+        used_tokens = [call[1]['headers']['Authorization'] for call in mocked_requests.call_args_list]
+        self.assertEquals(len(set(used_tokens)), 2)
+
+    @patch.dict(os.environ, {"PERSONAL_ACCESS_TOKENS": "token_a", "PERSONAL_ACCESS_TOKEN": ""})
+    @patch("popularity.utils.github_session.get", return_value=MockRequestsToGithubRateLimited())
+    def test_exhausted_pool_answered_with_retry_after(self, mocked_requests):
+        repo = Repo.objects.create(name='facebook/react')
+        self.client.force_login(User.objects.create_user('test', 'test@email.com', 'testtest'))
+        response = self.client.get(f'/api/v1/repos/{repo.id}/popular/')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertTrue(int(response['Retry-After']) > 0)
+        self.assertEquals(mocked_requests.call_count, 1)
+
+
+@patch.dict(os.environ, {"PERSONAL_ACCESS_TOKEN": "proper_and_working_personal_access_token_value"})
+class StoredPopularityTest(PopularityTestCase):
+    """Check popularity served from counts stored on Repo"""
+
+    def setUp(self):
+        github_cache.clear()
+        self.repo = Repo.objects.create(name='facebook/react')
+        self.user = User.objects.create_user('test', 'test@email.com', 'testtest')
+        self.client.force_login(self.user)
+
+    @patch("popularity.utils.github_session.get", return_value=MockRequestsToGithubPopularRepoWithEtag())
+    def test_counts_stored_after_lookup(self, mocked_requests):
+        response = self.client.get(f'/api/v1/repos/{self.repo.id}/popular/')
+        self.assertEqual(response.json(), POPULAR_REPO_RESULT)
+        self.repo.refresh_from_db()
+        self.assertEquals((self.repo.stargazers_count, self.repo.forks_count, self.repo.score), (500, 200, 900))
+        self.assertEquals(self.repo.popularity, POPULAR_REPO_RESULT)
+        self.assertEquals(self.repo.github_etag, '"etag_value"')
+        self.assertIsNotNone(self.repo.popularity_fetched_at)
+
+    @patch("popularity.utils.github_session.get")
+    def test_fresh_popularity_served_from_db(self, mocked_requests):
+        self.repo.update_popularity(num_stars=10, num_forks=0)
+        github_cache.clear()
+        response = self.client.get(f'/api/v1/repos/{self.repo.id}/popular/')
+        self.assertEqual(response.json(), NOT_POPULAR_REPO_RESULT)
+        self.assertFalse(mocked_requests.called)
+
+    @override_settings(POPULARITY_MAX_AGE=0, POPULARITY_STALE_WHILE_REVALIDATE=0)
+    @patch("popularity.utils.github_session.get", return_value=MockRequestsToGithubNotModified())
+    def test_stale_popularity_revalidated_with_stored_etag(self, mocked_requests):
+        self.repo.update_popularity(num_stars=600, num_forks=0, etag='"etag_value"')
+        github_cache.clear()
+        response = self.client.get(f'/api/v1/repos/{self.repo.id}/popular/')
+        self.assertEqual(response.json(), POPULAR_REPO_RESULT)
+        self.assertEquals(mocked_requests.call_args[1]['headers']['If-None-Match'], '"etag_value"')
+
+
+class RefreshPopularityTest(PopularityTestCase):
+    """Check background refresh of stored popularity"""
+
+    def test_hot_and_near_limit_repos_refreshed_more_often(self):
+        near_limit = refresh_interval(score=480, read_count=0)
+        far_from_limit = refresh_interval(score=50000, read_count=0)
+        hot_far_from_limit = refresh_interval(score=50000, read_count=1000)
+        self.assertLess(near_limit, far_from_limit)
+        self.assertLess(hot_far_from_limit, far_from_limit)
+        self.assertEquals(refresh_interval(score=None, read_count=0), 0)
+
+    @patch.dict(os.environ, {"PERSONAL_ACCESS_TOKEN": "proper_and_working_personal_access_token_value"})
+    @patch("popularity.utils.github_session.get", return_value=MockRequestsToGithubPopularRepo())
+    def test_worker_refreshes_due_repos_within_budget(self, mocked_requests):
+        github_cache.clear()
+        Repo.objects.create(name='user/first')
+        Repo.objects.create(name='user/second')
+        fresh = Repo.objects.create(name='user/fresh')
+        fresh.update_popularity(num_stars=100000, num_forks=0)
+        sleeps = []
+        worker = RefreshWorker(budget_fraction=0.5, sleep=sleeps.append)
+        worker.run(once=True)
+        self.assertEquals(worker.refreshed, 2)
+        self.assertEquals(Repo.objects.filter(popularity=POPULAR_REPO_RESULT).count(), 3)
+        self.assertEquals(sleeps, [worker.spacing] * 2)
+        self.assertAlmostEqual(worker.spacing, 3600 / 2500)
+        self.assertEquals(worker.summary()['due'], 0)
+        self.assertFalse(Repo.objects.exclude(lease_owner='').exists())
+
+    @patch.dict(os.environ, {"PERSONAL_ACCESS_TOKEN": "proper_and_working_personal_access_token_value"})
+    def test_worker_refreshes_batch_with_graphql(self):
+        github_cache.clear()
+        github = FakeGithubServer(repos={"facebook/react": (200000, 40000), "user/small": (10, 1)}).start()
+        self.addCleanup(github.stop)
+        for name in ("facebook/react", "user/small", "user/not_existing"):
+            Repo.objects.create(name=name)
+        sleeps = []
+        worker = RefreshWorker(budget_fraction=0.5, sleep=sleeps.append)
+        with override_settings(GITHUB_BACKEND='graphql', GITHUB_GRAPHQL_URL=f'{github.url}/graphql'):
+            worker.refresh_batch()
+        self.assertEquals(github.calls, 1)
+        self.assertEquals(sleeps, [worker.spacing])
+        self.assertEquals((worker.refreshed, worker.failed), (2, 1))
+        self.assertEquals(Repo.objects.get(name="facebook/react").popularity, POPULAR_REPO_RESULT)
+        self.assertEquals(Repo.objects.get(name="user/small").stargazers_count, 10)
+
+    def test_workers_lease_repos_without_overlap(self):
+        for i in range(5):
+            Repo.objects.create(name=f'user/repo{i}')
+        first = Repo.objects.claim_refresh_batch(owner='first', size=3, lease_seconds=60)
+        second = Repo.objects.claim_refresh_batch(owner='second', size=3, lease_seconds=60)
+        self.assertEquals(len(first), 3)
+        self.assertEquals(len(second), 2)
+        self.assertFalse({repo.id for repo in first} & {repo.id for repo in second})
+        self.assertEquals(Repo.objects.claim_refresh_batch(owner='third', size=3, lease_seconds=60), [])
+
+    def test_expired_lease_of_crashed_worker_claimed_again(self):
+        Repo.objects.create(name='user/repo')
+        Repo.objects.claim_refresh_batch(owner='crashed', size=1, lease_seconds=-1)
+        self.assertEquals(len(Repo.objects.claim_refresh_batch(owner='alive', size=1, lease_seconds=60)), 1)
+
+    def test_reads_flushed_to_db(self):
+        repo = Repo.objects.create(name='user/read')
+        counter = RepoReadCounter(flush_interval=60)
+        for _ in range(3):
+            counter.record(repo.id)
+        repo.refresh_from_db()
+        self.assertEquals(repo.read_count, 0)
+        counter.flush()
+        repo.refresh_from_db()
+        self.assertEquals(repo.read_count, 3)
+
+
+class SingleFlightTest(PopularityTestCase):
+    """Check coalescing of concurrent lookups of the same repo"""
+
+    def setUp(self):
+        github_cache.clear()
+
+    @patch.dict(os.environ, {"PERSONAL_ACCESS_TOKEN": "proper_and_working_personal_access_token_value"})
+    def test_concurrent_lookups_share_one_github_call(self):
+        def slow_github_response(url, **kwargs):
+            time.sleep(0.2)
+            return MockRequestsToGithubPopularRepo()
+
+        with patch("popularity.utils.github_session.get", side_effect=slow_github_response) as mocked_requests, \
+                ThreadPoolExecutor(max_workers=10) as executor:
+            results = list(executor.map(get_github_api_response, ["facebook/react"] * 10))
+        self.assertEquals(results, [(status.HTTP_200_OK, POPULAR_REPO_RESULT)] * 10)
+        self.assertEquals(mocked_requests.call_count, 1)
+
+    def test_error_shared_with_waiting_callers(self):
+        single_flight = SingleFlight(lock_dir=tempfile.gettempdir())
+        started = threading.Event()
+
+        def failing_call():
+            started.set()
+            time.sleep(0.1)
+            raise ValueError("upstream failed")
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            leader = executor.submit(single_flight.do, "facebook/react", failing_call)
+            started.wait()
+            follower = executor.submit(single_flight.do, "facebook/react", failing_call)
+            for future in (leader, follower):
+                with self.assertRaises(ValueError):
+                    future.result()
+
+
+@patch.dict(os.environ, {"PERSONAL_ACCESS_TOKEN": "proper_and_working_personal_access_token_value"})
+@override_settings(POPULARITY_MAX_AGE=60, POPULARITY_STALE_WHILE_REVALIDATE=600, POPULARITY_STALE_IF_ERROR=3600)
+class StalePopularityTest(PopularityTestCase):
+    """Check serving of stale popularity while Github is slow or failing"""
+
+    def setUp(self):
+        github_cache.clear()
+        self.repo = Repo.objects.create(name='facebook/react')
+        self.repo.update_popularity(num_stars=600, num_forks=0)
+        self.user = User.objects.create_user('test', 'test@email.com', 'testtest')
+        self.client.force_login(self.user)
+
+    def make_popularity_older(self, seconds):
+        Repo.objects.filter(pk=self.repo.pk).update(popularity_fetched_at=timezone.now() - timedelta(seconds=seconds))
+
+    @patch("popularity.views.revalidate_in_background")
+    @patch("popularity.utils.github_session.get")
+    def test_stale_served_while_revalidated_in_background(self, mocked_requests, mocked_revalidate):
+        self.make_popularity_older(120)
+        response = self.client.get(f'/api/v1/repos/{self.repo.id}/popular/')
+        self.assertEqual(response.json(), POPULAR_REPO_RESULT)
+        self.assertTrue(int(response['Age']) >= 120)
+        self.assertIn('110', response['Warning'])
+        mocked_revalidate.assert_called_once_with(self.repo.id)
+        self.assertFalse(mocked_requests.called)
+
+    @patch("popularity.utils.github_session.get", return_value=MockRequestsToGithubServerError())
+    def test_stale_served_when_github_fails(self, mocked_requests):
+        self.make_popularity_older(1200)
+        response = self.client.get(f'/api/v1/repos/{self.repo.id}/popular/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), POPULAR_REPO_RESULT)
+        self.assertIn('111', response['Warning'])
+
+    @patch("popularity.utils.github_session.get", return_value=MockRequestsToGithubServerError())
+    def test_error_returned_past_stale_limit(self, mocked_requests):
+        self.make_popularity_older(7200)
+        response = self.client.get(f'/api/v1/repos/{self.repo.id}/popular/')
+        self.assertEqual(response.status_code, status.HTTP_502_BAD_GATEWAY)
+
+
+class SharedGithubCacheTest(PopularityTestCase):
+    """Check Github lookups cache shared by worker processes through Django cache framework"""
+
+    def setUp(self):
+        self.memcached = FakeMemcachedServer().start()
+        self.addCleanup(self.memcached.stop)
+        caches_settings = dict(settings.CACHES, shared={
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': self.memcached.location,
+        })
+        override = override_settings(CACHES=caches_settings)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_entry_cached_by_one_process_served_to_another(self):
+        first_process = GithubRepoCache(max_size=10, ttl=60, cache_alias='shared')
+        second_process = GithubRepoCache(max_size=10, ttl=60, cache_alias='shared')
+        first_process.set("facebook/react", 200000, 40000, etag='W/"etag_value"', last_modified="Mon, 01 Jan 2024")
+        entry = second_process.get("facebook/react")
+        self.assertEquals((entry.num_stars, entry.num_forks), (200000, 40000))
+        self.assertEquals((entry.etag, entry.last_modified), ('W/"etag_value"', "Mon, 01 Jan 2024"))
+        self.assertTrue(second_process.is_fresh(entry))
+
+    def test_clear_keeps_other_shared_keys(self):
+        cache = GithubRepoCache(max_size=10, ttl=60, cache_alias='shared')
+        cache.set("facebook/react", 200000, 40000)
+        caches['shared'].set('auth:token:key', 1)
+        cache.clear()
+        self.assertIsNone(GithubRepoCache(max_size=10, ttl=60, cache_alias='shared').get("facebook/react"))
+        self.assertEquals(caches['shared'].get('auth:token:key'), 1)
+
+    def test_entry_packed_compactly(self):
+        entry = GithubRepoCache(max_size=10, ttl=60).set("facebook/react", 200000, 40000, etag='"abc"')
+        packed = GithubRepoCache.pack(entry)
+        self.assertLess(len(packed), 32)
+        self.assertEquals(GithubRepoCache.unpack(packed), entry)
+
+    def test_single_flight_lock_shared_by_processes(self):
+        first_process = SingleFlight(lock_cache_alias='shared', lock_timeout=1)
+        second_process = SingleFlight(lock_cache_alias='shared', lock_timeout=1)
+        order = []
+
+        def leader_call():
+            order.append('first started')
+            time.sleep(0.2)
+            order.append('first finished')
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            first = executor.submit(first_process.do, "facebook/react", leader_call)
+            time.sleep(0.05)
+            second = executor.submit(second_process.do, "facebook/react", lambda: order.append('second started'))
+            first.result(), second.result()
+        self.assertEquals(order, ['first started', 'first finished', 'second started'])
+
+
+@patch.dict(os.environ, {"PERSONAL_ACCESS_TOKEN": "token"})
+class AsyncViewsTest(PopularityTestCase):
+    """Check native async views served under ASGI against local fake Github server"""
+
+    def setUp(self):
+        github_cache.clear()
+        self.github = FakeGithubServer(repos={"facebook/react": (200000, 40000)}, latency=0.1).start()
+        self.addCleanup(self.github.stop)
+        override = override_settings(GITHUB_API_URL=self.github.url)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.repo = Repo.objects.create(name='facebook/react')
+        self.token = Token.objects.create(user=User.objects.create_user('test', 'test@email.com', 'testtest'))
+        self.factory = AsyncRequestFactory()
+
+    def test_popular_looked_up_and_stored(self):
+        request = self.factory.get(f'/api/v1/repos/{self.repo.id}/popular/',
+                                   authorization=f'Token {self.token.key}')
+        response = async_to_sync(async_views.repo_popular)(request, pk=self.repo.id)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.content, b'"popular"')
+        self.assertEqual(response['Age'], '0')
+        self.repo.refresh_from_db()
+        self.assertEqual((self.repo.stargazers_count, self.repo.popularity), (200000, POPULAR_REPO_RESULT))
+
+    def test_popular_refused_without_token(self):
+        response = async_to_sync(async_views.repo_popular)(self.factory.get('/'), pk=self.repo.id)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.github.calls, 0)
+
+    def test_only_get_and_head_allowed(self):
+        request = self.factory.post(f'/api/v1/repos/{self.repo.id}/popular/',
+                                    authorization=f'Token {self.token.key}')
+        response = async_to_sync(async_views.repo_popular)(request, pk=self.repo.id)
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+        self.assertEqual(response['Allow'], 'GET, HEAD')
+        self.assertEqual(self.github.calls, 0)
+
+    def test_concurrent_lookups_share_one_github_call(self):
+        async def lookups():
+            return await asyncio.gather(*(async_fetch_github_repo("facebook/react") for _ in range(5)))
+
+        results = async_to_sync(lookups)()
+        self.assertEqual({(_status, info.num_stars) for _status, info in results}, {(status.HTTP_200_OK, 200000)})
+        self.assertEqual(self.github.calls, 1)
+
+    def test_health_check(self):
+        response = async_to_sync(async_views.health_check)(self.factory.get('/health_check/'))
+        self.assertEqual(response.content, b'ok')
+
+
+class FakeGithubServerTest(PopularityTestCase):
+    """Check behaviours of local fake Github used by tests and benchmarks/run.py"""
+
+    def setUp(self):
+        self.github = FakeGithubServer(repos={"facebook/react": (200000, 40000)}, rate_limit=2).start()
+        self.addCleanup(self.github.stop)
+        self.url = f'{self.github.url}/repos/facebook/react'
+
+    def test_conditional_request_answered_not_modified_without_rate_limit_cost(self):
+        response = requests.get(self.url, headers={'Authorization': 'Token token'})
+        self.assertEqual(response.headers['X-RateLimit-Remaining'], '1')
+        not_modified = requests.get(self.url, headers={'Authorization': 'Token token',
+                                                       'If-None-Match': response.headers['ETag']})
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(not_modified.headers['X-RateLimit-Remaining'], '1')
+
+    def test_calls_past_rate_limit_refused(self):
+        statuses = [requests.get(self.url, headers={'Authorization': 'Token token'}).status_code for _ in range(3)]
+        self.assertEqual(statuses, [status.HTTP_200_OK, status.HTTP_200_OK, status.HTTP_403_FORBIDDEN])
+        self.assertEqual(self.github.calls_by_status, {200: 2, 403: 1})
+
+    def test_benchmark_results_compared(self):
+        from benchmarks.run import compare
+
+        baseline = {'results': {'wsgi': {'popular': {'rps': 100, 'p99_ms': 200, 'db_queries_per_request': 3}}}}
+        current = {'results': {'wsgi': {'popular': {'rps': 80, 'p99_ms': 100, 'db_queries_per_request': 3}}}}
+        self.assertEqual(compare(baseline, current), [
+            ('wsgi', 'popular', 'rps', 100, 80, -20.0, True),
+            ('wsgi', 'popular', 'p99_ms', 200, 100, -50.0, False),
+            ('wsgi', 'popular', 'db_queries_per_request', 3, 3, 0.0, False),
+        ])
+
+
+@patch.dict(os.environ, {"PERSONAL_ACCESS_TOKEN": "token"})
+class ServerTimingTest(PopularityTestCase):
+    """Check per request timings sent in Server-Timing header, logs and profiles of slow requests"""
+
+    def setUp(self):
+        github_cache.clear()
+        self.repo = Repo.objects.create(name='facebook/react')
+        self.user = User.objects.create_user('test', 'test@email.com', 'testtest')
+        self.client.force_login(self.user)
+
+    @patch("popularity.utils.github_session.get", return_value=MockRequestsToGithubPopularRepo())
+    def test_phases_sent_in_server_timing_header(self, mocked_requests):
+        response = self.client.get(f'/api/v1/repos/{self.repo.id}/popular/')
+        server_timing = {metric.split(';')[0]: metric for metric in response['Server-Timing'].split(', ')}
+        self.assertIn('desc="1 calls"', server_timing['github'])
+        self.assertIn('queries"', server_timing['db'])
+        self.assertEqual(set(server_timing), {'github', 'db', 'auth', 'serialize', 'total'})
+
+    @patch("popularity.utils.github_session.get", return_value=MockRequestsToGithubPopularRepo())
+    def test_timings_logged_as_json(self, mocked_requests):
+        with self.assertLogs('popularity.timing', 'INFO') as logs:
+            self.client.get(f'/api/v1/repos/{self.repo.id}/popular/')
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual((line['path'], line['status'], line['github_calls']),
+                         (f'/api/v1/repos/{self.repo.id}/popular/', 200, 1))
+        self.assertTrue(line['db_queries'] > 0)
+
+    @override_settings(POPULARITY_PROFILE_SLOW_REQUESTS=True, POPULARITY_SLOW_REQUEST_THRESHOLD=0.05)
+    @patch("popularity.utils.github_session.get")
+    def test_hot_stacks_of_slow_request_logged(self, mocked_requests):
+        def slow_github(*args, **kwargs):
+            time.sleep(0.2)
+            return MockRequestsToGithubPopularRepo()
+
+        mocked_requests.side_effect = slow_github
+        with self.assertLogs('popularity', 'WARNING') as logs:
+            self.client.get(f'/api/v1/repos/{self.repo.id}/popular/')
+        profile = json.loads(next(record for record in logs.records if record.name == 'popularity.profile').getMessage())
+        self.assertTrue(profile['samples'] > 0)
+        self.assertIn('slow_github', profile['stacks'][0]['stack'][-1])
+
+    def test_concurrent_profiles_of_one_thread_kept_apart(self):
+        sampler = StackSampler(interval=0.001)
+        first = sampler.watch(threading.get_ident())
+        second = sampler.watch(threading.get_ident())
+        time.sleep(0.05)
+        self.assertTrue(sum(sampler.unwatch(first).values()) > 0)
+        self.assertTrue(sum(sampler.unwatch(second).values()) > 0)
+
+    @override_settings(POPULARITY_PROFILE_SLOW_REQUESTS=True, POPULARITY_PROFILE_SAMPLE_RATE=1)
+    def test_async_requests_not_profiled(self):
+        async def get_response(request):
+            return HttpResponse()
+
+        middleware = ServerTimingMiddleware(get_response)
+        with patch('popularity.middleware.stack_sampler.watch') as watch:
+            response = async_to_sync(middleware)(AsyncRequestFactory().get('/'))
+        watch.assert_not_called()
+        self.assertIn('total;dur=', response['Server-Timing'])
+
+
+@patch.dict(os.environ, {"PERSONAL_ACCESS_TOKEN": "token"})
+class MetricsTest(PopularityTestCase):
+    """Check metrics exposed in Prometheus text format at /metrics"""
+
+    def setUp(self):
+        github_cache.clear()
+        self.repo = Repo.objects.create(name='facebook/react')
+        self.user = User.objects.create_user('test', 'test@email.com', 'testtest')
+        self.client.force_login(self.user)
+
+    @patch("popularity.utils.github_session.get", return_value=MockRequestsToGithubPopularRepo())
+    def test_lookup_exposed(self, mocked_requests):
+        self.client.get(f'/api/v1/repos/{self.repo.id}/popular/')
+        response = self.client.get('/metrics')
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        exposition = response.content.decode()
+        self.assertIn('github_request_duration_seconds_bucket{status="200",le="+Inf"}', exposition)
+        self.assertIn('http_request_duration_seconds_count{action="popular",view="RepoViewSet"}', exposition)
+        self.assertIn('popularity_results_total{result="popular"}', exposition)
+        self.assertIn('github_cache_misses_total 1', exposition)
+        self.assertIn('# TYPE github_rate_limit_remaining gauge', exposition)
+
+    def test_metrics_of_processes_and_threads_aggregated(self):
+        directory = tempfile.mkdtemp()
+        first_process, second_process = Metrics(directory=directory), Metrics(directory=directory)
+        threads = [threading.Thread(target=first_process.inc, args=('popularity_results_total',),
+                                    kwargs={'result': 'popular'}) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        first_process.observe('github_request_duration_seconds', 0.02, status=200)
+        first_process.flush()
+        second_process.inc('popularity_results_total', result='popular')
+        second_process.observe('github_request_duration_seconds', 3, status=200)
+        exposition = second_process.exposition()
+        self.assertIn('popularity_results_total{result="popular"} 5', exposition)
+        self.assertIn('github_request_duration_seconds_bucket{status="200",le="0.025"} 1', exposition)
+        self.assertIn('github_request_duration_seconds_bucket{status="200",le="5"} 2', exposition)
+        self.assertIn('github_request_duration_seconds_count{status="200"} 2', exposition)
+
+    def test_shards_of_finished_threads_folded(self):
+        process = Metrics()
+        for _ in range(50):
+            thread = threading.Thread(target=process.observe, args=('github_request_duration_seconds', 0.02),
+                                      kwargs={'status': 200})
+            thread.start()
+            thread.join()
+        process.inc('popularity_results_total', result='popular')
+        self.assertEqual(len(process._shards), 1)
+        exposition = process.exposition()
+        self.assertIn('github_request_duration_seconds_count{status="200"} 50', exposition)
+        self.assertIn('popularity_results_total{result="popular"} 1', exposition)
+
+    def test_counts_of_exited_and_idle_processes_kept(self):
+        github_cache.clear()
+        directory = tempfile.mkdtemp()
+        exited = Metrics(directory=directory)
+        exited.snapshot_name = '999999999-exited.json'
+        exited.inc('popularity_results_total', result='popular')
+        exited.flush()
+        idle = Metrics(directory=directory, snapshot_max_age=60)
+        idle.inc('popularity_results_total', result='popular')
+        snapshot = dict(idle.snapshot(), cache_entries=7)
+        idle_path = os.path.join(directory, idle.snapshot_name)
+        with open(idle_path, 'w') as snapshot_file:
+            json.dump(snapshot, snapshot_file)
+        os.utime(idle_path, (time.time() - 120, time.time() - 120))
+        serving = Metrics(directory=directory, snapshot_max_age=60)
+        serving.inc('popularity_results_total', result='popular')
+        for _ in range(2):
+            exposition = serving.exposition()
+            self.assertIn('popularity_results_total{result="popular"} 3', exposition)
+            self.assertIn('github_cache_entries 0', exposition)
+        self.assertFalse(os.path.exists(os.path.join(directory, exited.snapshot_name)))
+        self.assertTrue(os.path.exists(os.path.join(directory, Metrics.aggregate_name)))
+
+    def test_interrupted_fold_not_counted_twice(self):
+        directory = tempfile.mkdtemp()
+        exited = Metrics(directory=directory)
+        exited.snapshot_name = '999999999-exited.json'
+        exited.inc('popularity_results_total', result='popular')
+        exited.flush()
+        serving = Metrics(directory=directory)
+        with patch('popularity.metrics.os.remove'):
+            serving.exposition()
+        self.assertIn('popularity_results_total{result="popular"} 1', serving.exposition())
+
+
+@patch.dict(os.environ, {"PERSONAL_ACCESS_TOKEN": "token"})
+class ReadinessTest(PopularityTestCase):
+    """Check liveness and readiness probes not spending Github rate limit"""
+
+    def setUp(self):
+        github_cache.clear()
+        github_readiness.clear()
+        github_token_pool.clear()
+        self.addCleanup(github_readiness.clear)
+        self.github = FakeGithubServer(repos={"facebook/react": (200000, 40000)}).start()
+        self.addCleanup(self.github.stop)
+        override = override_settings(GITHUB_API_URL=self.github.url)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_liveness_does_not_call_github(self):
+        response = self.client.get('/health/live/')
+        self.assertEqual(response.json(), {'status': 'ok'})
+        self.assertEqual(self.github.calls, 0)
+
+    def test_rate_limit_probed_at_most_once_per_interval(self):
+        first = self.client.get('/health/ready/').json()
+        second = self.client.get('/health/ready/').json()
+        self.assertEqual((first['status'], first['github']['source']), ('ok', 'probe'))
+        self.assertEqual(second['rate_limit']['remaining'], 5000)
+        self.assertEqual(self.github.calls, 1)
+        self.assertEqual(self.github.calls_by_status, {200: 1})
+
+    def test_recent_lookup_reused(self):
+        get_github_api_response("facebook/react")
+        payload = self.client.get('/health/ready/').json()
+        self.assertEqual(payload['github']['source'], 'traffic')
+        self.assertEqual(payload['rate_limit']['remaining'], 4999)
+        self.assertEqual(self.github.calls, 1)
+
+    def test_not_ready_when_github_fails(self):
+        self.github.error_rate = 1
+        response = self.client.get('/health/ready/')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response.json()['github']['status'], status.HTTP_502_BAD_GATEWAY)
+
+
+class RepoImportTest(PopularityTestCase):
+    """Check streaming bulk import of repo names"""
+    import_url = reverse('repo-import')
+
+    def setUp(self):
+        self.user = User.objects.create_user('test', 'test@email.com', 'testtest')
+        self.client.force_login(self.user)
+        Repo.objects.create(name="saved/repo")
+
+    def test_ndjson_import(self):
+        body = '\n'.join(['"https://github.com/facebook/react/"', '{"name": "django/django"}', '"facebook/react"',
+                          '"saved/repo"', '', 'not json', '{"stars": 1}', '"no_owner"'])
+        response = self.client.post(self.import_url, data=body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        report = response.json()
+        self.assertEqual((report['inserted'], report['skipped'], report['invalid']), (2, 2, 3))
+        self.assertEqual([error['line'] for error in report['errors']], [6, 7, 8])
+        self.assertTrue(Repo.objects.filter(name="facebook/react").exists())
+        self.assertTrue(Repo.objects.filter(name="django/django").exists())
+
+    def test_csv_import_with_header(self):
+        body = 'stars,name\n1,facebook/react\n2,saved/repo\n3\n'
+        response = self.client.post(self.import_url, data=body, content_type='text/csv')
+        report = response.json()
+        self.assertEqual((report['inserted'], report['skipped'], report['invalid']), (1, 1, 1))
+
+    def test_batches_deduplicated_across_chunks(self):
+        lines = [f'"user/repo{i % 7}"\n'.encode() for i in range(30)]
+        report = RepoImport(batch_size=4).run(ndjson_rows(lines))
+        self.assertEqual((report['inserted'], report['skipped'], report['invalid']), (7, 23, 0))
+        self.assertEqual(Repo.objects.filter(name__startswith="user/repo").count(), 7)
+
+    def test_names_saved_concurrently_reported_skipped(self):
+        lookup = Repo.objects.filter
+
+        def lookup_missing_concurrent_save(*args, **kwargs):
+            names = set(lookup(*args, **kwargs).values_list('name', flat=True))
+            if not lookup(name="user/concurrent").exists():
+                Repo.objects.create(name="user/concurrent")
+            return Mock(values_list=Mock(return_value=names))
+
+        with patch.object(Repo.objects, 'filter', side_effect=lookup_missing_concurrent_save):
+            report = RepoImport().run(ndjson_rows([b'"user/concurrent"\n', b'"user/new"\n']))
+        self.assertEqual((report['inserted'], report['skipped']), (1, 1))
+        self.assertTrue(Repo.objects.filter(name="user/new").exists())
+
+    def test_management_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as names:
+            names.write('name\nfacebook/react\nsaved/repo\n')
+            names.flush()
+            output = StringIO()
+            call_command('import_repos', names.name, stdout=output)
+        self.assertEqual(json.loads(output.getvalue())['inserted'], 1)
+        self.assertTrue(Repo.objects.filter(name="facebook/react").exists())
+
+
+class RepoExportTest(PopularityTestCase):
+    """Check streaming export of repos with stored popularity"""
+    export_url = reverse('repo-export')
+
+    def setUp(self):
+        self.user = User.objects.create_user('test', 'test@email.com', 'testtest')
+        self.client.force_login(self.user)
+        Repo.objects.create(name="facebook/react").update_popularity(num_stars=200000, num_forks=40000)
+        Repo.objects.create(name="user/small").update_popularity(num_stars=1, num_forks=0)
+        Repo.objects.create(name="user/unknown")
+
+    def export(self, **params):
+        response = self.client.get(self.export_url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_ndjson_export(self):
+        rows = [json.loads(line) for line in self.export().splitlines()]
+        self.assertEqual([row['name'] for row in rows], ["facebook/react", "user/small", "user/unknown"])
+        self.assertEqual(rows[0]['github_url'], "https://github.com/facebook/react/")
+        self.assertEqual((rows[0]['stargazers_count'], rows[0]['popularity']), (200000, POPULAR_REPO_RESULT))
+        self.assertEqual(rows[2]['popularity_fetched_at'], None)
+
+    def test_csv_export(self):
+        lines = self.export(format='csv').splitlines()
+        self.assertEqual(lines[0], 'id,name,github_url,stargazers_count,forks_count,score,popularity,'
+                                   'popularity_fetched_at')
+        self.assertEqual(len(lines), 4)
+
+    def test_filters(self):
+        self.assertEqual(len(self.export(popular='true').splitlines()), 1)
+        self.assertEqual(len(self.export(popular='false').splitlines()), 1)
+        Repo.objects.filter(name="user/small").update(popularity_fetched_at=timezone.now() - timedelta(days=2))
+        since = (timezone.now() - timedelta(days=1)).isoformat()
+        self.assertEqual([json.loads(line)['name'] for line in self.export(updated_since=since).splitlines()],
+                         ["facebook/react"])
+
+    def test_invalid_filter(self):
+        response = self.client.get(self.export_url, {'updated_since': 'yesterday'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('updated_since', json.loads(response.content))
+
+    def test_rows_read_in_chunks(self):
+        with self.assertNumQueries(1):
+            rows = list(export_rows(Repo.objects.all(), chunk_size=1))
+        self.assertEqual(len(rows), 3)
+
+
+class PopularityHistoryTest(PopularityTestCase):
+    """Check history of fetched counts, its rollups and trend endpoint"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('test', 'test@email.com', 'testtest')
+        self.client.force_login(self.user)
+        self.repo = Repo.objects.create(name="user/rising")
+        self.now = timezone.now().replace(minute=30)
+
+    def add_samples(self, *samples):
+        RepoSample.objects.bulk_create([
+            RepoSample(repo=self.repo, sampled_at=self.now - age, stargazers_count=stars, forks_count=0, score=stars)
+            for age, stars in samples])
+
+    def test_fetched_counts_recorded(self):
+        self.repo.update_popularity(num_stars=10, num_forks=5)
+        sample = RepoSample.objects.get(repo=self.repo)
+        self.assertEqual((sample.resolution, sample.score), (RepoSample.RAW, 20))
+
+    def test_rollup_keeps_last_sample_of_hour_and_day(self):
+        self.add_samples((timedelta(days=3, minutes=20), 100), (timedelta(days=3, minutes=10), 110),
+                         (timedelta(days=40, hours=2), 10), (timedelta(days=40, hours=1), 20),
+                         (timedelta(days=5 * 365), 1), (timedelta(hours=1), 120))
+        removed = rollup_history(now=self.now)
+        self.assertEqual(removed, {RepoSample.RAW: 5, RepoSample.HOUR: 3, RepoSample.DAY: 1})
+        samples = list(RepoSample.objects.filter(repo=self.repo).values_list('resolution', 'score'))
+        self.assertEqual(samples, [(RepoSample.DAY, 20), (RepoSample.HOUR, 110), (RepoSample.RAW, 120)])
+        self.assertEqual(rollup_history(now=self.now), {RepoSample.RAW: 0, RepoSample.HOUR: 0, RepoSample.DAY: 0})
+
+    def test_rollup_skipped_while_another_runs(self):
+        self.add_samples((timedelta(days=3, minutes=20), 100), (timedelta(days=3, minutes=10), 110))
+        cache = caches[settings.GITHUB_CACHE_ALIAS]
+        cache.add(ROLLUP_LOCK_KEY, 1)
+        self.addCleanup(cache.delete, ROLLUP_LOCK_KEY)
+        self.assertIsNone(rollup_history(now=self.now))
+        self.assertEqual(RepoSample.objects.filter(resolution=RepoSample.RAW).count(), 2)
+
+    def test_history_endpoint(self):
+        self.add_samples((timedelta(days=10), 300), (timedelta(days=5), 600), (timedelta(days=2), 400),
+                         (timedelta(0), 1300))
+        url = reverse('repo-history', args=[self.repo.id])
+        with self.assertNumQueries(4):
+            history = self.client.get(url).json()
+        self.assertEqual([sample['popularity'] for sample in history['samples']],
+                         [NOT_POPULAR_REPO_RESULT, POPULAR_REPO_RESULT, NOT_POPULAR_REPO_RESULT, POPULAR_REPO_RESULT])
+        self.assertEqual(history['growth']['score_per_day'], 100)
+        self.assertEqual(len(history['crossings']), 3)
+        since = (self.now - timedelta(days=3)).isoformat()
+        history = self.client.get(url, {'since': since}).json()
+        self.assertEqual([sample['score'] for sample in history['samples']], [400, 1300])
+        self.assertEqual(self.client.get(url, {'resolution': 'minute'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(GITHUB_WEBHOOK_SECRET='secret')
+class GithubWebhookTest(PopularityTestCase):
+    """Check signed Github webhooks update stored counts of watched repos without polling"""
+    webhook_url = reverse('github-webhook')
+
+    def setUp(self):
+        # Deliveries of other tests are remembered in shared cache.
+        caches[settings.GITHUB_CACHE_ALIAS].clear()
+        github_cache.clear()
+        self.addCleanup(webhook_batcher.flush)
+        self.repo = Repo.objects.create(name="facebook/react")
+        self.repo.update_popularity(num_stars=490, num_forks=0)
+        self.deliveries = 0
+
+    def deliver(self, event, payload, secret='secret'):
+        body = json.dumps(payload).encode()
+        signature = 'sha256=' + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+        self.deliveries += 1
+        return self.client.post(self.webhook_url, data=body, content_type='application/json',
+                                HTTP_X_GITHUB_EVENT=event, HTTP_X_HUB_SIGNATURE_256=signature,
+                                HTTP_X_GITHUB_DELIVERY=f'delivery-{self.deliveries}')
+
+    def test_invalid_signature_rejected(self):
+        response = self.deliver('star', {'action': 'created', 'repository': {'full_name': "facebook/react"}},
+                                secret='wrong')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(webhook_batcher.pending(), 0)
+
+    def test_burst_of_events_coalesced_into_single_write(self):
+        for _ in range(15):
+            response = self.deliver('star', {'action': 'created', 'repository': {'full_name': "facebook/react"}})
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.deliver('fork', {'repository': {'full_name': "facebook/react"}})
+        self.deliver('star', {'action': 'created', 'repository': {'full_name': "unknown/repo"}})
+        with self.assertNumQueries(3):
+            self.assertEqual(webhook_batcher.flush(), 1)
+        self.repo.refresh_from_db()
+        self.assertEqual((self.repo.stargazers_count, self.repo.forks_count), (505, 1))
+        self.assertEqual(self.repo.popularity, POPULAR_REPO_RESULT)
+        self.assertEqual(github_cache.get("facebook/react")[:2], (505, 1))
+
+    def test_counts_of_payload_replace_deltas(self):
+        self.deliver('star', {'action': 'created', 'repository': {'full_name': "facebook/react"}})
+        self.deliver('repository', {'action': 'edited', 'repository': {
+            'full_name': "facebook/react", 'stargazers_count': 200000, 'forks_count': 40000}})
+        self.deliver('star', {'action': 'deleted', 'repository': {'full_name': "facebook/react"}})
+        webhook_batcher.flush()
+        self.repo.refresh_from_db()
+        self.assertEqual((self.repo.stargazers_count, self.repo.forks_count), (199999, 40000))
+
+    def test_redelivery_ignored(self):
+        self.deliver('star', {'action': 'created', 'repository': {'full_name': "facebook/react"}})
+        self.deliveries -= 1
+        response = self.deliver('star', {'action': 'created', 'repository': {'full_name': "facebook/react"}})
+        self.assertEqual(response.json(), {'status': 'duplicate'})
+
+    def test_redelivery_of_rejected_payload_processed(self):
+        body = b'{"action": "created", "repository": {"full_name": "facebook/'
+        signature = 'sha256=' + hmac.new(b'secret', body, hashlib.sha256).hexdigest()
+        response = self.client.post(self.webhook_url, data=body, content_type='application/json',
+                                    HTTP_X_GITHUB_EVENT='star', HTTP_X_HUB_SIGNATURE_256=signature,
+                                    HTTP_X_GITHUB_DELIVERY='delivery-1')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.deliver('star', {'action': 'created', 'repository': {'full_name': "facebook/react"}})
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+
+    @patch.object(github_session, 'get', side_effect=AssertionError("Github polled"))
+    def test_watched_repo_served_without_polling(self, _):
+        self.deliver('fork', {'repository': {'full_name': "facebook/react", 'stargazers_count': 600}})
+        webhook_batcher.flush()
+        Repo.objects.filter(pk=self.repo.pk).update(popularity_fetched_at=timezone.now() - timedelta(days=2))
+        repo = Repo.objects.get(pk=self.repo.pk)
+        self.assertEqual(repo.lookup_popularity().info, POPULAR_REPO_RESULT)
+        self.assertFalse(Repo.objects.due_for_refresh(timezone.now()).filter(pk=repo.pk).exists())
+
+
+@patch.dict(os.environ, {"PERSONAL_ACCESS_TOKEN": "token"})
+class PopularityByNameTest(PopularityTestCase):
+    """Check popularity looked up by repo name, saved or not"""
+
+    def setUp(self):
+        github_cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('test', 'test@email.com', 'testtest'))
+        self.repo = Repo.objects.create(name="https://github.com/Facebook/React/")
+        self.repo.update_popularity(num_stars=200000, num_forks=40000)
+
+    def test_name_normalized_case_insensitively(self):
+        self.assertEqual(normalize_repo_name("HTTPS://GitHub.com/Facebook/React/"), "Facebook/React")
+        self.assertEqual(normalize_repo_name("///user/name"), "user/name")
+        self.assertEqual((self.repo.name, self.repo.name_key), ("Facebook/React", "facebook/react"))
+
+    def test_saved_repo_by_name_in_single_query(self):
+        url = reverse('repo-popular-by-name', kwargs={'owner': 'facebook', 'name': 'REACT'})
+        self.assertEqual(url, '/api/v1/repos/by-name/facebook/REACT/popular/')
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.json(), POPULAR_REPO_RESULT)
+        response = self.client.get(reverse('repo-popular-by-name', kwargs={'owner': 'facebook', 'name': 'vue'}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @patch('popularity.utils.github_session.get', return_value=MockRequestsToGithubNotPopularRepo())
+    def test_adhoc_popularity_without_db(self, mock_get):
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('popularity'), {'repo': "https://github.com/User/Small"})
+            self.client.get(reverse('popularity'), {'repo': "user/small"})
+        self.assertEqual(response.json(), NOT_POPULAR_REPO_RESULT)
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertFalse(Repo.objects.filter(name_key="user/small").exists())
+
+    def test_adhoc_popularity_invalid_name(self):
+        response = self.client.get(reverse('popularity'), {'repo': "no_owner"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(reverse('popularity')).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ScoringTest(PopularityTestCase):
+    """Check batch scoring of stored repos and leaderboard"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('test', 'test@email.com', 'testtest'))
+        for name, stars, forks in [("a/high", 5000, 100), ("b/tie", 700, 0), ("c/tie", 300, 200), ("d/low", 400, 10),
+                                   ("e/none", 1, 0)]:
+            Repo.objects.create(name=name).update_popularity(num_stars=stars, num_forks=forks)
+        Repo.objects.create(name="f/unscored")
+
+    def test_columns_scored_at_once(self):
+        scorer = Scorer(stars_weight=1, forks_weight=3, threshold=600)
+        scores = scorer.scores([100, 600], [200, 0])
+        self.assertEqual(list(scores), [700, 600])
+        self.assertEqual([bool(popular) for popular in scorer.popular(scores)], [True, True])
+
+    def test_what_if_threshold_changes(self):
+        report = rescore(Scorer(threshold=1000))
+        self.assertEqual((report['scored'], report['changed'], report['to_not_popular']), (5, 2, 2))
+        self.assertEqual(Repo.objects.filter(popularity=POPULAR_REPO_RESULT).count(), 3)
+
+    def test_apply_new_weights(self):
+        report = rescore(Scorer(stars_weight=1, forks_weight=10), apply=True)
+        self.assertEqual((report['changed'], report['to_popular']), (3, 1))
+        repo = Repo.objects.get(name="d/low")
+        self.assertEqual((repo.score, repo.popularity), (500, POPULAR_REPO_RESULT))
+        self.assertEqual(Repo.objects.get(name="b/tie").score, 700)
+
+    @staticmethod
+    def what_if():
+        scorer = Scorer(stars_weight=1, forks_weight=10, threshold=1000)
+        scores = scorer.scores([100, 600], [200, 0])
+        report = rescore(scorer)
+        del report['scoring_ms']
+        return [int(score) for score in scores], [bool(popular) for popular in scorer.popular(scores)], report
+
+    def test_scored_without_numpy(self):
+        with patch('popularity.scoring.numpy', None), self.assertLogs('popularity.scoring', 'WARNING'):
+            self.assertEqual(Scorer().scores([1], [1]).typecode, 'q')
+            scores, popular, report = self.what_if()
+        self.assertEqual((scores, popular), ([2100, 600], [True, False]))
+        self.assertEqual((report['changed'], report['to_popular'], report['to_not_popular']), (4, 0, 1))
+
+    @skipUnless(scoring.numpy is not None, "NumPy not installed")
+    def test_numpy_scores_as_fallback(self):
+        with_numpy = self.what_if()
+        with patch('popularity.scoring.numpy', None), self.assertLogs('popularity.scoring', 'WARNING'):
+            self.assertEqual(self.what_if(), with_numpy)
+
+    def test_leaderboard(self):
+        with self.assertNumQueries(1):
+            leaders = self.client.get(reverse('repo-leaderboard'), {'limit': 4}).json()
+        self.assertEqual([(leader['name'], leader['rank']) for leader in leaders],
+                         [("a/high", 1), ("c/tie", 2), ("b/tie", 2), ("d/low", 4)])
+        response = self.client.get(reverse('repo-leaderboard'), {'limit': 0})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ConditionalRequestTest(PopularityTestCase):
+    """Check ETag / Last-Modified validators and 304 Not Modified of repo responses"""
+
+    def setUp(self):
+        github_cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('test', 'test@email.com', 'testtest'))
+        self.repo = Repo.objects.create(name="facebook/react")
+        self.repo.update_popularity(num_stars=200000, num_forks=40000)
+        Repo.objects.create(name="django/django")
+
+    def assertNotModifiedUntilChange(self, url, change):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('must-revalidate', response['Cache-Control'])
+        self.assertIn('Last-Modified', response)
+        with patch('rest_framework.renderers.JSONRenderer.render') as render:
+            not_modified_response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified_response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(not_modified_response['ETag'], response['ETag'])
+        render.assert_not_called()
+        change()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, status.HTTP_200_OK)
+
+    def test_detail(self):
+        def rename():
+            self.repo.name = "facebook/react-native"
+            self.repo.save()
+        self.assertNotModifiedUntilChange(reverse('repo-detail', args=[self.repo.id]), rename)
+
+    def test_list(self):
+        self.assertNotModifiedUntilChange(reverse('repo-list'),
+                                          lambda: Repo.objects.filter(name="django/django").delete())
+
+    def test_popular(self):
+        url = reverse('repo-popular', args=[self.repo.id])
+        response = self.client.get(url)
+        self.assertTrue(response['Cache-Control'].startswith('max-age=3'))
+        self.assertNotModifiedUntilChange(url, lambda: self.repo.update_popularity(num_stars=1, num_forks=0))
+
+    def test_if_modified_since(self):
+        url = reverse('repo-detail', args=[self.repo.id])
+        last_modified = self.client.get(url)['Last-Modified']
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+
+@patch.dict(os.environ, {"PERSONAL_ACCESS_TOKEN": "token"})
+class CachedTokenAuthenticationTest(PopularityTestCase):
+    """Check token to user mapping is cached and forgotten with deleted tokens and deactivated users"""
+
+    def setUp(self):
+        github_cache.clear()
+        token_users.clear()
+        self.user = User.objects.create_user('test', 'test@email.com', 'testtest')
+        self.token = Token.objects.create(user=self.user)
+        self.authorization = f'Token {self.token.key}'
+
+    def get_popularity(self):
+        return self.client.get(reverse('popularity'), {'repo': "facebook/react"}, HTTP_AUTHORIZATION=self.authorization)
+
+    @patch('popularity.utils.github_session.get', return_value=MockRequestsToGithubPopularRepo())
+    def test_cached_popularity_without_db_queries(self, _):
+        self.assertEqual(self.get_popularity().json(), POPULAR_REPO_RESULT)
+        with self.assertNumQueries(0):
+            response = self.get_popularity()
+        self.assertEqual(response.json(), POPULAR_REPO_RESULT)
+
+    def test_shared_between_processes(self):
+        self.get_popularity()
+        token_users.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(token_users.get(self.token.key), self.user)
+
+    def test_password_hash_not_cached(self):
+        self.get_popularity()
+        token_users.clear()
+        cached = caches[settings.GITHUB_CACHE_ALIAS].get(token_users.shared_key(self.token.key))
+        self.assertNotIn(self.user.password, cached)
+        user = token_users.get(self.token.key)
+        self.assertEqual((user.pk, user.username, user.is_active), (self.user.pk, 'test', True))
+        self.assertEqual(user.password, '')
+
+    def test_cached_user_read_only(self):
+        token_users.set(self.token.key, self.user)
+        with self.assertRaises(TypeError):
+            token_users.get(self.token.key).save()
+
+    def test_auth_routes_use_full_user(self):
+        self.user.first_name = 'First'
+        self.user.save()
+        self.get_popularity()
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=self.authorization)
+        client.get('/auth/users/me/')
+        self.assertEqual(client.get('/auth/users/me/').json()['email'], 'test@email.com')
+        client.patch('/auth/users/me/', {'email': 'new@email.com'})
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.email, self.user.first_name), ('new@email.com', 'First'))
+        self.assertTrue(self.user.check_password('testtest'))
+        response = client.post('/auth/users/set_password/', {'current_password': 'testtest',
+                                                             'new_password': 'An0ther-passw0rd'})
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_cached_inactive_user_rejected(self):
+        self.user.is_active = False
+        token_users.set(self.token.key, self.user)
+        self.assertEqual(self.get_popularity().status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deleted_token_rejected(self):
+        self.get_popularity()
+        self.token.delete()
+        self.assertEqual(self.get_popularity().status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deactivated_user_rejected(self):
+        self.get_popularity()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get_popularity().status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_invalid_token_not_cached(self):
+        self.authorization = f'Token {WRONG_TOKEN_VALUE_GOOD_FORMAT}'
+        self.assertEqual(self.get_popularity().status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertIsNone(token_users.get(WRONG_TOKEN_VALUE_GOOD_FORMAT))
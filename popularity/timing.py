@@ -0,0 +1,119 @@
+import contextvars
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# Timings of request being served, visible in threads and coroutines of sync_to_async / async_to_sync.
+current_timings = contextvars.ContextVar('current_timings', default=None)
+
+TIMING_DESCRIPTIONS = {
+    'github': 'calls',
+    'db': 'queries',
+}
+
+
+class RequestTimings:
+    """Time spent by request in phases (github, db, auth, serialize) and count of timed calls of every phase."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.durations = Counter()
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        # Bulk lookups add Github calls from many threads at once.
+        with self._lock:
+            self.durations[name] += seconds
+            self.counts[name] += 1
+
+    @property
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self, total):
+        """Server-Timing header value, durations in milliseconds."""
+        metrics = []
+        for name, duration in self.durations.items():
+            description = TIMING_DESCRIPTIONS.get(name)
+            metric = f'{name};dur={duration * 1000:.1f}'
+            if description is not None:
+                metric += f';desc="{self.counts[name]} {description}"'
+            metrics.append(metric)
+        metrics.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(metrics)
+
+    def as_dict(self, total):
+        timings = {f'{name}_ms': round(duration * 1000, 1) for name, duration in self.durations.items()}
+        timings.update({f'{name}_{description}': self.counts[name]
+                        for name, description in TIMING_DESCRIPTIONS.items()})
+        timings['total_ms'] = round(total * 1000, 1)
+        return timings
+
+
+@contextmanager
+def timed(name):
+    """Add wall time of the block to phase `name` of the request being served, no-op outside of request."""
+    timings = current_timings.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - started)
+
+
+def time_query(execute, sql, params, many, context):
+    """Execute wrapper of db connections timing queries of request."""
+    with timed('db'):
+        return execute(sql, params, many, context)
+
+
+class StackSampler:
+    """
+    Sampling profiler. Single daemon thread records every `interval` seconds the stack of each watched thread,
+    so stacks seen most often show where slow request spent its time.
+    """
+    max_depth = 30
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._samples = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def watch(self, thread_id):
+        """Start sampling thread, returns key of this watch for unwatch."""
+        key = object()
+        with self._lock:
+            self._samples[key] = (thread_id, Counter())
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+                self._thread.start()
+        return key
+
+    def unwatch(self, key):
+        """Stop sampling of watch `key`, returns Counter of its stacks (outermost frame first)."""
+        with self._lock:
+            return self._samples.pop(key, (None, Counter()))[1]
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, samples in self._samples.values():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        samples[self.stack(frame)] += 1
+
+    def stack(self, frame):
+        stack = []
+        while frame is not None and len(stack) < self.max_depth:
+            stack.append(f'{frame.f_code.co_filename}:{frame.f_lineno} {frame.f_code.co_name}')
+            frame = frame.f_back
+        return tuple(reversed(stack))
@@ -1,4 +1,5 @@
 # Create a router and register our viewsets with it.
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
@@ -10,4 +11,11 @@ router.register(r'repos', views.RepoViewSet)
 # The API URLs are now determined automatically by the router.
 urlpatterns = [
     path('api/v1/', include(router.urls)),
+    path('api/v1/popularity/', views.PopularityView.as_view(), name='popularity'),
+    path('api/v1/webhooks/github/', views.GithubWebhookView.as_view(), name='github-webhook'),
 ]
+
+if settings.POPULARITY_ASYNC_VIEWS:
+    from popularity import async_views
+
+    urlpatterns.insert(0, path('api/v1/repos/<int:pk>/popular/', async_views.repo_popular, name='repo-popular'))
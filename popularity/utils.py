@@ -1,35 +1,610 @@
+import hashlib
+import math
+import contextvars
 import os
+import random
+import re
+import struct
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
 import requests
+from django.conf import settings
+from django.core.cache import caches
+from requests.adapters import HTTPAdapter
 from rest_framework import status
+from urllib3.util.retry import Retry
+
+from popularity.metrics import metrics, observed_github_call
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 POPULAR_REPO_RESULT = "popular"
 NOT_POPULAR_REPO_RESULT = "not popular"
 
+GithubRepoCounts = namedtuple('GithubRepoCounts', ['num_stars', 'num_forks', 'etag', 'last_modified', 'fetched_at'])
+
+
+class GithubRepoCache:
+    """
+    Cache of GitHub repo counts together with the validators (ETag / Last-Modified) of the response.
+    Entries younger than `ttl` seconds are served without asking GitHub. Older entries are revalidated with
+    a conditional request - 304 responses are not counted by GitHub against the rate limit.
+    Entries are kept in bounded in-process LRU and, with `cache_alias`, shared with other worker processes
+    through Django cache framework in compact binary format.
+    """
+    counts_format = struct.Struct('!IId')
+
+    def __init__(self, max_size, ttl, cache_alias=None, shared_timeout=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.cache_alias = cache_alias
+        self.shared_timeout = shared_timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+
+    @property
+    def shared(self):
+        return caches[self.cache_alias] if self.cache_alias else None
+
+    @staticmethod
+    def shared_key(repo_name):
+        return f"github:{hashlib.sha1(repo_name.encode()).hexdigest()}"
+
+    @classmethod
+    def pack(cls, entry):
+        return b'\0'.join([cls.counts_format.pack(entry.num_stars, entry.num_forks, entry.fetched_at),
+                            (entry.etag or '').encode(), (entry.last_modified or '').encode()])
+
+    @classmethod
+    def unpack(cls, value):
+        num_stars, num_forks, fetched_at = cls.counts_format.unpack_from(value)
+        etag, last_modified = value[cls.counts_format.size + 1:].split(b'\0')
+        return GithubRepoCounts(num_stars, num_forks, etag.decode() or None, last_modified.decode() or None,
+                                fetched_at)
+
+    def get(self, repo_name):
+        with self._lock:
+            entry = self._entries.get(repo_name)
+            if entry is not None:
+                self._entries.move_to_end(repo_name)
+        if self.shared is not None and (entry is None or not self.is_fresh(entry)):
+            value = self.shared.get(self.shared_key(repo_name))
+            shared_entry = self.unpack(value) if value is not None else None
+            if shared_entry is not None and (entry is None or shared_entry.fetched_at > entry.fetched_at):
+                entry = self._remember(repo_name, shared_entry)
+        return entry
+
+    def is_fresh(self, entry):
+        return time.time() - entry.fetched_at < self.ttl
+
+    def set(self, repo_name, num_stars, num_forks, etag=None, last_modified=None):
+        entry = self._remember(repo_name, GithubRepoCounts(num_stars, num_forks, etag, last_modified, time.time()))
+        if self.shared is not None:
+            self.shared.set(self.shared_key(repo_name), self.pack(entry), timeout=self.shared_timeout)
+        return entry
+
+    def _remember(self, repo_name, entry):
+        with self._lock:
+            self._entries[repo_name] = entry
+            self._entries.move_to_end(repo_name)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return entry
+
+    def touch(self, repo_name, entry):
+        """Mark entry as fresh again after GitHub confirmed it with 304 Not Modified."""
+        return self.set(repo_name, entry.num_stars, entry.num_forks, entry.etag, entry.last_modified)
+
+    def record(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def clear(self):
+        """
+        Forget entries of this process and their shared copies. Shared cache is used by auth tokens, locks and
+        webhook deliveries too, so only keys of this cache are deleted.
+        """
+        with self._lock:
+            repo_names = list(self._entries)
+            self._entries.clear()
+            self.hits = self.misses = self.revalidations = self.evictions = 0
+        if self.shared is not None and repo_names:
+            self.shared.delete_many([self.shared_key(repo_name) for repo_name in repo_names])
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'revalidations': self.revalidations,
+            'evictions': self.evictions,
+        }
+
+
+github_cache = GithubRepoCache(max_size=settings.GITHUB_CACHE_MAX_SIZE, ttl=settings.GITHUB_CACHE_TTL,
+                               cache_alias=settings.GITHUB_CACHE_ALIAS,
+                               shared_timeout=settings.GITHUB_CACHE_SHARED_TIMEOUT)
+
+
+class SingleFlightCall:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+    def result(self):
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls for the same key: the first caller runs the function, the others wait and share
+    its result or error. Leaders in many worker processes are serialized as well - by file lock in `lock_dir`
+    (single node) and/or by lock entry added to Django cache `lock_cache_alias` (many nodes), so a call could
+    pick up result cached by another process instead of repeating it.
+    """
+
+    def __init__(self, lock_dir=None, lock_cache_alias=None, lock_timeout=10):
+        self.lock_dir = lock_dir
+        self.lock_cache_alias = lock_cache_alias
+        self.lock_timeout = lock_timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function, *args):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = SingleFlightCall()
+        if not leader:
+            call.done.wait()
+            return call.result()
+        try:
+            with self._file_lock(key), self._cache_lock(key):
+                call.value = function(*args)
+        except Exception as error:
+            call.error = error
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result()
+
+    @staticmethod
+    def _digest(key):
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    @contextmanager
+    def _file_lock(self, key):
+        if self.lock_dir is None or fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.lock_dir, f"{self._digest(key)}.lock"), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _cache_lock(self, key):
+        if self.lock_cache_alias is None:
+            yield
+            return
+        cache, lock_key = caches[self.lock_cache_alias], f"single-flight:{self._digest(key)}"
+        deadline = time.monotonic() + self.lock_timeout
+        acquired = cache.add(lock_key, os.getpid(), timeout=self.lock_timeout)
+        while not acquired and time.monotonic() < deadline:
+            time.sleep(0.05)
+            acquired = cache.add(lock_key, os.getpid(), timeout=self.lock_timeout)
+        try:
+            yield
+        finally:
+            if acquired:
+                cache.delete(lock_key)
+
+
+github_single_flight = SingleFlight(lock_dir=settings.GITHUB_SINGLE_FLIGHT_LOCK_DIR,
+                                    lock_cache_alias=settings.GITHUB_SINGLE_FLIGHT_LOCK_CACHE_ALIAS,
+                                    lock_timeout=settings.GITHUB_READ_TIMEOUT)
+
+
+class GithubTokensExhausted(Exception):
+    """Every configured PERSONAL ACCESS TOKEN reached Github rate limit."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Github rate limit exhausted, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class GithubTokenPool:
+    """
+    Pool of PERSONAL ACCESS TOKENs from PERSONAL_ACCESS_TOKENS (comma separated) and PERSONAL_ACCESS_TOKEN env.
+    Rate limit of every token is tracked per Github resource (core, graphql) from X-RateLimit-* response headers.
+    Lookups go to the token with the most remaining budget, exhausted tokens are parked until their reset.
+    """
+    default_limit = 5000
+
+    def __init__(self):
+        self._limits = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def configured_tokens():
+        tokens = [token.strip() for token in (os.environ.get("PERSONAL_ACCESS_TOKENS") or '').split(',')
+                  if token.strip()]
+        personal_token = os.environ.get("PERSONAL_ACCESS_TOKEN")
+        if personal_token and personal_token not in tokens:
+            tokens.append(personal_token)
+        return tokens
+
+    def _budget(self, token, resource, now):
+        remaining, reset = self._limits.get((token, resource), (self.default_limit, 0))
+        if reset and reset <= now:
+            return self.default_limit, 0
+        return remaining, reset
+
+    def acquire(self, resource='core'):
+        """Return token with the most remaining budget. Raises GithubTokensExhausted if all tokens are parked."""
+        now = time.time()
+        with self._lock:
+            budgets = {token: self._budget(token, resource, now) for token in self.configured_tokens()}
+            available = {token: budget for token, budget in budgets.items() if budget[0] > 0}
+            if not available:
+                raise GithubTokensExhausted(self._seconds_to_reset(budgets.values(), now))
+            token = max(available, key=lambda available_token: available[available_token][0])
+            remaining, reset = available[token]
+            # Reserve budget upfront, so concurrent lookups are spread over tokens before headers come back.
+            self._limits[(token, resource)] = remaining - 1, reset
+            return token
+
+    def update(self, token, headers):
+        remaining, reset = headers.get('X-RateLimit-Remaining'), headers.get('X-RateLimit-Reset')
+        if remaining is None or reset is None:
+            return
+        resource = headers.get('X-RateLimit-Resource', 'core')
+        with self._lock:
+            self._limits[(token, resource)] = int(remaining), int(reset)
+
+    def retry_after(self, resource='core'):
+        """Seconds until the first parked token is usable again, None if any token still has budget."""
+        now = time.time()
+        with self._lock:
+            budgets = [self._budget(token, resource, now) for token in self.configured_tokens()]
+        if not budgets or any(remaining > 0 for remaining, _ in budgets):
+            return None
+        return self._seconds_to_reset(budgets, now)
+
+    @staticmethod
+    def _seconds_to_reset(budgets, now):
+        return max(1, int(min((reset for _, reset in budgets), default=now) - now) + 1)
+
+    def budgets(self, resource='core'):
+        """{last 4 chars of token: (remaining, reset)} of every configured token."""
+        now = time.time()
+        with self._lock:
+            return {token[-4:]: self._budget(token, resource, now) for token in self.configured_tokens()}
+
+    def stats(self):
+        with self._lock:
+            return {f'{token[-4:]}:{resource}': {'remaining': remaining, 'reset': reset}
+                    for (token, resource), (remaining, reset) in self._limits.items()}
+
+    def clear(self):
+        with self._lock:
+            self._limits.clear()
+
+
+github_token_pool = GithubTokenPool()
+
+
+def is_rate_limited(response):
+    return response.status_code in (status.HTTP_403_FORBIDDEN, status.HTTP_429_TOO_MANY_REQUESTS) and \
+        response.headers.get('X-RateLimit-Remaining') == '0'
+
+
+class GithubRetry(Retry):
+    """
+    Bounded retries of Github Rest Api calls with jittered exponential backoff.
+    403 is retried only when Github asks for it with Retry-After (secondary rate limit), never for exhausted token.
+    """
+
+    def get_backoff_time(self):
+        return random.uniform(0, super().get_backoff_time())
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, settings.GITHUB_RETRY_AFTER_MAX)
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if status_code == status.HTTP_403_FORBIDDEN and not has_retry_after:
+            return False
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+def build_github_session():
+    """Session keeping alive pooled connections to Github, so TCP+TLS handshakes are not paid on every lookup."""
+    retry = GithubRetry(total=settings.GITHUB_MAX_RETRIES,
+                        backoff_factor=settings.GITHUB_RETRY_BACKOFF_FACTOR,
+                        status_forcelist=[status.HTTP_403_FORBIDDEN, status.HTTP_429_TOO_MANY_REQUESTS,
+                                          status.HTTP_500_INTERNAL_SERVER_ERROR, status.HTTP_502_BAD_GATEWAY,
+                                          status.HTTP_503_SERVICE_UNAVAILABLE, status.HTTP_504_GATEWAY_TIMEOUT],
+                        allowed_methods=frozenset(['GET', 'POST']),
+                        raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=settings.GITHUB_POOL_CONNECTIONS,
+                          pool_maxsize=settings.GITHUB_POOL_MAXSIZE,
+                          max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+github_session = build_github_session()
+
 
 def get_github_api_response(repo_name):
-    personal_token = os.environ.get("PERSONAL_ACCESS_TOKEN")
-    if personal_token is None:
+    _status, info = fetch_github_repo(repo_name)
+    if _status != status.HTTP_200_OK:
+        return _status, info
+    return _status, calculate_popularity(num_stars=info.num_stars, num_forks=info.num_forks)
+
+
+def fetch_github_repo(repo_name, known=None):
+    """
+    Get stars and forks of repo from cache or Github Rest Api. Returns (status, GithubRepoCounts) on success,
+    (status, reason) otherwise. `known` counts stored elsewhere are revalidated with their ETag when not cached.
+    """
+    if not github_token_pool.configured_tokens():
         return status.HTTP_503_SERVICE_UNAVAILABLE, "PERSONAL ACCESS TOKEN not granted on server"
-    try:
-        response = requests.get(f'https://api.github.com/repos/{repo_name}',
-                                headers={'Authorization': f'Token {personal_token}'})
-    except OSError:
-        return status.HTTP_500_INTERNAL_SERVER_ERROR, "not proper value for PERSONAL ACCESS TOKEN"
+    cached = github_cache.get(repo_name)
+    if cached is not None and github_cache.is_fresh(cached):
+        github_cache.record('hits')
+        return status.HTTP_200_OK, cached
+    return github_single_flight.do(repo_name, _fetch_github_repo, repo_name, known)
+
+
+def _fetch_github_repo(repo_name, known):
+    cached = github_cache.get(repo_name)
+    if cached is not None and github_cache.is_fresh(cached):
+        # Filled while waiting for lookup of the same repo in another process.
+        github_cache.record('hits')
+        return status.HTTP_200_OK, cached
+    cached = cached or known
+    headers = conditional_headers(cached)
+    while True:
+        try:
+            personal_token = github_token_pool.acquire()
+        except GithubTokensExhausted:
+            return status.HTTP_503_SERVICE_UNAVAILABLE, "Github rate limit exhausted for all PERSONAL ACCESS TOKENs"
+        try:
+            with observed_github_call() as call:
+                response = github_session.get(f'{settings.GITHUB_API_URL}/repos/{repo_name}',
+                                              headers=dict(headers, Authorization=f'Token {personal_token}'),
+                                              timeout=(settings.GITHUB_CONNECT_TIMEOUT, settings.GITHUB_READ_TIMEOUT))
+                call['status'] = response.status_code
+        except requests.exceptions.Timeout:
+            return status.HTTP_504_GATEWAY_TIMEOUT, "Github Rest Api not responding in time"
+        except requests.exceptions.ConnectionError:
+            return status.HTTP_503_SERVICE_UNAVAILABLE, "Github Rest Api not reachable"
+        except OSError:
+            return status.HTTP_500_INTERNAL_SERVER_ERROR, "not proper value for PERSONAL ACCESS TOKEN"
+        github_token_pool.update(personal_token, response.headers)
+        if not is_rate_limited(response):
+            break
+    return github_repo_result(repo_name, cached, response)
+
+
+def conditional_headers(cached):
+    headers = {}
+    if cached is not None:
+        if cached.etag:
+            headers['If-None-Match'] = cached.etag
+        if cached.last_modified:
+            headers['If-Modified-Since'] = cached.last_modified
+    return headers
+
+
+def github_repo_result(repo_name, cached, response):
+    """Turn Github Rest Api response for repo into (status, GithubRepoCounts) or (status, reason), cache counts."""
+    if response.status_code == status.HTTP_304_NOT_MODIFIED and cached is not None:
+        github_cache.record('revalidations')
+        return status.HTTP_200_OK, github_cache.touch(repo_name, cached)
+    github_cache.record('misses')
     if response.status_code == status.HTTP_401_UNAUTHORIZED:
         return status.HTTP_503_SERVICE_UNAVAILABLE, "PERSONAL ACCESS TOKEN not authorizing with Github Rest Api"
     if response.status_code not in [status.HTTP_200_OK]:
-        return response.status_code, response.reason
+        # requests names it `reason`, httpx `reason_phrase`
+        return response.status_code, getattr(response, 'reason_phrase', None) or response.reason
     resp_json = response.json()
     _num_stars = resp_json['stargazers_count']
     _num_forks = resp_json['forks']
-    return response.status_code, calculate_popularity(num_stars=_num_stars, num_forks=_num_forks)
+    return response.status_code, github_cache.set(repo_name, _num_stars, _num_forks,
+                                                  etag=response.headers.get('ETag'),
+                                                  last_modified=response.headers.get('Last-Modified'))
+
+
+github_executor = ThreadPoolExecutor(max_workers=settings.GITHUB_BULK_MAX_WORKERS, thread_name_prefix='github')
+
+
+def bulk_get_github_api_response(repo_names):
+    """
+    Fan out lookups of many repos over bounded thread pool, so whole batch takes about the slowest lookup.
+    Returns {repo_name: (status, info)}. Failure of single lookup is reported only for its repo.
+    With GITHUB_BACKEND = 'graphql' repos are looked up in batches of GITHUB_GRAPHQL_BATCH_SIZE per request.
+    """
+    if settings.GITHUB_BACKEND == 'graphql':
+        return get_github_graphql_response(repo_names)
+    # Lookups run in context copied from the request, so their Github calls are timed with it.
+    futures = {repo_name: github_executor.submit(contextvars.copy_context().run, get_github_api_response, repo_name)
+               for repo_name in repo_names}
+    results = {}
+    for repo_name, future in futures.items():
+        try:
+            results[repo_name] = future.result()
+        except Exception:
+            results[repo_name] = status.HTTP_500_INTERNAL_SERVER_ERROR, "Github Rest Api response not processed"
+    return results
+
+
+def get_github_graphql_response(repo_names):
+    """Look up popularity of many repos with aliased Github GraphQL queries. Returns {repo_name: (status, info)}."""
+    results = {}
+    for repo_name, (_status, info) in fetch_github_graphql_repos(repo_names).items():
+        if _status == status.HTTP_200_OK:
+            info = calculate_popularity(num_stars=info.num_stars, num_forks=info.num_forks)
+        results[repo_name] = _status, info
+    return results
+
+
+def fetch_github_graphql_repos(repo_names):
+    """
+    Get stars and forks of many repos from cache or Github GraphQL Api, GITHUB_GRAPHQL_BATCH_SIZE repos per request.
+    Returns {repo_name: (status, GithubRepoCounts)} on success, {repo_name: (status, reason)} otherwise.
+    """
+    if not github_token_pool.configured_tokens():
+        return {repo_name: (status.HTTP_503_SERVICE_UNAVAILABLE, "PERSONAL ACCESS TOKEN not granted on server")
+                for repo_name in repo_names}
+    results = {}
+    to_fetch = []
+    for repo_name in repo_names:
+        cached = github_cache.get(repo_name)
+        if cached is not None and github_cache.is_fresh(cached):
+            github_cache.record('hits')
+            results[repo_name] = status.HTTP_200_OK, cached
+        else:
+            to_fetch.append(repo_name)
+    batch_size = settings.GITHUB_GRAPHQL_BATCH_SIZE
+    batches = [to_fetch[start:start + batch_size] for start in range(0, len(to_fetch), batch_size)]
+    futures = [(batch, github_executor.submit(contextvars.copy_context().run, _get_github_graphql_batch, batch))
+               for batch in batches]
+    for batch, future in futures:
+        try:
+            results.update(future.result())
+        except Exception:
+            results.update({repo_name: (status.HTTP_500_INTERNAL_SERVER_ERROR,
+                                        "Github GraphQL Api response not processed") for repo_name in batch})
+    return results
+
+
+def _get_github_graphql_batch(repo_names):
+    arguments, fields, variables = [], [], {}
+    for index, repo_name in enumerate(repo_names):
+        owner, _, name = repo_name.partition('/')
+        variables[f'owner{index}'], variables[f'name{index}'] = owner, name
+        arguments.append(f'$owner{index}: String!, $name{index}: String!')
+        fields.append(f'repo{index}: repository(owner: $owner{index}, name: $name{index}) {{ stargazerCount forkCount }}')
+    query = f"query({', '.join(arguments)}) {{ {' '.join(fields)} }}"
+
+    def same_for_all(_status, info):
+        return {repo_name: (_status, info) for repo_name in repo_names}
+
+    while True:
+        try:
+            personal_token = github_token_pool.acquire(resource='graphql')
+        except GithubTokensExhausted:
+            return same_for_all(status.HTTP_503_SERVICE_UNAVAILABLE,
+                                "Github rate limit exhausted for all PERSONAL ACCESS TOKENs")
+        try:
+            with observed_github_call() as call:
+                response = github_session.post(settings.GITHUB_GRAPHQL_URL,
+                                               json={'query': query, 'variables': variables},
+                                               headers={'Authorization': f'bearer {personal_token}'},
+                                               timeout=(settings.GITHUB_CONNECT_TIMEOUT, settings.GITHUB_READ_TIMEOUT))
+                call['status'] = response.status_code
+        except requests.exceptions.Timeout:
+            return same_for_all(status.HTTP_504_GATEWAY_TIMEOUT, "Github Rest Api not responding in time")
+        except requests.exceptions.ConnectionError:
+            return same_for_all(status.HTTP_503_SERVICE_UNAVAILABLE, "Github Rest Api not reachable")
+        except OSError:
+            return same_for_all(status.HTTP_500_INTERNAL_SERVER_ERROR, "not proper value for PERSONAL ACCESS TOKEN")
+        github_token_pool.update(personal_token, response.headers)
+        if not is_rate_limited(response):
+            break
+    if response.status_code == status.HTTP_401_UNAUTHORIZED:
+        return same_for_all(status.HTTP_503_SERVICE_UNAVAILABLE,
+                            "PERSONAL ACCESS TOKEN not authorizing with Github Rest Api")
+    if response.status_code != status.HTTP_200_OK:
+        return same_for_all(response.status_code, response.reason)
+    resp_json = response.json()
+    data = resp_json.get('data') or {}
+    errors = {error['path'][0]: error for error in resp_json.get('errors', []) if error.get('path')}
+    results = {}
+    for index, repo_name in enumerate(repo_names):
+        alias = f'repo{index}'
+        repo = data.get(alias)
+        if repo is not None:
+            github_cache.record('misses')
+            results[repo_name] = status.HTTP_200_OK, github_cache.set(repo_name, repo['stargazerCount'],
+                                                                      repo['forkCount'])
+        elif errors.get(alias, {}).get('type') == 'NOT_FOUND':
+            results[repo_name] = status.HTTP_404_NOT_FOUND, "Not Found"
+        else:
+            results[repo_name] = status.HTTP_502_BAD_GATEWAY, errors.get(alias, {}).get('message', "Not resolved")
+    return results
+
+
+# Github url or slashes before repo name, e.g. https://github.com/ of https://github.com/facebook/react/
+REPO_NAME_PREFIX = re.compile(r'^/*(?:https?://(?:www\.)?github\.com)?/*', re.IGNORECASE)
+
+# Github format of repo name: github_user/repo_name of letters, digits, "-", "_" and ".", but not "." or ".." alone
+GITHUB_REPO_NAME = re.compile(r'^(?!\.\.?/)[\w.-]+/(?!\.\.?$)[\w.-]+$', re.ASCII)
+
+
+def normalize_repo_name(name):
+    """Turn github url or path into github format of repo name e.g. https://github.com/facebook/react/ -> facebook/react"""
+    return REPO_NAME_PREFIX.sub('', name, count=1).rstrip("/")
+
+
+def repo_name_key(name):
+    """Normalized lower case repo name, Github names are case insensitive."""
+    return normalize_repo_name(name).lower()
+
+
+def refresh_interval(score, read_count):
+    """
+    Seconds between refreshes of repo stored popularity. Often read repos and repos with score close
+    to POPULARITY_THRESHOLD (where popularity could flip) are refreshed more often than cold or far from limit ones.
+    """
+    if score is None:
+        return 0
+    hotness = 1 + math.log1p(read_count)
+    distance = abs(score - settings.POPULARITY_THRESHOLD) / settings.POPULARITY_THRESHOLD
+    nearness = 1 + 4 / (1 + 10 * distance)
+    interval = settings.POPULARITY_REFRESH_MAX_INTERVAL / (hotness * nearness)
+    return max(settings.POPULARITY_REFRESH_MIN_INTERVAL, min(settings.POPULARITY_REFRESH_MAX_INTERVAL, interval))
+
+
+def calculate_score(num_stars, num_forks):
+    """Score = num_stars * POPULARITY_STARS_WEIGHT + num_forks * POPULARITY_FORKS_WEIGHT (1 and 2 by default)."""
+    return int(num_stars * settings.POPULARITY_STARS_WEIGHT + num_forks * settings.POPULARITY_FORKS_WEIGHT)
+
+
+def popularity_of_score(score):
+    return POPULAR_REPO_RESULT if score >= settings.POPULARITY_THRESHOLD else NOT_POPULAR_REPO_RESULT
 
 
 def calculate_popularity(num_stars, num_forks):
     """Calculate if GitHub repository is popular or not.
-     "popular" means the repo for which score >= 500 where score = num_stars * 1 + num_forks * 2."""
-    _popularity = NOT_POPULAR_REPO_RESULT
-    popularity_limit = 500
-    if (num_stars + num_forks * 2) >= popularity_limit:
-        _popularity = POPULAR_REPO_RESULT
+     "popular" means the repo for which score >= POPULARITY_THRESHOLD (500 by default)."""
+    _popularity = popularity_of_score(calculate_score(num_stars, num_forks))
+    metrics.inc('popularity_results_total', result=_popularity)
     return _popularity
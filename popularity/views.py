@@ -1,44 +1,254 @@
 # Create your views here.
-from django.http import HttpResponse
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
 from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from popularity.authentication import API_AUTHENTICATION_CLASSES
+from popularity.conditional import not_modified, with_validators, repo_validators, page_validators, \
+    popularity_validators
+from popularity.exports import export_rows, ndjson_lines, csv_lines
+from popularity.filters import RepoFilter, RepoOrderingFilter
+from popularity.health import github_readiness
+from popularity.history import repo_history
+from popularity.imports import RepoImport
+from popularity.metrics import metrics
+from popularity.models import Repo, STALE_WARNING, REVALIDATION_FAILED_WARNING
+from popularity.parsers import NDJSONParser, CSVParser
+from popularity.renderers import NDJSONRenderer, CSVRenderer
+from popularity.refresh import repo_reads, revalidate_in_background
+from popularity.serializers import RepoSerializer, RepoSerializerDetail, BulkPopularitySerializer, \
+    RepoExportFilterSerializer, RepoHistoryFilterSerializer, PopularityQuerySerializer, LeaderboardQuerySerializer
+from popularity.timing import timed
+from popularity.utils import get_github_api_response, bulk_get_github_api_response, normalize_repo_name, \
+    github_token_pool, repo_name_key, GITHUB_REPO_NAME, POPULAR_REPO_RESULT, NOT_POPULAR_REPO_RESULT
+from popularity.webhooks import verify_signature, repo_update, webhook_batcher
+
+
+def rate_limit_headers(_status):
+    """Retry-After for 503 caused by Github rate limit exhausted on every configured token."""
+    retry_after = github_token_pool.retry_after() if _status == status.HTTP_503_SERVICE_UNAVAILABLE else None
+    return {'Retry-After': str(retry_after)} if retry_after else {}
+
+
+WARNING_HEADERS = {
+    STALE_WARNING: '110 - "Response is Stale"',
+    REVALIDATION_FAILED_WARNING: '111 - "Revalidation Failed"',
+}
+
+
+def staleness_headers(lookup):
+    """Age of served popularity, Warning when it is stale."""
+    headers = {}
+    if lookup.age is not None:
+        headers['Age'] = str(lookup.age)
+    if lookup.warning is not None:
+        headers['Warning'] = WARNING_HEADERS[lookup.warning]
+    return headers
+
 
-from popularity.models import Repo
-from popularity.serializers import RepoSerializer, RepoSerializerDetail
-from popularity.utils import get_github_api_response
+class TimedAuthenticationMixin:
+    """Authentication time of request is reported in Server-Timing `auth`."""
 
+    def perform_authentication(self, request):
+        with timed('auth'):
+            super().perform_authentication(request)
 
-class RepoViewSet(viewsets.ModelViewSet):
+
+class RepoViewSet(TimedAuthenticationMixin, viewsets.ModelViewSet):
     """
     This viewset automatically provides `list`, `create`, `retrieve`,
     `update` and `destroy` actions.
     list:
     Post a github repo url as name to save repo.
     name could be sth like  https://github.com/facebook/create-react-app or facebook/create-react-app
+    Repos are paginated by cursor, filtered by name prefix (?name=facebook/) and popularity (?popularity=popular),
+    ordered by created (default), name or score (?ordering=-score).
     """
     queryset = Repo.objects.all()
+    authentication_classes = API_AUTHENTICATION_CLASSES
     permission_classes = (IsAuthenticated,)
+    filter_backends = [RepoFilter, RepoOrderingFilter]
+    ordering_fields = ['created', 'name', 'score']
+    ordering = ['created', 'id']
+
+    def list(self, request, *args, **kwargs):
+        """Page of repos, 304 Not Modified when none of them changed since conditional request of the client."""
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            repos, links = list(queryset), (None, None)
+        else:
+            repos, links = page, (self.paginator.get_next_link(), self.paginator.get_previous_link())
+        validators = page_validators(repos, *links)
+        response = not_modified(request, validators)
+        if response is not None:
+            return response
+        serializer = self.get_serializer(repos, many=True)
+        response = self.get_paginated_response(serializer.data) if page is not None else Response(serializer.data)
+        return with_validators(response, validators)
+
+    def retrieve(self, request, *args, **kwargs):
+        repo = self.get_object()
+        validators = repo_validators(repo)
+        response = not_modified(request, validators)
+        if response is not None:
+            return response
+        return with_validators(Response(self.get_serializer(repo).data), validators)
 
     @action(detail=True)
     def popular(self, request, *args, **kwargs):
         """
         GET endpoint for Api to score popularity of saved github repo.
-        Repo is popular if 1 * num_stars + 2 * num_forks >= 500.  Returns:  "popular" or "not popular"
+        Repo is popular if 1 * num_stars + 2 * num_forks >= 500 (weights and threshold are configurable).
+        Returns:  "popular" or "not popular"
+        Age header tells how old stored popularity is, Warning header is set when stale one is served.
         """
-        repo = self.get_object()
-        _status, info = repo.popular_status
-        return Response(info, _status)
+        return self.popularity_response(self.get_object())
+
+    @action(detail=False, url_path=r'by-name/(?P<owner>[^/]+)/(?P<name>[^/]+)/popular', url_name='popular-by-name')
+    def popular_by_name(self, request, owner, name, *args, **kwargs):
+        """
+        GET endpoint to score popularity of saved github repo by its name, e.g. /repos/by-name/facebook/react/popular/
+        Name is matched case insensitively. Answers as /repos/<id>/popular/.
+        """
+        repo = Repo.objects.filter(name_key=repo_name_key(f'{owner}/{name}')).order_by('id').first()
+        if repo is None:
+            raise NotFound()
+        self.check_object_permissions(request, repo)
+        return self.popularity_response(repo)
+
+    def popularity_response(self, repo):
+        repo_reads.record(repo.id)
+        lookup = repo.lookup_popularity()
+        if lookup.warning == STALE_WARNING:
+            revalidate_in_background(repo.id)
+        validators = popularity_validators(repo, lookup)
+        response = not_modified(self.request, validators)
+        if response is None:
+            response = Response(lookup.info, lookup.status)
+        for header, value in dict(rate_limit_headers(lookup.status), **staleness_headers(lookup)).items():
+            response[header] = value
+        return with_validators(response, validators)
+
+    @action(detail=False)
+    def leaderboard(self, request, *args, **kwargs):
+        """
+        GET endpoint ranking saved repos by score, the highest first: /repos/leaderboard/?limit=100
+        Ranking is kept by (score, id) index updated with every stored score, request reads only its top `limit`
+        entries instead of sorting repos. Repos with the same score share rank.
+        """
+        query = LeaderboardQuerySerializer(data=request.query_params.dict())
+        query.is_valid(raise_exception=True)
+        leaders = Repo.objects.filter(score__isnull=False).order_by('-score', '-id').values(
+            'id', 'name', 'stargazers_count', 'forks_count', 'score', 'popularity')[:query.validated_data['limit']]
+        ranked = []
+        for position, leader in enumerate(leaders, start=1):
+            same_score = ranked and ranked[-1]['score'] == leader['score']
+            ranked.append(dict(leader, rank=ranked[-1]['rank'] if same_score else position))
+        return Response(ranked)
+
+    @action(detail=True)
+    def history(self, request, *args, **kwargs):
+        """
+        GET endpoint with history of counts fetched from Github: raw samples of the last days, hourly and daily
+        ones before. Filters: since, until (ISO datetimes), resolution=raw|hour|day.
+        Returns samples with popularity, growth per day over the range and crossings of popularity threshold.
+        """
+        filters = RepoHistoryFilterSerializer(data=request.query_params.dict())
+        filters.is_valid(raise_exception=True)
+        return Response(repo_history(self.get_object(), **filters.validated_data))
+
+    @action(detail=False, methods=['post'], url_path='popular', url_name='popular-bulk')
+    def popular_bulk(self, request, *args, **kwargs):
+        """
+        POST endpoint for Api to score popularity of many repos at once. Accepts saved repo "ids" and/or "names".
+        Returns map of repo name: {"id", "status", "result"}. Failure of single repo does not fail the whole batch,
+        names not in github_user/repo_name format are reported as invalid without Github lookup.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        repo_ids = dict(Repo.objects.filter(pk__in=ids).values_list('name', 'id'))
+        results = {str(repo_id): {"id": repo_id, "status": status.HTTP_404_NOT_FOUND, "result": "Not found."}
+                   for repo_id in set(ids) - set(repo_ids.values())}
+        for name in serializer.validated_data['names']:
+            name = normalize_repo_name(name.strip())
+            if GITHUB_REPO_NAME.match(name):
+                repo_ids.setdefault(name, None)
+            else:
+                results[name] = {"id": None, "status": status.HTTP_400_BAD_REQUEST,
+                                 "result": "Repo name not in github_user/repo_name format."}
+        for name, (_status, info) in bulk_get_github_api_response(list(repo_ids)).items():
+            results[name] = {"id": repo_ids[name], "status": _status, "result": info}
+        return Response(results)
+
+    @action(detail=False, methods=['post'], url_path='import', url_name='import',
+            parser_classes=[NDJSONParser, CSVParser])
+    def import_repos(self, request, *args, **kwargs):
+        """
+        POST endpoint to save many repos at once. Body is newline delimited JSON (application/x-ndjson) of names
+        or {"name": ...} objects, or CSV (text/csv) with "name" column. Body is streamed and saved in batches.
+        Returns counts of inserted, skipped (saved already) and invalid names with first errors.
+        """
+        rows = request.data if not isinstance(request.data, dict) else []
+        return Response(RepoImport().run(rows))
+
+    @action(detail=False, url_path='export', url_name='export', renderer_classes=[NDJSONRenderer, CSVRenderer])
+    def export(self, request, *args, **kwargs):
+        """
+        GET endpoint streaming all saved repos with name, github_url, stored counts and popularity as newline
+        delimited JSON (default) or CSV (?format=csv or Accept: text/csv). Repos are read from db in chunks.
+        Filters: popular=true|false, updated_since=<ISO datetime> of popularity fetched from Github.
+        """
+        filters = RepoExportFilterSerializer(data=request.query_params.dict())
+        filters.is_valid(raise_exception=True)
+        repos = Repo.objects.all()
+        if 'popular' in filters.validated_data:
+            repos = repos.filter(popularity=POPULAR_REPO_RESULT if filters.validated_data['popular']
+                                 else NOT_POPULAR_REPO_RESULT)
+        if 'updated_since' in filters.validated_data:
+            repos = repos.filter(popularity_fetched_at__gte=filters.validated_data['updated_since'])
+        renderer = request.accepted_renderer
+        lines = csv_lines if renderer.format == 'csv' else ndjson_lines
+        response = StreamingHttpResponse(lines(export_rows(repos)), content_type=f'{renderer.media_type}; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="repos.{renderer.format}"'
+        return response
 
     def get_serializer_class(self):
         if self.action == 'list':
             return RepoSerializer
+        if self.action == 'popular_bulk':
+            return BulkPopularitySerializer
         else:
             return RepoSerializerDetail
 
 
+class PopularityView(TimedAuthenticationMixin, APIView):
+    """
+    GET endpoint to score popularity of any github repo, saved or not: /api/v1/popularity/?repo=facebook/react
+    Counts are served from Github repo cache shared by worker processes, Github is asked only on cache miss.
+    """
+    authentication_classes = API_AUTHENTICATION_CLASSES
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request, *args, **kwargs):
+        query = PopularityQuerySerializer(data=request.query_params.dict())
+        query.is_valid(raise_exception=True)
+        _status, info = get_github_api_response(query.validated_data['repo'])
+        return Response(info, _status, headers=rate_limit_headers(_status))
+
+
 class HealthCheckView(View):
     """
     Checks to see if the service is healthy. Check if communication with Api Github Api is working.
@@ -54,4 +264,76 @@ class HealthCheckView(View):
         _status, _ = get_github_api_response(test_repo)
         if _status == status.HTTP_200_OK:
             return HttpResponse("ok")
-        return HttpResponse("Not ok", status=_status)
+        response = HttpResponse("Not ok", status=_status)
+        for header, value in rate_limit_headers(_status).items():
+            response[header] = value
+        return response
+
+
+class LivenessView(View):
+    """
+    Liveness probe. Answers while the process serves requests, neither Github nor db are asked.
+    """
+
+    @staticmethod
+    def get(request, *args, **kwargs):
+        return JsonResponse({'status': 'ok'})
+
+
+class ReadinessView(View):
+    """
+    Readiness probe without spending Github rate limit. Github status is taken from recent real lookups or from
+    Github /rate_limit probed at most every POPULARITY_READINESS_PROBE_INTERVAL seconds.
+    Reports Github latency and remaining rate limit, answers 503 when Github fails or rate limit is exhausted.
+    """
+
+    @staticmethod
+    def get(request, *args, **kwargs):
+        ready, payload = github_readiness.check()
+        _status = status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE
+        response = JsonResponse(payload, status=_status)
+        for header, value in rate_limit_headers(_status).items():
+            response[header] = value
+        return response
+
+
+class MetricsView(View):
+    """
+    Metrics of all worker processes in Prometheus text exposition format: Github calls latency by status,
+    rate limit of tokens, lookups cache, popularity results and requests latency by DRF action.
+    """
+
+    @staticmethod
+    def get(request, *args, **kwargs):
+        return HttpResponse(metrics.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class GithubWebhookView(View):
+    """
+    Receiver of Github webhooks signed with GITHUB_WEBHOOK_SECRET. star, fork and repository events of saved repos
+    are queued and coalesced, so bursts of events end in single write per repo. Redelivered events are ignored.
+    """
+
+    @staticmethod
+    def post(request, *args, **kwargs):
+        if not verify_signature(settings.GITHUB_WEBHOOK_SECRET, request.body,
+                                request.headers.get('X-Hub-Signature-256')):
+            return JsonResponse({'detail': "Invalid signature."}, status=status.HTTP_403_FORBIDDEN)
+        event = request.headers.get('X-GitHub-Event')
+        if event == 'ping':
+            return JsonResponse({'status': 'pong'})
+        try:
+            payload = json.loads(request.body)
+        except ValueError:
+            return JsonResponse({'detail': "Not valid JSON."}, status=status.HTTP_400_BAD_REQUEST)
+        update = repo_update(event, payload) if isinstance(payload, dict) else None
+        if update is None:
+            return JsonResponse({'status': 'ignored'})
+        # Only accepted deliveries are remembered, redelivery of rejected one is processed again.
+        delivery = request.headers.get('X-GitHub-Delivery')
+        if delivery and not caches[settings.GITHUB_CACHE_ALIAS].add(f'github:delivery:{delivery}', 1,
+                                                                    timeout=settings.GITHUB_CACHE_SHARED_TIMEOUT):
+            return JsonResponse({'status': 'duplicate'})
+        webhook_batcher.add(*update)
+        return JsonResponse({'status': 'queued'}, status=status.HTTP_202_ACCEPTED)
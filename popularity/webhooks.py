@@ -0,0 +1,108 @@
+import atexit
+import hashlib
+import hmac
+import threading
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from popularity.models import Repo
+from popularity.utils import github_cache, repo_name_key
+
+# Events changing counts of repo, every one carries the repository with its current counts.
+COUNTED_EVENTS = ('star', 'fork', 'repository')
+
+
+def verify_signature(secret, body, signature):
+    """X-Hub-Signature-256 header is HMAC SHA-256 of request body keyed with webhook secret."""
+    if not secret or not signature:
+        return False
+    expected = 'sha256=' + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+def repo_update(event, payload):
+    """
+    (repo name key, stars, forks, stars delta, forks delta) of webhook event, None for events not changing counts.
+    Stars / forks are counts of repository in payload (None when missing), deltas are changes made by the event.
+    """
+    repository = payload.get('repository') or {}
+    name = repository.get('full_name')
+    if event not in COUNTED_EVENTS or not name:
+        return None
+    stars_delta = forks_delta = 0
+    if event == 'star':
+        stars_delta = {'created': 1, 'deleted': -1}.get(payload.get('action'), 0)
+    elif event == 'fork':
+        forks_delta = 1
+    return (repo_name_key(name), repository.get('stargazers_count'), repository.get('forks_count'),
+            stars_delta, forks_delta)
+
+
+class WebhookBatcher:
+    """
+    Queue coalescing webhook updates of repo, flushed at most `flush_interval` seconds after the first queued one
+    or once `max_pending` repos are queued. Counts of repository in payload replace the queued ones, deltas are
+    summed up and applied when payload lacks counts. Every repo is written once per flush: stored popularity,
+    history sample and Github cache, so lookups see the new counts without asking Github.
+    """
+
+    def __init__(self, flush_interval, max_pending):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def add(self, name, num_stars, num_forks, stars_delta, forks_delta):
+        with self._lock:
+            queued = self._pending.get(name, (None, None, 0, 0))
+            self._pending[name] = (
+                num_stars if num_stars is not None else queued[0],
+                num_forks if num_forks is not None else queued[1],
+                0 if num_stars is not None else queued[2] + stars_delta,
+                0 if num_forks is not None else queued[3] + forks_delta,
+            )
+            flush_now = len(self._pending) >= self.max_pending
+            if not flush_now and self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self._flush_in_background)
+                self._timer.daemon = True
+                self._timer.start()
+        if flush_now:
+            self.flush()
+
+    def _flush_in_background(self):
+        try:
+            self.flush()
+        finally:
+            connection.close()
+
+    def flush(self):
+        """Write queued updates of tracked repos. Returns amount of updated repos."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not pending:
+            return 0
+        watched_at = timezone.now()
+        repos = Repo.objects.filter(name_key__in=list(pending))
+        for repo in repos:
+            num_stars, num_forks, stars_delta, forks_delta = pending[repo.name_key]
+            num_stars = max(0, (num_stars if num_stars is not None else repo.stargazers_count or 0) + stars_delta)
+            num_forks = max(0, (num_forks if num_forks is not None else repo.forks_count or 0) + forks_delta)
+            repo.update_popularity(num_stars=num_stars, num_forks=num_forks, watched_at=watched_at)
+            for repo_name in {repo.name, repo.name_key}:
+                github_cache.set(repo_name, num_stars, num_forks)
+        return len(repos)
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+
+webhook_batcher = WebhookBatcher(flush_interval=settings.POPULARITY_WEBHOOK_FLUSH_INTERVAL,
+                                 max_pending=settings.POPULARITY_WEBHOOK_MAX_PENDING)
+atexit.register(webhook_batcher.flush)
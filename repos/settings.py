@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'popularity.middleware.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -101,13 +103,243 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 REST_FRAMEWORK = {
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'popularity.pagination.KeysetPagination',
     'PAGE_SIZE': 10,
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework.authentication.TokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ),
     'DEFAULT_SCHEMA_CLASS': 'rest_framework.schemas.coreapi.AutoSchema',
+    'DEFAULT_RENDERER_CLASSES': (
+        'popularity.renderers.TimedJSONRenderer',
+        'popularity.renderers.TimedBrowsableAPIRenderer',
+    ),
+}
+
+# Github Rest Api client
+# Connections are pooled and kept alive. Timeouts are in seconds, 5xx and secondary rate limits are retried.
+
+GITHUB_API_URL = 'https://api.github.com'
+
+GITHUB_CONNECT_TIMEOUT = 3.05
+
+GITHUB_READ_TIMEOUT = 5
+
+GITHUB_POOL_CONNECTIONS = 4
+
+GITHUB_POOL_MAXSIZE = 32
+
+GITHUB_MAX_RETRIES = 2
+
+GITHUB_RETRY_BACKOFF_FACTOR = 0.3
+
+GITHUB_RETRY_AFTER_MAX = 5
+
+# Bulk popularity lookups are spread over GITHUB_BULK_MAX_WORKERS threads.
+# GITHUB_BACKEND = 'graphql' looks up bulk calls with up to GITHUB_GRAPHQL_BATCH_SIZE repos per GraphQL request.
+
+GITHUB_BACKEND = 'rest'
+
+GITHUB_GRAPHQL_URL = 'https://api.github.com/graphql'
+
+GITHUB_GRAPHQL_BATCH_SIZE = 100
+
+GITHUB_BULK_MAX_WORKERS = 16
+
+GITHUB_BULK_MAX_REPOS = 500
+
+# Github Rest Api lookups cache
+# Entries younger than GITHUB_CACHE_TTL seconds are served from cache, older ones are revalidated with ETag.
+# GITHUB_CACHE_MAX_SIZE entries are kept in memory of every process, all of them are shared by processes
+# in GITHUB_CACHE_ALIAS cache for GITHUB_CACHE_SHARED_TIMEOUT seconds.
+
+GITHUB_CACHE_TTL = 60
+
+GITHUB_CACHE_MAX_SIZE = 10000
+
+GITHUB_CACHE_ALIAS = 'default'
+
+GITHUB_CACHE_SHARED_TIMEOUT = 24 * 60 * 60
+
+# Concurrent lookups of the same repo wait for one Github call. Lookups of many worker processes are coalesced
+# by lock files in GITHUB_SINGLE_FLIGHT_LOCK_DIR (single node) or lock entries in cache (many nodes).
+# Lock entries need cache with atomic add (memcached, redis, database). Add of the default file based cache is not
+# atomic, there two processes may take the lock at once and call Github twice.
+
+GITHUB_SINGLE_FLIGHT_LOCK_DIR = None
+
+GITHUB_SINGLE_FLIGHT_LOCK_CACHE_ALIAS = 'default'
+
+# Cache shared by worker processes. Default file based cache is enough for single node.
+# For many nodes point all of them to memcached, e.g.
+# POPULARITY_CACHE_BACKEND=django.core.cache.backends.memcached.MemcachedCache
+# POPULARITY_CACHE_LOCATION=10.0.0.5:11211
+# Single-flight lock entries, history roll up lock and deduplication of webhook deliveries rely on atomic add.
+# File based cache does not provide it, they are best effort with it: use memcached for exactly once behaviour.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('POPULARITY_CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.environ.get('POPULARITY_CACHE_LOCATION', str(BASE_DIR / '.cache')),
+        'KEY_PREFIX': 'popularity',
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
+    }
+}
+
+# Users of auth tokens are cached for POPULARITY_AUTH_CACHE_TTL seconds in GITHUB_CACHE_ALIAS cache shared by worker
+# processes and for POPULARITY_AUTH_CACHE_LOCAL_TTL seconds in bounded in-process LRU of POPULARITY_AUTH_CACHE_MAX_SIZE
+# tokens. Deleted tokens and deactivated users are rejected by other processes at most local TTL later.
+# Only repo and popularity Api (popularity.authentication.API_AUTHENTICATION_CLASSES) uses the cache, auth/ routes
+# changing users resolve tokens from db.
+
+POPULARITY_AUTH_CACHE_TTL = 5 * 60
+
+POPULARITY_AUTH_CACHE_LOCAL_TTL = 5
+
+POPULARITY_AUTH_CACHE_MAX_SIZE = 10000
+
+# Repo list and detail responses carry ETag and Last-Modified, clients and reverse proxies reuse them for
+# POPULARITY_REPO_CACHE_MAX_AGE seconds and revalidate them later (304 Not Modified skips serialization).
+# /popular/ responses are reusable while stored popularity is younger than POPULARITY_MAX_AGE.
+
+POPULARITY_REPO_CACHE_MAX_AGE = 0
+
+# Repo is popular when num_stars * POPULARITY_STARS_WEIGHT + num_forks * POPULARITY_FORKS_WEIGHT
+# >= POPULARITY_THRESHOLD. After change of them run python manage.py score_repos --apply to rescore stored repos.
+
+POPULARITY_STARS_WEIGHT = 1
+
+POPULARITY_FORKS_WEIGHT = 2
+
+POPULARITY_THRESHOLD = 500
+
+# /api/v1/repos/leaderboard/ lists at most POPULARITY_LEADERBOARD_MAX_LIMIT repos with the highest score.
+
+POPULARITY_LEADERBOARD_MAX_LIMIT = 1000
+
+# Popularity stored on Repo is served without asking Github while younger than POPULARITY_MAX_AGE seconds
+
+POPULARITY_MAX_AGE = 300
+
+# Stale popularity is served POPULARITY_STALE_WHILE_REVALIDATE seconds past max age while refreshed in background
+# and POPULARITY_STALE_IF_ERROR seconds past max age when Github fails or rate limit is exhausted.
+
+POPULARITY_STALE_WHILE_REVALIDATE = 60 * 60
+
+POPULARITY_STALE_IF_ERROR = 24 * 60 * 60
+
+POPULARITY_REVALIDATION_WORKERS = 4
+
+# Under ASGI (repos/asgi.py sets POPULARITY_ASYNC_VIEWS=1) /popular/ of single repo and health check are served
+# by native async views, Github is then called with httpx.AsyncClient.
+
+POPULARITY_ASYNC_VIEWS = os.environ.get('POPULARITY_ASYNC_VIEWS') == '1'
+
+# refresh_popularity worker uses at most POPULARITY_REFRESH_BUDGET_FRACTION of hourly Github rate limit.
+# Repos are refreshed every MIN..MAX_INTERVAL seconds - often read and near popularity limit ones more often.
+# Workers lease batches of POPULARITY_REFRESH_BATCH_SIZE repos, so many of them could run side by side.
+
+POPULARITY_REFRESH_BUDGET_FRACTION = 0.5
+
+POPULARITY_REFRESH_MIN_INTERVAL = 60
+
+POPULARITY_REFRESH_MAX_INTERVAL = 24 * 60 * 60
+
+POPULARITY_REFRESH_BATCH_SIZE = 50
+
+POPULARITY_READS_FLUSH_INTERVAL = 30
+
+# Github webhooks (star, fork and repository events) signed with GITHUB_WEBHOOK_SECRET update stored counts.
+# Events are coalesced per repo and written at most POPULARITY_WEBHOOK_FLUSH_INTERVAL seconds later or once
+# POPULARITY_WEBHOOK_MAX_PENDING repos are queued. Repos with events within POPULARITY_WEBHOOK_WATCH_PERIOD seconds
+# are served from stored counts without polling Github.
+
+GITHUB_WEBHOOK_SECRET = os.environ.get('GITHUB_WEBHOOK_SECRET')
+
+POPULARITY_WEBHOOK_FLUSH_INTERVAL = 1
+
+POPULARITY_WEBHOOK_MAX_PENDING = 500
+
+POPULARITY_WEBHOOK_WATCH_PERIOD = 7 * 24 * 60 * 60
+
+# Every count fetched from Github is kept as history sample. Raw samples are rolled up to hourly after
+# POPULARITY_HISTORY_RAW_RETENTION seconds, hourly ones to daily after POPULARITY_HISTORY_HOURLY_RETENTION,
+# daily ones are deleted after POPULARITY_HISTORY_DAILY_RETENTION. refresh_popularity workers roll up
+# every POPULARITY_HISTORY_ROLLUP_INTERVAL seconds, POPULARITY_HISTORY_ROLLUP_BATCH_SIZE repos per transaction.
+# Roll ups of all workers are serialized by lock entry in GITHUB_CACHE_ALIAS cache.
+
+POPULARITY_HISTORY_RAW_RETENTION = 2 * 24 * 60 * 60
+
+POPULARITY_HISTORY_HOURLY_RETENTION = 30 * 24 * 60 * 60
+
+POPULARITY_HISTORY_DAILY_RETENTION = 3 * 365 * 24 * 60 * 60
+
+POPULARITY_HISTORY_ROLLUP_INTERVAL = 60 * 60
+
+POPULARITY_HISTORY_ROLLUP_BATCH_SIZE = 200
+
+# Bulk import of repos inserts POPULARITY_IMPORT_BATCH_SIZE names per transaction.
+
+POPULARITY_IMPORT_BATCH_SIZE = 500
+
+# Export of repos reads POPULARITY_EXPORT_CHUNK_SIZE rows at once from db cursor.
+
+POPULARITY_EXPORT_CHUNK_SIZE = 2000
+
+# /health/ready/ reuses outcome of real Github calls younger than POPULARITY_READINESS_TRAFFIC_MAX_AGE seconds.
+# Without such traffic Github /rate_limit (not counted against rate limit) is probed at most every
+# POPULARITY_READINESS_PROBE_INTERVAL seconds by all processes sharing GITHUB_CACHE_ALIAS cache.
+
+POPULARITY_READINESS_TRAFFIC_MAX_AGE = 60
+
+POPULARITY_READINESS_PROBE_INTERVAL = 30
+
+# Every response has Server-Timing header (github, db, auth, serialize, total) and is logged as JSON line by
+# 'popularity.timing' logger at INFO, requests slower than POPULARITY_SLOW_REQUEST_THRESHOLD seconds at WARNING.
+# With POPULARITY_PROFILE_SLOW_REQUESTS=1 stacks of POPULARITY_PROFILE_SAMPLE_RATE of requests are sampled every
+# POPULARITY_PROFILE_INTERVAL seconds, the hottest ones of slow requests are logged by 'popularity.profile' logger.
+
+POPULARITY_SLOW_REQUEST_THRESHOLD = 1.0
+
+POPULARITY_PROFILE_SLOW_REQUESTS = os.environ.get('POPULARITY_PROFILE_SLOW_REQUESTS') == '1'
+
+POPULARITY_PROFILE_SAMPLE_RATE = 1.0
+
+POPULARITY_PROFILE_INTERVAL = 0.005
+
+POPULARITY_PROFILE_TOP_STACKS = 5
+
+# /metrics exposes Prometheus text format. Every worker process saves its metrics every
+# POPULARITY_METRICS_FLUSH_INTERVAL seconds to POPULARITY_METRICS_DIR, so /metrics of any of them aggregates all.
+# Without POPULARITY_METRICS_DIR metrics of the serving process only are exposed (single process deployment).
+
+POPULARITY_METRICS_DIR = os.environ.get('POPULARITY_METRICS_DIR')
+
+POPULARITY_METRICS_FLUSH_INTERVAL = 10
+
+# Counters and histograms of exited processes are kept in aggregate snapshot, so totals never go down. Gauges of
+# snapshots not flushed for POPULARITY_METRICS_SNAPSHOT_MAX_AGE seconds (hung or idle processes) are left out.
+
+POPULARITY_METRICS_SNAPSHOT_MAX_AGE = 5 * 60
+
+# POPULARITY_LOG_LEVEL=INFO logs timings of every request, not only of slow ones.
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'popularity': {
+            'handlers': ['console'],
+            'level': os.environ.get('POPULARITY_LOG_LEVEL', 'WARNING'),
+        },
+    },
 }
 
 # Internationalization
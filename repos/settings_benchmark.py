@@ -0,0 +1,34 @@
+"""
+Settings of servers started by benchmarks/run.py: own database and cache, Github replaced by local fake.
+"""
+from repos.settings import *  # noqa: F401,F403
+from repos.settings import os, DATABASES, CACHES, INSTALLED_APPS
+
+DEBUG = False
+
+ALLOWED_HOSTS = ['127.0.0.1', 'localhost']
+
+# Counts db queries of server process, exposed to benchmark driver at /benchmark/stats/
+
+INSTALLED_APPS = INSTALLED_APPS + ['benchmarks.apps.BenchmarksConfig']
+
+ROOT_URLCONF = 'benchmarks.urls'
+
+DATABASES['default']['NAME'] = os.environ['BENCHMARK_DATABASE']
+DATABASES['default']['OPTIONS'] = {'timeout': 30}
+
+CACHES['default']['LOCATION'] = os.environ['BENCHMARK_CACHE_DIR']
+
+GITHUB_API_URL = os.environ['BENCHMARK_GITHUB_URL']
+
+GITHUB_GRAPHQL_URL = f'{GITHUB_API_URL}/graphql'
+
+# By default every lookup goes to (fake) Github, so servers are compared on waiting for upstream.
+
+GITHUB_CACHE_TTL = int(os.environ.get('BENCHMARK_GITHUB_CACHE_TTL', 0))
+
+POPULARITY_MAX_AGE = int(os.environ.get('BENCHMARK_POPULARITY_MAX_AGE', 0))
+
+POPULARITY_STALE_WHILE_REVALIDATE = int(os.environ.get('BENCHMARK_POPULARITY_STALE_WHILE_REVALIDATE', 0))
+
+POPULARITY_READS_FLUSH_INTERVAL = 60 * 60
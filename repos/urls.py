@@ -13,6 +13,7 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include, re_path
 from drf_yasg import openapi
@@ -44,4 +45,12 @@ urlpatterns = [
     path(r'auth/', include('djoser.urls')),
     path('', include('popularity.urls')),
     path(r'health_check/', views.HealthCheckView.as_view()),
+    path(r'health/live/', views.LivenessView.as_view()),
+    path(r'health/ready/', views.ReadinessView.as_view()),
+    path(r'metrics', views.MetricsView.as_view()),
 ]
+
+if settings.POPULARITY_ASYNC_VIEWS:
+    from popularity import async_views
+
+    urlpatterns.insert(0, path(r'health_check/', async_views.health_check))